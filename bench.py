@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+import argparse
+import copy
+import io
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from constants import emitted_pseudo_ops
+from emit_utils import EmitContext
+from parse import generate, load_backend
+from shared_utils import (
+    OPCODES_DIR,
+    InstrDict,
+    OverlapIndex,
+    add_segmented_vls_insn,
+    create_inst_dict,
+    extension_file_names,
+    log_and_exit,
+    process_imported_instructions,
+    process_pseudo_instructions,
+    process_standard_instructions,
+    read_lines,
+)
+from synthetic_utils import synthesize_isa, write_isa
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# File filters timed end to end by the parse.* benchmarks.
+PARSE_FILTERS = {
+    "rv": ["rv*"],
+    "unratified": ["unratified/rv*"],
+    "all": ["rv*", "unratified/rv*"],
+}
+
+# Extensions of the backend.rvc_lut benchmark: a lookup table decodes one
+# configuration, without Zcmp and Zcmt as they exclude Zcd (see make rvc_lut).
+RVC_LUT_FILTER = ["rv*_c*", "rv*_zcb", "rv_zcmop"]
+
+# Instruction counts of the synthetic ISAs timed by --scaling.
+SCALING_SIZES = "1000,10000,100000"
+
+# Translation units preprocessed by the cpp.* benchmarks: the whole
+# encoding.out.h versus the split headers of a few extensions. Both expand the
+# DECLARE_INSN and DECLARE_CSR lists like simulators do.
+HEADER_UNITS = {
+    "cpp.umbrella": ["encoding.out.h"],
+    "cpp.split": [
+        "encoding/csr.h",
+        "encoding/rv_i.h",
+        "encoding/rv_m.h",
+        "encoding/rv_c.h",
+        "encoding/rv_zicsr.h",
+    ],
+}
+
+# Statistics compared against the baseline by --compare.
+COMPARED_METRICS = ("median", "peak_memory")
+DEFAULT_THRESHOLD = 0.10
+
+# A benchmark is a (setup, run) pair: setup prepares fresh input for every
+# run and is not part of the measurement.
+Setup = Callable[[], Any]
+Run = Callable[[Any], Any]
+Benchmark = Tuple[Setup, Run]
+Stats = Dict[str, float]
+
+
+def measure(setup: Setup, run: Run, warmup: int = 1, repeat: int = 5) -> Stats:
+    """
+    Time run(setup()) repeat times after warmup untimed runs and return the
+    statistics in seconds. The peak memory (in bytes) is measured with
+    tracemalloc in one extra run, so tracing does not distort the timings.
+    """
+    for _ in range(warmup):
+        run(setup())
+
+    times: "list[float]" = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "peak_memory": peak,
+        "warmup": warmup,
+        "repeat": repeat,
+    }
+
+
+def parse_standard(file_names: "list[str]") -> InstrDict:
+    """First pass of create_inst_dict: standard instructions."""
+    instr_dict: InstrDict = {}
+    overlap_index = OverlapIndex()
+    for file_name in file_names:
+        lines = read_lines(file_name)
+        process_standard_instructions(lines, instr_dict, file_name, overlap_index)
+    return instr_dict
+
+
+def parse_pseudo(
+    file_names: "list[str]", instr_dict: InstrDict, opcodes_dir: str
+) -> InstrDict:
+    """Second pass of create_inst_dict: pseudo instructions."""
+    for file_name in file_names:
+        lines = read_lines(file_name)
+        process_pseudo_instructions(
+            lines, instr_dict, file_name, opcodes_dir, False, []
+        )
+    return instr_dict
+
+
+def parse_imported(
+    file_names: "list[str]", instr_dict: InstrDict, opcodes_dir: str
+) -> InstrDict:
+    """Third pass of create_inst_dict: imported instructions."""
+    for file_name in file_names:
+        lines = read_lines(file_name)
+        process_imported_instructions(lines, instr_dict, file_name, opcodes_dir)
+    return instr_dict
+
+
+def copying(value: Any) -> Setup:
+    """Setup handing every run its own deep copy of value."""
+    return lambda: copy.deepcopy(value)
+
+
+def writing(backend: str, binary: bool, *args: Any) -> Benchmark:
+    """Benchmark writing a backend's output to an in-memory file."""
+    write = load_backend(backend)
+
+    def setup() -> Any:
+        return io.BytesIO() if binary else io.StringIO()
+
+    return setup, lambda out: write(*args, out)
+
+
+def parse_benchmarks(
+    file_filter: "list[str]", opcodes_dir: str
+) -> "Dict[str, Benchmark]":
+    """Benchmarks of the individual create_inst_dict passes over file_filter."""
+    file_names = extension_file_names(file_filter, opcodes_dir)
+    standard = parse_standard(file_names)
+    pseudo = parse_pseudo(file_names, copy.deepcopy(standard), opcodes_dir)
+    return {
+        "phase.standard": (lambda: file_names, parse_standard),
+        "phase.pseudo": (
+            copying(standard),
+            lambda d: parse_pseudo(file_names, d, opcodes_dir),
+        ),
+        "phase.import": (
+            copying(pseudo),
+            lambda d: parse_imported(file_names, d, opcodes_dir),
+        ),
+    }
+
+
+def backend_benchmarks(
+    file_filter: "list[str]", opcodes_dir: str
+) -> "Dict[str, Benchmark]":
+    """
+    Benchmarks of add_segmented_vls_insn and of every backend writing its
+    output for file_filter, mirroring parse.emit_outputs.
+    """
+    instr_dict = dict(
+        sorted(create_inst_dict(file_filter, opcodes_dir=opcodes_dir).items())
+    )
+    instr_dict_c = dict(
+        sorted(
+            create_inst_dict(
+                file_filter,
+                include_pseudo_ops=emitted_pseudo_ops,
+                opcodes_dir=opcodes_dir,
+            ).items()
+        )
+    )
+    rvc_dict = create_inst_dict(RVC_LUT_FILTER, opcodes_dir=opcodes_dir)
+    benchmarks: "Dict[str, Benchmark]" = {
+        "add_segmented_vls_insn": (copying(instr_dict), add_segmented_vls_insn)
+    }
+    # add_segmented_vls_insn updates instr_dict in place, as in parse.py
+    expanded = add_segmented_vls_insn(instr_dict)
+    ctx = EmitContext(instr_dict)
+    ctx_c = EmitContext(instr_dict_c)
+    benchmarks.update(
+        {
+            "backend.json": (
+                io.StringIO,
+                lambda out: json.dump(expanded, out, indent=2),
+            ),
+            "emit_context": (lambda: instr_dict, EmitContext),
+            "backend.binary": writing("binary", True, expanded),
+            "backend.sqlite": writing("sqlite", True, expanded),
+            "backend.c": writing("c", False, ctx_c),
+            "backend.chisel": writing("chisel", False, ctx),
+            "backend.spinalhdl": (
+                io.StringIO,
+                lambda out: load_backend("chisel")(ctx, out, True),
+            ),
+            "backend.sverilog": writing("sverilog", False, ctx),
+            "backend.rust": writing("rust", False, ctx),
+            "backend.go": (
+                io.StringIO,
+                lambda out: load_backend("go")(ctx, out, "bench.py"),
+            ),
+            "backend.python": writing("python", False, ctx),
+            "backend.rvc_lut": (
+                lambda: lambda filename, binary: io.StringIO(),
+                lambda open_output: load_backend("rvc_lut")(rvc_dict, open_output),
+            ),
+            "backend.latex": writing("latex", False),
+            "backend.priv_latex": writing("priv_latex", False),
+        }
+    )
+    return benchmarks
+
+
+def all_benchmarks(opcodes_dir: str = OPCODES_DIR) -> "Dict[str, Benchmark]":
+    """Every benchmark of the suite, by name."""
+    benchmarks: "Dict[str, Benchmark]" = {
+        f"parse.{name}": (
+            lambda file_filter=file_filter: file_filter,
+            lambda file_filter: create_inst_dict(file_filter, opcodes_dir=opcodes_dir),
+        )
+        for name, file_filter in PARSE_FILTERS.items()
+    }
+    benchmarks.update(parse_benchmarks(PARSE_FILTERS["all"], opcodes_dir))
+    benchmarks.update(backend_benchmarks(PARSE_FILTERS["all"], opcodes_dir))
+    return benchmarks
+
+
+def header_unit(headers: "list[str]") -> str:
+    """Source of a translation unit using the given C headers."""
+    includes = "".join(f'#include "{header}"\n' for header in headers)
+    return f"""{includes}
+struct insn_desc {{ const char *name; unsigned long match, mask; }};
+#define DECLARE_INSN(name, match, mask) {{ #name, match, mask }},
+static const struct insn_desc insns[] = {{
+{includes}}};
+#undef DECLARE_INSN
+#define DECLARE_CSR(name, number) number,
+static const int csrs[] = {{
+{includes}}};
+#undef DECLARE_CSR
+"""
+
+
+def header_benchmarks(directory: str, cpp: str) -> "Dict[str, Benchmark]":
+    """
+    Benchmarks of preprocessing HEADER_UNITS with cpp, using the headers of
+    the bundled extensions written to directory.
+    """
+    artifacts = generate(PARSE_FILTERS["all"], ["c", "c_split"])
+    for filename, data in artifacts.items():
+        path = os.path.join(directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as out:
+            out.write(str(data))
+
+    benchmarks: "Dict[str, Benchmark]" = {}
+    for name, headers in HEADER_UNITS.items():
+        unit = os.path.join(directory, f"{name}.c")
+        with open(unit, "w", encoding="utf-8") as out:
+            out.write(header_unit(headers))
+        benchmarks[name] = (
+            lambda unit=unit: [cpp, "-P", unit],
+            lambda command: subprocess.run(
+                command, check=True, stdout=subprocess.DEVNULL
+            ),
+        )
+    return benchmarks
+
+
+def scaling_benchmarks(
+    sizes: "list[int]", directory: str, seed: int = 0
+) -> "Dict[str, Benchmark]":
+    """
+    Benchmarks of create_inst_dict over synthetic ISAs of the given sizes,
+    written to subdirectories of directory (see synthetic_utils).
+    """
+    benchmarks: "Dict[str, Benchmark]" = {}
+    for size in sizes:
+        opcodes_dir = os.path.join(directory, str(size))
+        write_isa(
+            opcodes_dir,
+            synthesize_isa(size, seed, pseudo_ops=size // 100, imports=size // 100),
+        )
+        benchmarks[f"scale.{size}"] = (
+            lambda opcodes_dir=opcodes_dir: opcodes_dir,
+            lambda opcodes_dir: create_inst_dict(["rv*"], opcodes_dir=opcodes_dir),
+        )
+    return benchmarks
+
+
+def run_benchmarks(
+    benchmarks: "Dict[str, Benchmark]",
+    warmup: int = 1,
+    repeat: int = 5,
+    name_filter: "Optional[str]" = None,
+) -> "Dict[str, Any]":
+    """Run the benchmarks whose name matches name_filter and collect the results."""
+    results: "Dict[str, Stats]" = {}
+    for name, (setup, run) in benchmarks.items():
+        if name_filter is not None and not re.search(name_filter, name):
+            continue
+        logging.debug("Running benchmark %s", name)
+        results[name] = measure(setup, run, warmup, repeat)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+
+
+def compare_results(
+    current: "Dict[str, Any]",
+    baseline: "Dict[str, Any]",
+    threshold: float = DEFAULT_THRESHOLD,
+) -> "List[str]":
+    """
+    Compare the results against a baseline and describe every metric of
+    COMPARED_METRICS that grew by more than threshold (a fraction). Benchmarks
+    missing from either side are ignored.
+    """
+    regressions: "List[str]" = []
+    for name, stats in current["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        for metric in COMPARED_METRICS:
+            old = baseline["benchmarks"][name][metric]
+            new = stats[metric]
+            if old > 0 and new > old * (1 + threshold):
+                regressions.append(
+                    f"{name} {metric}: {old:.6g} -> {new:.6g} (+{new / old - 1:.1%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark instruction parsing and the output backends"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Untimed runs before measuring"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs")
+    parser.add_argument(
+        "--filter", help="Only run benchmarks whose name matches this regex"
+    )
+    parser.add_argument(
+        "--output", help="Write the JSON results to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="Fail if a metric regressed compared to this earlier JSON result",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed relative growth of a metric for --compare",
+    )
+    parser.add_argument(
+        "--opcodes-dir",
+        default=OPCODES_DIR,
+        help="Directory holding the extension files to benchmark",
+    )
+    parser.add_argument(
+        "--scaling",
+        nargs="?",
+        const=SCALING_SIZES,
+        metavar="SIZES",
+        help="Also time parsing synthetic ISAs of these comma-separated "
+        f"instruction counts (default {SCALING_SIZES})",
+    )
+    parser.add_argument(
+        "--scaling-repeat",
+        type=int,
+        default=1,
+        help="Timed runs per synthetic ISA size (without warmup)",
+    )
+    parser.add_argument(
+        "--cpp",
+        default=os.environ.get("CPP", "cpp"),
+        help="C preprocessor timed by the cpp.* benchmarks (skipped if not found)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        all_benchmarks(args.opcodes_dir), args.warmup, args.repeat, args.filter
+    )
+    cpp = shutil.which(args.cpp)
+    if cpp is None:
+        logging.warning(f"{args.cpp} not found, skipping the cpp benchmarks")
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            headers = run_benchmarks(
+                header_benchmarks(directory, cpp),
+                args.warmup,
+                args.repeat,
+                args.filter,
+            )
+        results["benchmarks"].update(headers["benchmarks"])
+    if args.scaling:
+        sizes = [int(size) for size in args.scaling.split(",")]
+        with tempfile.TemporaryDirectory() as directory:
+            scaling = run_benchmarks(
+                scaling_benchmarks(sizes, directory),
+                0,
+                args.scaling_repeat,
+                args.filter,
+            )
+        results["benchmarks"].update(scaling["benchmarks"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=2)
+        logging.info(f"{args.output} generated successfully")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, args.threshold)
+        for regression in regressions:
+            logging.error(f"Regression: {regression}")
+        if regressions:
+            log_and_exit(
+                f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}"
+            )
+        logging.info(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
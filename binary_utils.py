@@ -0,0 +1,270 @@
+import array
+import logging
+import mmap
+import struct
+import sys
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from shared_utils import InstrDict, SingleInstr, log_and_exit
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Layout of instr_dict.bin (all integers little-endian):
+#
+#   header   : magic, version, record size (in u32 words), counts and the
+#              byte offsets of the three sections below.
+#   strings  : (n_strings + 1) u32 offsets into a UTF-8 blob, then the blob.
+#              String ids are indices into the offset table.
+#   records  : n_records fixed-width records of RECORD_WORDS u32 words:
+#              name id, match, mask, first extension id slot, extension
+#              count, first field id slot, field count.
+#   ids      : n_ids u32 string ids referenced by the extension and field
+#              slots of the records.
+#
+# Every section starts on an 8 byte boundary so that it can be viewed in
+# place, either through memoryview.cast("I") or as a NumPy array. The
+# memoryviews are only in place on little-endian hosts, see u32_words.
+BINARY_MAGIC = b"RVOP"
+BINARY_VERSION = 1
+HEADER_FORMAT = "<4sHHIIIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_WORDS = 7
+RECORD_FIELDS = (
+    "name",
+    "match",
+    "mask",
+    "ext_start",
+    "ext_count",
+    "field_start",
+    "field_count",
+)
+
+
+def _align(data: bytearray, boundary: int = 8):
+    data.extend(b"\0" * (-len(data) % boundary))
+
+
+def encode_binary(instr_dict: InstrDict) -> bytes:
+    """
+    Serialise an instruction dictionary into the versioned binary layout
+    described at the top of this file. Instructions keep the order of
+    instr_dict; the string table is sorted so the output is deterministic.
+    """
+    strings = sorted(
+        {
+            s
+            for name, instr in instr_dict.items()
+            for s in [name, *instr["extension"], *instr["variable_fields"]]
+        }
+    )
+    string_ids = {s: i for i, s in enumerate(strings)}
+
+    blob = bytearray()
+    offsets: List[int] = []
+    for s in strings:
+        offsets.append(len(blob))
+        blob.extend(s.encode("utf-8"))
+    offsets.append(len(blob))
+
+    records: List[int] = []
+    ids: List[int] = []
+    for name, instr in instr_dict.items():
+        records.extend(
+            (
+                string_ids[name],
+                int(instr["match"], 16),
+                int(instr["mask"], 16),
+                len(ids),
+                len(instr["extension"]),
+                len(ids) + len(instr["extension"]),
+                len(instr["variable_fields"]),
+            )
+        )
+        ids.extend(string_ids[e] for e in instr["extension"])
+        ids.extend(string_ids[f] for f in instr["variable_fields"])
+
+    body = bytearray(HEADER_SIZE)
+    _align(body)
+    strings_offset = len(body)
+    body.extend(struct.pack(f"<{len(offsets)}I", *offsets))
+    body.extend(blob)
+    _align(body)
+    records_offset = len(body)
+    body.extend(struct.pack(f"<{len(records)}I", *records))
+    _align(body)
+    ids_offset = len(body)
+    body.extend(struct.pack(f"<{len(ids)}I", *ids))
+
+    struct.pack_into(
+        HEADER_FORMAT,
+        body,
+        0,
+        BINARY_MAGIC,
+        BINARY_VERSION,
+        RECORD_WORDS,
+        len(strings),
+        len(instr_dict),
+        len(ids),
+        strings_offset,
+        records_offset,
+        ids_offset,
+    )
+    return bytes(body)
+
+
+def u32_words(view: memoryview, byteorder: str = sys.byteorder) -> memoryview:
+    """
+    The little-endian u32 words of view, in place if the host (byteorder) is
+    little-endian too, else from a byteswapped copy.
+    """
+    if byteorder == "little":
+        return view.cast("I")
+    words = array.array("I")
+    words.frombytes(view)
+    words.byteswap()
+    return memoryview(words)
+
+
+def write_binary(instr_dict: InstrDict, out: BinaryIO):
+    out.write(encode_binary(instr_dict))
+
+
+class BinaryInstrDB:
+    """
+    Read-only view of an instr_dict.bin image. Nothing is copied out of the
+    buffer until a record is asked for: records and ids are exposed as
+    memoryviews over the (usually memory-mapped) image, or over a copy on
+    big-endian hosts, and strings are decoded on demand.
+    """
+
+    def __init__(self, buffer: Any, backing: Optional[mmap.mmap] = None):
+        self._backing = backing
+        view = memoryview(buffer)
+        if len(view) < HEADER_SIZE:
+            log_and_exit("Instruction database is truncated")
+        (
+            magic,
+            version,
+            record_words,
+            self.n_strings,
+            self.n_records,
+            self.n_ids,
+            strings_offset,
+            records_offset,
+            ids_offset,
+        ) = struct.unpack_from(HEADER_FORMAT, view)
+        if magic != BINARY_MAGIC:
+            log_and_exit("Not a RISC-V instruction database (bad magic)")
+        if version != BINARY_VERSION or record_words != RECORD_WORDS:
+            log_and_exit(
+                f"Unsupported instruction database version {version} "
+                f"(expected {BINARY_VERSION})"
+            )
+
+        blob_offset = strings_offset + 4 * (self.n_strings + 1)
+        self._view = view
+        self._string_offsets = u32_words(view[strings_offset:blob_offset])
+        self._blob_offset = blob_offset
+        self.records = u32_words(
+            view[records_offset : records_offset + 4 * RECORD_WORDS * self.n_records]
+        )
+        self.ids = u32_words(view[ids_offset : ids_offset + 4 * self.n_ids])
+        self._offsets = (strings_offset, records_offset, ids_offset)
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def __enter__(self) -> "BinaryInstrDB":
+        return self
+
+    def __exit__(self, *_exc: object):
+        self.close()
+
+    def close(self):
+        """
+        Release the views and unmap the file, if this object mapped it. The
+        arrays of as_numpy() hold on to the image: while one of them is
+        alive, unmapping raises BufferError, and close() can be called again
+        once they are deleted.
+        """
+        self.records.release()
+        self.ids.release()
+        self._string_offsets.release()
+        self._view.release()
+        if self._backing is not None:
+            self._backing.close()
+            self._backing = None
+
+    def string(self, string_id: int) -> str:
+        start = self._blob_offset + self._string_offsets[string_id]
+        end = self._blob_offset + self._string_offsets[string_id + 1]
+        return str(self._view[start:end], "utf-8")
+
+    def record(self, index: int) -> "tuple[int, ...]":
+        base = index * RECORD_WORDS
+        return tuple(self.records[base : base + RECORD_WORDS])
+
+    def name(self, index: int) -> str:
+        return self.string(self.records[index * RECORD_WORDS])
+
+    def instruction(self, index: int) -> "tuple[str, SingleInstr]":
+        """Rebuild the instr_dict entry stored at the given record index."""
+        name_id, match, mask, ext_start, ext_count, field_start, field_count = (
+            self.record(index)
+        )
+        encoding = "".join(
+            ("1" if (match >> bit) & 1 else "0") if (mask >> bit) & 1 else "-"
+            for bit in range(31, -1, -1)
+        )
+        return self.string(name_id), {
+            "encoding": encoding,
+            "variable_fields": [
+                self.string(i)
+                for i in self.ids[field_start : field_start + field_count]
+            ],
+            "extension": [
+                self.string(i) for i in self.ids[ext_start : ext_start + ext_count]
+            ],
+            "match": hex(match),
+            "mask": hex(mask),
+        }
+
+    def to_instr_dict(self) -> InstrDict:
+        return dict(self.instruction(i) for i in range(self.n_records))
+
+    def as_numpy(self) -> "Dict[str, Any]":
+        """
+        Zero-copy NumPy views of the image: a structured 'records' array with
+        one named u32 column per RECORD_FIELDS entry, the 'ids' array and the
+        string 'offsets'. NumPy is only needed when this method is called.
+        The arrays keep the image alive: a mapped file cannot be closed
+        while they are referenced (see close).
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        strings_offset, records_offset, ids_offset = self._offsets
+        record_dtype = np.dtype([(f, "<u4") for f in RECORD_FIELDS])
+        return {
+            "records": np.frombuffer(
+                self._view,
+                dtype=record_dtype,
+                count=self.n_records,
+                offset=records_offset,
+            ),
+            "ids": np.frombuffer(
+                self._view, dtype="<u4", count=self.n_ids, offset=ids_offset
+            ),
+            "offsets": np.frombuffer(
+                self._view,
+                dtype="<u4",
+                count=self.n_strings + 1,
+                offset=strings_offset,
+            ),
+        }
+
+
+def load_binary(filename: str = "instr_dict.bin") -> BinaryInstrDB:
+    """Memory-map an instr_dict.bin file and return a zero-copy view of it."""
+    with open(filename, "rb") as bin_file:
+        backing = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return BinaryInstrDB(backing, backing)
@@ -1,55 +1,44 @@
 import logging
 import os
 import pprint
+import re
+from itertools import groupby
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    TextIO,
+)
 
-from constants import causes, csrs, csrs32
-from shared_utils import InstrDict, arg_lut
+from emit_utils import EmitContext, InstrSymbol, write_chunks
+from shared_utils import InstrDict
 
 pp = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
+OpenOutput = Callable[[str, bool], ContextManager[IO[Any]]]
 
-def make_c(instr_dict: InstrDict):
-    mask_match_str = ""
-    declare_insn_str = ""
-    for i in instr_dict:
-        mask_match_str += (
-            f'#define MATCH_{i.upper().replace(".","_")} {instr_dict[i]["match"]}\n'
-        )
-        mask_match_str += (
-            f'#define MASK_{i.upper().replace(".","_")} {instr_dict[i]["mask"]}\n'
-        )
-        declare_insn_str += f'DECLARE_INSN({i.replace(".","_")}, MATCH_{i.upper().replace(".","_")}, MASK_{i.upper().replace(".","_")})\n'
-
-    csr_names_str = ""
-    declare_csr_str = ""
-    for num, name in csrs + csrs32:
-        csr_names_str += f"#define CSR_{name.upper()} {hex(num)}\n"
-        declare_csr_str += f"DECLARE_CSR({name}, CSR_{name.upper()})\n"
-
-    causes_str = ""
-    declare_cause_str = ""
-    for num, name in causes:
-        causes_str += f"#define CAUSE_{name.upper().replace(' ', '_')} {hex(num)}\n"
-        declare_cause_str += (
-            f"DECLARE_CAUSE(\"{name}\", CAUSE_{name.upper().replace(' ','_')})\n"
-        )
-
-    arg_str = ""
-    for name, rng in arg_lut.items():
-        sanitized_name = name.replace(" ", "_").replace("=", "_eq_")
-        begin = rng[1]
-        end = rng[0]
-        mask = ((1 << (end - begin + 1)) - 1) << begin
-        arg_str += f"#define INSN_FIELD_{sanitized_name.upper()} {hex(mask)}\n"
 
-    with open(f"{os.path.dirname(__file__)}/encoding.h", "r", encoding="utf-8") as file:
-        enc_header = file.read()
+def git_commit() -> str:
+    """Returns the short hash of the checked out commit, as shown in the header."""
+    return os.popen('git log -1 --format="format:%h"').read()
+
 
-    commit = os.popen('git log -1 --format="format:%h"').read()
+# Directory of the per-extension headers written by write_c_split
+SPLIT_DIR = "encoding"
 
-    # Generate the output as a string
-    output_str = f"""/* SPDX-License-Identifier: BSD-3-Clause */
+# Defined while all.h includes the extension headers, which then declare only
+# the instructions they own, so that all.h declares every instruction once.
+IN_ALL_H = "RISCV_ENCODING_IN_ALL_H"
+
+
+def license_header(commit: str) -> str:
+    return f"""/* SPDX-License-Identifier: BSD-3-Clause */
 
 /* Copyright (c) 2023 RISC-V International */
 
@@ -57,23 +46,171 @@ def make_c(instr_dict: InstrDict):
  * This file is auto-generated by running 'make' in
  * https://github.com/riscv/riscv-opcodes ({commit})
  */
-
-{enc_header}
-/* Automatically generated by parse_opcodes. */
-#ifndef RISCV_ENCODING_H
-#define RISCV_ENCODING_H
-{mask_match_str}
-{csr_names_str}
-{causes_str}
-{arg_str}#endif
-#ifdef DECLARE_INSN
-{declare_insn_str}#endif
-#ifdef DECLARE_CSR
-{declare_csr_str}#endif
-#ifdef DECLARE_CAUSE
-{declare_cause_str}#endif
 """
 
-    # Write the modified output to the file
+
+def match_mask_defines(instrs: "list[InstrSymbol]") -> "Iterator[str]":
+    for i in instrs:
+        yield f"#define MATCH_{i.upper} {i.match_hex}\n#define MASK_{i.upper} {i.mask_hex}\n"
+
+
+def declare_insns(instrs: "list[InstrSymbol]") -> "Iterator[str]":
+    for i in instrs:
+        yield f"DECLARE_INSN({i.c_name}, MATCH_{i.upper}, MASK_{i.upper})\n"
+
+
+def csr_defines(ctx: EmitContext) -> "Iterator[str]":
+    for c in ctx.csrs:
+        yield f"#define CSR_{c.upper} {c.hex}\n"
+
+
+def declare_csrs(ctx: EmitContext) -> "Iterator[str]":
+    for c in ctx.csrs:
+        yield f"DECLARE_CSR({c.name}, CSR_{c.upper})\n"
+
+
+def cause_defines(ctx: EmitContext) -> "Iterator[str]":
+    for c in ctx.causes:
+        yield f"#define CAUSE_{c.upper} {c.hex}\n"
+
+
+def declare_causes(ctx: EmitContext) -> "Iterator[str]":
+    for c in ctx.causes:
+        yield f'DECLARE_CAUSE("{c.name}", CAUSE_{c.upper})\n'
+
+
+def insn_field_defines(ctx: EmitContext) -> "Iterator[str]":
+    for f in ctx.fields:
+        yield f"#define INSN_FIELD_{f.upper} {f.mask_hex}\n"
+
+
+def read_encoding_h() -> str:
+    with open(f"{os.path.dirname(__file__)}/encoding.h", "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def c_chunks(ctx: EmitContext, commit: str = "") -> "Iterator[str]":
+    """The text of encoding.out.h, in small chunks."""
+    yield f"{license_header(commit)}\n{read_encoding_h()}\n"
+    yield "/* Automatically generated by parse_opcodes. */\n"
+    yield "#ifndef RISCV_ENCODING_H\n#define RISCV_ENCODING_H\n"
+    yield from match_mask_defines(ctx.instrs)
+    yield "\n"
+    yield from csr_defines(ctx)
+    yield "\n"
+    yield from cause_defines(ctx)
+    yield "\n"
+    yield from insn_field_defines(ctx)
+    yield "#endif\n#ifdef DECLARE_INSN\n"
+    yield from declare_insns(ctx.instrs)
+    yield "#endif\n#ifdef DECLARE_CSR\n"
+    yield from declare_csrs(ctx)
+    yield "#endif\n#ifdef DECLARE_CAUSE\n"
+    yield from declare_causes(ctx)
+    yield "#endif\n"
+
+
+def write_c(ctx: EmitContext, out: TextIO, commit: str = ""):
+    write_chunks(out, c_chunks(ctx, commit))
+
+
+def header_guard(name: str) -> str:
+    return "RISCV_ENCODING_" + re.sub(r"\W", "_", name).upper() + "_H"
+
+
+def common_h_chunks(ctx: EmitContext, license_str: str) -> "Iterator[str]":
+    yield f"{license_str}\n{read_encoding_h()}\n"
+    yield "/* Automatically generated by parse_opcodes. */\n"
+    yield f"#ifndef {header_guard('common')}\n#define {header_guard('common')}\n"
+    yield from insn_field_defines(ctx)
+    yield "#endif\n"
+
+
+def csr_h_chunks(ctx: EmitContext, license_str: str) -> "Iterator[str]":
+    yield f'{license_str}\n#include "common.h"\n\n'
+    yield f"#ifndef {header_guard('csr')}\n#define {header_guard('csr')}\n"
+    yield from csr_defines(ctx)
+    yield "\n"
+    yield from cause_defines(ctx)
+    yield "#endif\n#ifdef DECLARE_CSR\n"
+    yield from declare_csrs(ctx)
+    yield "#endif\n#ifdef DECLARE_CAUSE\n"
+    yield from declare_causes(ctx)
+    yield "#endif\n"
+
+
+def extension_h_chunks(
+    ext: str, instrs: "list[InstrSymbol]", license_str: str
+) -> "Iterator[str]":
+    yield f'{license_str}\n#include "common.h"\n\n'
+    yield f"#ifndef {header_guard(ext)}\n#define {header_guard(ext)}\n"
+    yield from match_mask_defines(instrs)
+    yield "#endif\n#ifdef DECLARE_INSN\n"
+    for owned, run in groupby(instrs, key=lambda i: i.extension == ext):
+        if not owned:
+            yield f"#ifndef {IN_ALL_H}\n"
+        yield from declare_insns(list(run))
+        if not owned:
+            yield "#endif\n"
+    yield "#endif\n"
+
+
+def all_h_chunks(exts: "Iterable[str]", license_str: str) -> "Iterator[str]":
+    yield f'{license_str}\n#include "common.h"\n#include "csr.h"\n\n'
+    yield f"#define {IN_ALL_H}\n"
+    for ext in exts:
+        yield f'#include "{ext}.h"\n'
+    yield f"#undef {IN_ALL_H}\n"
+
+
+def extension_members(ctx: EmitContext) -> "Dict[str, List[InstrSymbol]]":
+    """
+    The instructions of every extension listing them in "extension", sorted
+    by extension name, e.g. andn is in rv_zbb, rv_zbkb, rv_zkn and rv_zks.
+    """
+    members: "Dict[str, List[InstrSymbol]]" = {}
+    for i in ctx.instrs:
+        for ext in i.extensions:
+            members.setdefault(ext, []).append(i)
+    return dict(sorted(members.items()))
+
+
+def write_c_split(ctx: EmitContext, open_output: OpenOutput, commit: str = ""):
+    """
+    Write the contents of encoding.out.h split over SPLIT_DIR, so that
+    translation units can include only the extensions they use:
+        - common.h: encoding.h and the INSN_FIELD_* masks;
+        - csr.h: the CSR_* and CAUSE_* numbers and their DECLARE_CSR and
+          DECLARE_CAUSE lists;
+        - <extension>.h: MATCH_*/MASK_* and the DECLARE_INSN list of the
+          instructions of the extension, for every entry of their
+          "extension", so an instruction shared by extensions is in each;
+        - all.h: includes common.h, csr.h and every extension header, with
+          IN_ALL_H defined so that each instruction is declared once, by
+          the header of its owning extension.
+    Every macro is defined with the same value as in encoding.out.h, so the
+    split headers can be mixed with it. Like encoding.out.h, the DECLARE_*
+    lists are expanded on every inclusion with the DECLARE_* macro defined,
+    so a translation unit expanding them includes either all.h or the
+    extension headers of disjoint extensions.
+    """
+    license_str = license_header(commit)
+
+    with open_output(f"{SPLIT_DIR}/common.h", False) as out:
+        write_chunks(out, common_h_chunks(ctx, license_str))
+
+    with open_output(f"{SPLIT_DIR}/csr.h", False) as out:
+        write_chunks(out, csr_h_chunks(ctx, license_str))
+
+    members = extension_members(ctx)
+    for ext, instrs in members.items():
+        with open_output(f"{SPLIT_DIR}/{ext}.h", False) as out:
+            write_chunks(out, extension_h_chunks(ext, instrs, license_str))
+
+    with open_output(f"{SPLIT_DIR}/all.h", False) as out:
+        write_chunks(out, all_h_chunks(members, license_str))
+
+
+def make_c(instr_dict: InstrDict):
     with open("encoding.out.h", "w", encoding="utf-8") as enc_file:
-        enc_file.write(output_str)
+        write_c(EmitContext(instr_dict), enc_file, git_commit())
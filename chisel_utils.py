@@ -1,82 +1,73 @@
 import logging
 import pprint
+from typing import Iterator, TextIO
 
-from constants import causes, csrs, csrs32
-from shared_utils import InstrDict, instr_dict_2_extensions
+from emit_utils import EmitContext, write_chunks
+from shared_utils import InstrDict
 
 pp = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
 
-def make_chisel(instr_dict: InstrDict, spinal_hdl: bool = False):
+def chisel_extension_name(extension: str) -> str:
+    """Name of the Map of an extension's instructions, without "Type"."""
+    if "rv64_" in extension:
+        return extension.replace("rv64_", "").upper() + "64"
+    if "rv32_" in extension:
+        return extension.replace("rv32_", "").upper() + "32"
+    if "rv_" in extension:
+        return extension.replace("rv_", "").upper()
+    return extension.upper()
+
+
+def chisel_chunks(ctx: EmitContext, spinal_hdl: bool = False) -> "Iterator[str]":
+    """
+    The Chisel (or SpinalHDL) objects, one line at a time. Chisel gets one
+    Map per extension, in extension name order.
+    """
+    yield "\n/* Automatically generated by parse_opcodes */\n"
+    yield "object Instructions {\n"
+    if spinal_hdl:
+        for i in ctx.instrs:
+            yield f'  def {i.upper:<18s} = M"b{i.encoding}"\n'
+    else:
+        for e, instrs in ctx.extensions.items():
+            yield f"  val {chisel_extension_name(e)}Type = Map(\n"
+            for i in instrs:
+                quoted = f'"{i.upper}"'
+                yield f'   {quoted:<18s} -> BitPat("b{i.bitpat}"),\n'
+            yield "  )\n"
+    yield "\n}\n"
 
-    chisel_names = ""
-    cause_names_str = ""
-    csr_names_str = ""
-    for i in instr_dict:
-        if spinal_hdl:
-            chisel_names += f'  def {i.upper().replace(".","_"):<18s} = M"b{instr_dict[i]["encoding"].replace("-","-")}"\n'
-        # else:
-        #     chisel_names += f'  def {i.upper().replace(".","_"):<18s} = BitPat("b{instr_dict[i]["encoding"].replace("-","?")}")\n'
-    if not spinal_hdl:
-        extensions = instr_dict_2_extensions(instr_dict)
-        for e in extensions:
-            if "rv64_" in e:
-                e_format = e.replace("rv64_", "").upper() + "64"
-            elif "rv32_" in e:
-                e_format = e.replace("rv32_", "").upper() + "32"
-            elif "rv_" in e:
-                e_format = e.replace("rv_", "").upper()
-            else:
-                e_format = e.upper()
-            chisel_names += f'  val {e_format+"Type"} = Map(\n'
-            for instr_name, instr in instr_dict.items():
-                if instr["extension"][0] == e:
-                    tmp_instr_name = '"' + instr_name.upper().replace(".", "_") + '"'
-                    chisel_names += f'   {tmp_instr_name:<18s} -> BitPat("b{instr["encoding"].replace("-","?")}"),\n'
-            chisel_names += "  )\n"
+    yield "object Causes {\n"
+    for c in ctx.causes:
+        yield f"  val {c.lower} = {c.hex}\n"
+    yield "  val all = {\n    val res = collection.mutable.ArrayBuffer[Int]()\n"
+    for c in ctx.causes:
+        yield f"    res += {c.lower}\n"
+    yield "    res.toArray\n  }\n}\n"
 
-    for num, name in causes:
-        cause_names_str += f'  val {name.lower().replace(" ","_")} = {hex(num)}\n'
-    cause_names_str += """  val all = {
-    val res = collection.mutable.ArrayBuffer[Int]()
-"""
-    for num, name in causes:
-        cause_names_str += f'    res += {name.lower().replace(" ","_")}\n'
-    cause_names_str += """    res.toArray
-  }"""
+    yield "object CSRs {\n"
+    for c in ctx.csrs:
+        yield f"  val {c.name} = {c.hex}\n"
+    yield "  val all = {\n    val res = collection.mutable.ArrayBuffer[Int]()\n"
+    for c in ctx.csrs:
+        if not c.rv32_only:
+            yield f"    res += {c.name}\n"
+    yield "    res.toArray\n  }\n"
+    yield "  val all32 = {\n    val res = collection.mutable.ArrayBuffer(all:_*)\n"
+    for c in ctx.csrs:
+        if c.rv32_only:
+            yield f"    res += {c.name}\n"
+    yield "    res.toArray\n  }\n}\n"
 
-    for num, name in csrs + csrs32:
-        csr_names_str += f"  val {name} = {hex(num)}\n"
-    csr_names_str += """  val all = {
-    val res = collection.mutable.ArrayBuffer[Int]()
-"""
-    for num, name in csrs:
-        csr_names_str += f"""    res += {name}\n"""
-    csr_names_str += """    res.toArray
-  }
-  val all32 = {
-    val res = collection.mutable.ArrayBuffer(all:_*)
-"""
-    for num, name in csrs32:
-        csr_names_str += f"""    res += {name}\n"""
-    csr_names_str += """    res.toArray
-  }"""
 
+def write_chisel(ctx: EmitContext, out: TextIO, spinal_hdl: bool = False):
+    write_chunks(out, chisel_chunks(ctx, spinal_hdl))
+
+
+def make_chisel(instr_dict: InstrDict, spinal_hdl: bool = False):
     with open(
         "inst.spinalhdl" if spinal_hdl else "inst.chisel", "w", encoding="utf-8"
     ) as chisel_file:
-        chisel_file.write(
-            f"""
-/* Automatically generated by parse_opcodes */
-object Instructions {{
-{chisel_names}
-}}
-object Causes {{
-{cause_names_str}
-}}
-object CSRs {{
-{csr_names_str}
-}}
-"""
-        )
+        write_chisel(EmitContext(instr_dict), chisel_file, spinal_hdl)
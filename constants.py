@@ -1,5 +1,11 @@
 import csv
+import os
 import re
+from typing import Any, Callable, Dict
+
+# The CSV tables live next to this file; they are read on first use rather
+# than at import time, and independently of the current working directory.
+TABLES_DIR = os.path.dirname(os.path.realpath(__file__))
 
 # TODO: The constants in this file should be in all caps.
 overlapping_extensions = {
@@ -8,6 +14,13 @@ overlapping_extensions = {
     "rv_c": {"rv_zcmop"},
 }
 
+# The overlapping extensions that cannot be implemented together: a word
+# matched by instructions of both decodes by the extension implemented.
+exclusive_extensions = {
+    "rv_zcmt": {"rv_c_d"},
+    "rv_zcmp": {"rv_c_d"},
+}
+
 overlapping_instructions = {
     "c_addi": {"c_nop"},
     "c_lui": {"c_addi16sp"},
@@ -16,10 +29,6 @@ overlapping_instructions = {
     "c_add": {"c_ebreak", "c_jalr"},
 }
 
-isa_regex = re.compile(
-    "^RV(32|64|128)[IE]+[ABCDEFGHJKLMNPQSTUVX]*(Zicsr|Zifencei|Zihintpause|Zam|Ztso|Zkne|Zknd|Zknh|Zkse|Zksh|Zkg|Zkb|Zkr|Zks|Zkn|Zba|Zbc|Zbb|Zbp|Zbr|Zbm|Zbs|Zbe|Zbf|Zbt|Zmmul|Zbpbo|Zca|Zcf|Zcd|Zcb|Zcmp|Zcmt){,1}(_Zicsr){,1}(_Zifencei){,1}(_Zihintpause){,1}(_Zmmul){,1}(_Zam){,1}(_Zba){,1}(_Zbb){,1}(_Zbc){,1}(_Zbe){,1}(_Zbf){,1}(_Zbm){,1}(_Zbp){,1}(_Zbpbo){,1}(_Zbr){,1}(_Zbs){,1}(_Zbt){,1}(_Zkb){,1}(_Zkg){,1}(_Zkr){,1}(_Zks){,1}(_Zkn){,1}(_Zknd){,1}(_Zkne){,1}(_Zknh){,1}(_Zkse){,1}(_Zksh){,1}(_Ztso){,1}(_Zca){,1}(_Zcf){,1}(_Zcd){,1}(_Zcb){,1}(_Zcmp){,1}(_Zcmt){,1}$"
-)
-
 # regex to find <msb>..<lsb>=<val> patterns in instruction
 fixed_ranges = re.compile(
     r"\s*(?P<msb>\d+.?)\.\.(?P<lsb>\d+.?)\s*=\s*(?P<val>\d[\w]*)[\s$]*", re.M
@@ -29,6 +38,15 @@ fixed_ranges = re.compile(
 # single_fixed = re.compile('\s+(?P<lsb>\d+)=(?P<value>[\w\d]*)[\s$]*', re.M)
 single_fixed = re.compile(r"(?:^|[\s])(?P<lsb>\d+)=(?P<value>[\w]*)((?=\s|$))", re.M)
 
+# single-pass tokenizer for the encoding part of an instruction line: every
+# match is either a fixed range, a single fixed bit (same syntax as
+# fixed_ranges and single_fixed above) or an argument name
+encoding_token = re.compile(
+    r"(?P<msb>\d+.?)\.\.(?P<lsb>\d+.?)\s*=\s*(?P<val>\d[\w]*)"
+    r"|(?P<bit>\d+)=(?P<bit_val>[\w]*)(?=\s|$)"
+    r"|(?P<arg>\S+)"
+)
+
 # regex to find the overloading condition variable
 var_regex = re.compile(r"(?P<var>[a-zA-Z][\w\d]*)\s*=\s*.*?[\s$]*", re.M)
 
@@ -50,39 +68,84 @@ def read_int_map_csv(filename: str) -> "list[tuple[int, str]]":
     Each tuple contains an integer value (from the first column) and a string (from the second column).
 
     Args:
-        filename (str): The name of the CSV file to read.
+        filename (str): The name of the CSV file to read, relative to TABLES_DIR.
 
     Returns:
         list of tuple: A list of (int, str) tuples extracted from the CSV file.
     """
-    with open(filename, encoding="utf-8") as f:
+    with open(os.path.join(TABLES_DIR, filename), encoding="utf-8") as f:
         csv_reader = csv.reader(f, skipinitialspace=True)
         return [(int(row[0], 0), row[1]) for row in csv_reader]
 
 
-causes = read_int_map_csv("causes.csv")
-csrs = read_int_map_csv("csrs.csv")
-csrs32 = read_int_map_csv("csrs32.csv")
-
-
 def read_arg_lut_csv(filename: str) -> "dict[str, tuple[int, int]]":
     """
     Load the argument lookup table (arg_lut) from a CSV file, mapping argument names to their bit positions.
     """
-    with open(filename, encoding="utf-8") as f:
+    with open(os.path.join(TABLES_DIR, filename), encoding="utf-8") as f:
         csv_reader = csv.reader(f, skipinitialspace=True)
         return {row[0]: (int(row[1]), int(row[2])) for row in csv_reader}
 
 
-arg_lut = read_arg_lut_csv("arg_lut.csv")
+def load_arg_lut() -> "dict[str, tuple[int, int]]":
+    lut = read_arg_lut_csv("arg_lut.csv")
+
+    # for mop
+    lut["mop_r_t_30"] = (30, 30)
+    lut["mop_r_t_27_26"] = (27, 26)
+    lut["mop_r_t_21_20"] = (21, 20)
+    lut["mop_rr_t_30"] = (30, 30)
+    lut["mop_rr_t_27_26"] = (27, 26)
+    lut["c_mop_t"] = (10, 8)
+    return lut
+
+
+# arg_lut is loaded on import: every parse needs it, and shared_utils and the
+# backends bind it with `from ... import arg_lut`.
+arg_lut = load_arg_lut()
+
+# Tables that are only built when first accessed (see __getattr__ below).
+# The declarations give the attributes their types; the loaders fill them in.
+causes: "list[tuple[int, str]]"
+csrs: "list[tuple[int, str]]"
+csrs32: "list[tuple[int, str]]"
+
+_lazy_tables: "Dict[str, Callable[[], Any]]" = {
+    "causes": lambda: read_int_map_csv("causes.csv"),
+    "csrs": lambda: read_int_map_csv("csrs.csv"),
+    "csrs32": lambda: read_int_map_csv("csrs32.csv"),
+}
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Build a lazy table on first access and cache it as a regular module
+    attribute, so later lookups (and `from constants import ...`) bypass this
+    hook entirely.
+    """
+    if name not in _lazy_tables:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = _lazy_tables[name]()
+    globals()[name] = value
+    return value
+
+
+def reload_tables():
+    """
+    Re-read arg_lut and the lazy tables that have already been loaded. The
+    existing list and dict objects are updated in place, so modules that
+    imported them with `from constants import ...` see the new contents.
+    """
+    arg_lut.clear()
+    arg_lut.update(load_arg_lut())
+    for name, loader in _lazy_tables.items():
+        current = globals().get(name)
+        if isinstance(current, list):
+            current[:] = loader()
+        elif isinstance(current, dict):
+            current.clear()
+            current.update(loader())
 
-# for mop
-arg_lut["mop_r_t_30"] = (30, 30)
-arg_lut["mop_r_t_27_26"] = (27, 26)
-arg_lut["mop_r_t_21_20"] = (21, 20)
-arg_lut["mop_rr_t_30"] = (30, 30)
-arg_lut["mop_rr_t_27_26"] = (27, 26)
-arg_lut["c_mop_t"] = (10, 8)
 
 # dictionary containing the mapping of the argument to the what the fields in
 # the latex table should be
@@ -0,0 +1,457 @@
+from array import array
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from constants import exclusive_extensions, overlapping_instructions
+from shared_utils import InstrDict, arg_lut, log_and_exit
+
+# (mask, match, name) of an instruction, as checked by a decoder leaf
+Candidate = Tuple[int, int, str]
+
+
+class DecoderNode(NamedTuple):
+    """
+    Inner node of a decoder tree, branching on insn & mask. The candidates
+    of hot, if any, are checked in order before branching.
+    """
+
+    mask: int
+    children: "Dict[int, DecoderTree]"
+    hot: "Tuple[Candidate, ...]" = ()
+
+
+# A decoder tree is a DecoderNode, or a leaf listing the candidates left, most
+# specific (most fixed bits) first.
+DecoderTree = Union[DecoderNode, "List[Candidate]"]
+
+# Instruction name -> relative frequency, e.g. counts from a trace.
+Histogram = Dict[str, float]
+
+# Hottest candidates considered for the hot list of a node.
+MAX_HOT_CANDIDATES = 16
+
+# Bound on the copies of the candidates made by weighted_mask, relative to
+# their number.
+MAX_REPLICATION = 8
+
+
+def fixed_bit_count(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+def specificity(candidate: Candidate) -> "Tuple[int, str]":
+    """Sort key of the candidates of a leaf: most fixed bits first, then by name."""
+    return -fixed_bit_count(candidate[0]), candidate[2]
+
+
+def candidates_overlap(a: Candidate, b: Candidate) -> bool:
+    """Whether a word matches both candidates."""
+    return (a[1] ^ b[1]) & a[0] & b[0] == 0
+
+
+def blockers(candidate: Candidate, candidates: "List[Candidate]") -> "List[Candidate]":
+    """
+    The candidates that must be checked before candidate: the overlapping
+    ones that come first in specificity order, and recursively their own.
+    """
+    found: "Dict[Candidate, None]" = {}
+    pending = [candidate]
+    while pending:
+        current = pending.pop()
+        for other in candidates:
+            if (
+                other not in found
+                and specificity(other) < specificity(current)
+                and candidates_overlap(other, current)
+            ):
+                found[other] = None
+                pending.append(other)
+    return sorted(found, key=specificity)
+
+
+def weighted_order(
+    candidates: "List[Candidate]", weights: Histogram
+) -> "List[Candidate]":
+    """
+    The candidates with the heaviest first, each after its blockers so that
+    every word still decodes to the same instruction.
+    """
+    order: "Dict[Candidate, None]" = {}
+    for candidate in sorted(
+        candidates, key=lambda c: (-weights.get(c[2], 0), specificity(c))
+    ):
+        for blocker in blockers(candidate, candidates):
+            order.setdefault(blocker)
+        order.setdefault(candidate)
+    return list(order)
+
+
+def hot_list(
+    candidates: "List[Candidate]", costs: "Dict[str, float]", weights: Histogram
+) -> "Tuple[Candidate, ...]":
+    """
+    The candidates to check before branching at a node whose subtree decodes
+    each candidate in costs[name] tests: the prefix of the hottest
+    candidates (with their blockers) minimizing the expected number of
+    tests, as every word not decoded by the list pays for all its checks.
+    """
+    hottest = sorted(
+        (c for c in candidates if weights.get(c[2], 0) > 0),
+        key=lambda c: (-weights[c[2]], specificity(c)),
+    )[:MAX_HOT_CANDIDATES]
+    total = sum(weights.get(c[2], 0) * costs[c[2]] for c in candidates)
+    best_cost, best = total, 0
+    order: "Dict[Candidate, None]" = {}
+    for candidate in hottest:
+        for blocker in blockers(candidate, candidates):
+            order.setdefault(blocker)
+        order.setdefault(candidate)
+        listed = {c[2] for c in order}
+        cost = sum(weights.get(c[2], 0) * (i + 1) for i, c in enumerate(order)) + sum(
+            weights.get(c[2], 0) * (len(order) + costs[c[2]])
+            for c in candidates
+            if c[2] not in listed
+        )
+        if cost < best_cost:
+            best_cost, best = cost, len(order)
+    return tuple(list(order)[:best])
+
+
+def branch(candidates: "List[Candidate]", mask: int) -> "Dict[int, List[Candidate]]":
+    """
+    The candidates by value of insn & mask. A candidate leaving some bits of
+    mask free goes to every value its fixed bits agree with.
+    """
+    groups: "Dict[int, List[Candidate]]" = {}
+    for candidate in candidates:
+        free = mask & ~candidate[0]
+        value = candidate[1] & mask & candidate[0]
+        # every subset of the free bits, starting from the empty one
+        bits = 0
+        while True:
+            groups.setdefault(value | bits, []).append(candidate)
+            bits = (bits - free) & free
+            if bits == 0:
+                break
+    return groups
+
+
+def weighted_mask(
+    candidates: "List[Candidate]", tested: int, common: int, weights: Histogram
+) -> int:
+    """
+    The bits to branch on for a histogram: common, merged with the bits the
+    heaviest child would branch on next, saving that child's words a test,
+    as long as the candidates that leave those bits free are copied to at
+    most MAX_REPLICATION times as many children as there are candidates.
+    """
+    groups = branch(candidates, common)
+    heaviest = max(groups.values(), key=lambda g: sum(weights.get(c[2], 0) for c in g))
+    following = ~(tested | common)
+    for mask, _match, _name in heaviest:
+        following &= mask
+    if len(heaviest) <= 1 or following == 0:
+        return common
+    merged = common | following
+    copies = sum(1 << fixed_bit_count(merged & ~c[0]) for c in candidates)
+    return merged if copies <= MAX_REPLICATION * len(candidates) else common
+
+
+def build_decoder(
+    candidates: "Iterable[Candidate]",
+    tested: int = 0,
+    weights: "Optional[Histogram]" = None,
+) -> DecoderTree:
+    """
+    Builds a decoder tree for the candidates. Every node branches on all the
+    bits fixed by each of its candidates that no enclosing node has tested
+    yet; candidates that share no more fixed bits (a single instruction, or
+    instructions allowed to overlap) end up in a leaf.
+
+    With weights, the layout minimizes the expected number of tests for
+    words drawn from that histogram: nodes also branch on the bits of their
+    heaviest child (see weighted_mask), leaves check the heaviest candidates
+    first and nodes get hot lists where that pays off. Words decode to the
+    same instructions either way.
+    """
+    candidates = list(candidates)
+    common = ~tested
+    for mask, _match, _name in candidates:
+        common &= mask
+    if len(candidates) <= 1 or common == 0:
+        leaf = sorted(candidates, key=specificity)
+        return weighted_order(leaf, weights) if weights else leaf
+
+    hot_weight = weights and any(weights.get(c[2], 0) > 0 for c in candidates)
+    if hot_weight:
+        assert weights is not None
+        common = weighted_mask(candidates, tested, common, weights)
+    groups = branch(candidates, common)
+    if len(groups) == 1:
+        # the bits do not discriminate, but tell the children they are known
+        return build_decoder(candidates, tested | common, weights)
+    node = DecoderNode(
+        common,
+        {
+            value: build_decoder(group, tested | common, weights)
+            for value, group in sorted(groups.items())
+        },
+    )
+    if hot_weight:
+        assert weights is not None
+        hot = hot_list(candidates, decoder_costs(node), weights)
+        if hot:
+            # words reaching the children match none of the hot candidates
+            node = prune(node, {c[2] for c in hot})._replace(hot=hot)
+    return node
+
+
+def prune(tree: DecoderTree, names: "Set[str]") -> DecoderTree:
+    """The tree without the candidates named in names."""
+    if isinstance(tree, tuple):
+        return DecoderNode(
+            tree.mask,
+            {value: prune(child, names) for value, child in tree.children.items()},
+            tuple(c for c in tree.hot if c[2] not in names),
+        )
+    return [c for c in tree if c[2] not in names]
+
+
+def decode(tree: DecoderTree, insn: int) -> "Optional[str]":
+    """Name of the instruction encoded by insn, None if there is none."""
+    node = tree
+    while isinstance(node, tuple):
+        for mask, match, name in node[2]:
+            if insn & mask == match:
+                return name
+        node = node[1].get(insn & node[0], [])
+    for mask, match, name in node:
+        if insn & mask == match:
+            return name
+    return None
+
+
+def decoder_costs(tree: DecoderTree) -> "Dict[str, float]":
+    """
+    Mean number of tests (hot list checks, node lookups and leaf checks)
+    needed to decode a word of each instruction of the tree, over the
+    values of its variable fields. An instruction copied to several
+    children (see branch) splits its words between them.
+    """
+    totals: "Dict[str, List[float]]" = {}
+
+    def walk(node: DecoderTree, spent: int, tested: int):
+        checked = node.hot if isinstance(node, tuple) else node
+        for i, (mask, _match, name) in enumerate(checked):
+            share = 1 / (1 << fixed_bit_count(tested & ~mask))
+            total = totals.setdefault(name, [0.0, 0.0])
+            total[0] += share * (spent + i + 1)
+            total[1] += share
+        if isinstance(node, tuple):
+            for child in node.children.values():
+                walk(child, spent + len(node.hot) + 1, tested | node.mask)
+
+    walk(tree, 0, 0)
+    return {name: cost / share for name, (cost, share) in totals.items()}
+
+
+def expected_cost(tree: DecoderTree, weights: Histogram) -> float:
+    """Mean number of tests to decode a word drawn from the histogram."""
+    costs = decoder_costs(tree)
+    total = sum(w for name, w in weights.items() if name in costs)
+    if total <= 0:
+        return 0.0
+    return sum(w * costs[name] for name, w in weights.items() if name in costs) / total
+
+
+def decoder_source(tree: DecoderTree, indent: str = "") -> "Iterator[str]":
+    """
+    The tree as a Python literal: (mask, {value: subtree}) tuples for the
+    nodes, (mask, {value: subtree}, [hot candidates]) for the nodes with a
+    hot list, and [(mask, match, name)] lists for the leaves, numbers in hex.
+    """
+    if not isinstance(tree, tuple):
+        yield "["
+        yield ", ".join(
+            f"({hex(mask)}, {hex(match)}, {name!r})" for mask, match, name in tree
+        )
+        yield "]"
+        return
+    yield f"({hex(tree.mask)}, {{\n"
+    for value, child in tree.children.items():
+        yield f"{indent}    {hex(value)}: "
+        yield from decoder_source(child, indent + "    ")
+        yield ",\n"
+    yield f"{indent}}}"
+    if tree.hot:
+        yield ", "
+        yield from decoder_source(list(tree.hot), indent)
+    yield ")"
+
+
+# Values that variable fields must not take, besides zero for the *_n0
+# fields and the c_nz* immediates (whose hi and lo parts must not both be
+# zero). The compressed register fields (*_p) may take any of their values.
+FORBIDDEN_VALUES = {"rd_n2": (0, 2)}
+
+
+def field_constraints(variable_fields: "list[str]") -> "List[Tuple[int, int]]":
+    """
+    The (mask, value) pairs that a word of an instruction with these variable
+    fields must not have, i.e. word & mask must never equal value.
+    """
+    constraints: "List[Tuple[int, int]]" = []
+    nonzero_immediates: "Dict[str, int]" = {}
+    for field in variable_fields:
+        msb, lsb = arg_lut[field]
+        field_mask = ((1 << (msb - lsb + 1)) - 1) << lsb
+        if field in FORBIDDEN_VALUES:
+            constraints.extend(
+                (field_mask, value << lsb) for value in FORBIDDEN_VALUES[field]
+            )
+        elif field.endswith("_n0"):
+            constraints.append((field_mask, 0))
+        elif field.startswith("c_nz"):
+            immediate = field[:-2] if field.endswith(("hi", "lo")) else field
+            nonzero_immediates[immediate] = (
+                nonzero_immediates.get(immediate, 0) | field_mask
+            )
+    constraints.extend((mask, 0) for mask in nonzero_immediates.values())
+    return constraints
+
+
+# Compressed instructions are the 16-bit encodings whose bits 1..0 are not 11.
+HALFWORDS = 1 << 16
+
+
+def is_compressed(mask: int, match: int) -> bool:
+    return mask < HALFWORDS and match & 3 != 3
+
+
+def for_xlen(extensions: "list[str]", xlen: int) -> bool:
+    """Whether an instruction of these extensions exists for the given XLEN."""
+    other = "rv64_" if xlen == 32 else "rv32_"
+    return any(not ext.startswith(other) for ext in extensions)
+
+
+def exclusive_clashes(instr_dict: InstrDict, xlen: int) -> "List[Tuple[str, str]]":
+    """
+    The pairs of instructions of instr_dict that exist for xlen and match a
+    common word, but are of mutually exclusive extensions (see
+    exclusive_extensions, e.g. Zcmp and Zcd). Which one such a word decodes
+    to depends on the configuration, so a decoder needs one of them only.
+    """
+    members: "Dict[str, List[Tuple[str, int, int]]]" = {}
+    for name, instr in instr_dict.items():
+        if for_xlen(instr["extension"], xlen):
+            for ext in instr["extension"]:
+                members.setdefault(ext, []).append(
+                    (name, int(instr["mask"], 16), int(instr["match"], 16))
+                )
+    return [
+        (a, b)
+        for ext, others in exclusive_extensions.items()
+        for other in sorted(others)
+        for a, a_mask, a_match in members.get(ext, [])
+        for b, b_mask, b_match in members.get(other, [])
+        if a != b and (a_match ^ b_match) & a_mask & b_mask == 0
+    ]
+
+
+def takes_priority(a: Candidate, b: Candidate) -> "Optional[bool]":
+    """
+    Whether a wins over b where both match: overlapping_instructions lists
+    the instructions carved out of another one, and otherwise the
+    instruction fixing a superset of the other's bits wins. None if neither.
+    """
+    if a[2] in overlapping_instructions.get(b[2], ()):
+        return True
+    if b[2] in overlapping_instructions.get(a[2], ()):
+        return False
+    if a[0] != b[0] and a[0] & b[0] == b[0]:
+        return True
+    if a[0] != b[0] and a[0] & b[0] == a[0]:
+        return False
+    return None
+
+
+class CompressedLUT:
+    """
+    Decodes a compressed instruction by indexing a table with its halfword:
+    table[halfword] is the index of its name in names, 0 (the name "") for
+    halfwords that are no compressed instruction of the XLEN.
+    """
+
+    def __init__(self, xlen: int, names: "List[str]", table: "array[int]"):
+        self.xlen = xlen
+        self.names = names
+        self.table = table
+
+    def decode(self, halfword: int) -> "Optional[str]":
+        return self.names[self.table[halfword & (HALFWORDS - 1)]] or None
+
+
+def build_compressed_lut(instr_dict: InstrDict, xlen: int) -> CompressedLUT:
+    """
+    Enumerates the halfwords matched by every compressed instruction of
+    instr_dict that exists for xlen (32 or 64). Where several match, the one
+    taking priority (see takes_priority) is stored. A table is of one
+    configuration: instructions of mutually exclusive extensions (see
+    exclusive_clashes, e.g. Zcmp and Zcd) sharing halfwords are an error.
+    Like the match/mask values, the table knows nothing of reserved field
+    values, e.g. 0x0000 is c_addi4spn.
+    """
+    if xlen not in (32, 64):
+        raise ValueError(f"Unsupported XLEN {xlen}")
+    clashes = exclusive_clashes(instr_dict, xlen)
+    if clashes:
+        log_and_exit(
+            f"{len(clashes)} pairs of instructions of mutually exclusive extensions "
+            f"share halfwords, e.g. {' and '.join(clashes[0])}; select the "
+            "extensions of one configuration"
+        )
+    candidates = sorted(
+        (int(instr["mask"], 16), int(instr["match"], 16), name.replace(".", "_"))
+        for name, instr in instr_dict.items()
+        if is_compressed(int(instr["mask"], 16), int(instr["match"], 16))
+        and for_xlen(instr["extension"], xlen)
+    )
+    names = [""] + sorted(c[2] for c in candidates)
+    index = {name: i for i, name in enumerate(names)}
+    winners: "Dict[int, Candidate]" = {}
+    for candidate in candidates:
+        mask, match, name = candidate
+        free = ~mask & (HALFWORDS - 1)
+        # every subset of the free bits, starting from the empty one
+        bits = 0
+        while True:
+            halfword = match | bits
+            current = winners.get(halfword)
+            if current is None:
+                winners[halfword] = candidate
+            else:
+                priority = takes_priority(candidate, current)
+                if priority is None:
+                    log_and_exit(
+                        f"Cannot decide between {current[2]} and {name} for the "
+                        f"halfword {hex(halfword)}"
+                    )
+                if priority:
+                    winners[halfword] = candidate
+            bits = (bits - free) & free
+            if bits == 0:
+                break
+
+    table = array("B" if len(names) <= 256 else "H", [0]) * HALFWORDS
+    for halfword, (_mask, _match, name) in winners.items():
+        table[halfword] = index[name]
+    return CompressedLUT(xlen, names, table)
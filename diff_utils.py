@@ -0,0 +1,251 @@
+import argparse
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from binary_utils import BINARY_MAGIC, load_binary
+from constants import pseudo_regex
+from shared_utils import (
+    OPCODES_DIR,
+    InstrDict,
+    OverlapIndex,
+    SingleInstr,
+    extension_overlap_allowed,
+    instruction_overlap_allowed,
+    load_extension_file,
+    log_and_exit,
+    same_base_isa,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# (match, mask) of an instruction, the key of the encoding index
+EncodingKey = Tuple[int, int]
+
+
+def load_db(path: str) -> InstrDict:
+    """Loads an instr_dict.json or instr_dict.bin file, told apart by its magic."""
+    instr_dict: InstrDict = {}
+    try:
+        with open(path, "rb") as f:
+            binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        if binary:
+            with load_binary(path) as db:
+                instr_dict = db.to_instr_dict()
+        else:
+            with open(path, encoding="utf-8") as f:
+                instr_dict = json.load(f)
+    except (OSError, ValueError) as e:
+        log_and_exit(f"Cannot read instruction database {path}: {e}")
+    return instr_dict
+
+
+def encoding_key(instr: SingleInstr) -> EncodingKey:
+    return int(instr["match"], 16), int(instr["mask"], 16)
+
+
+def encoding_index(instr_dict: InstrDict) -> "Dict[EncodingKey, List[str]]":
+    index: "Dict[EncodingKey, List[str]]" = {}
+    for name, instr in instr_dict.items():
+        index.setdefault(encoding_key(instr), []).append(name)
+    return index
+
+
+def encodings_overlap(a: EncodingKey, b: EncodingKey) -> bool:
+    """Whether a word matches both encodings: they agree on their common fixed bits."""
+    return (a[0] ^ b[0]) & a[1] & b[1] == 0
+
+
+def pseudo_op_names(instr_dict: InstrDict, opcodes_dir: str) -> "Set[str]":
+    """
+    The names in instr_dict of the pseudo-ops of its extension files that are
+    in opcodes_dir: the ones of $pseudo_op lines that no file defines, and
+    the <name>_pseudo variants.
+    """
+    pseudo_ops: "Set[str]" = set()
+    defined: "Set[str]" = set()
+    extensions = {ext for instr in instr_dict.values() for ext in instr["extension"]}
+    for ext in sorted(extensions):
+        for path in (
+            os.path.join(opcodes_dir, ext),
+            os.path.join(opcodes_dir, "unratified", ext),
+        ):
+            if os.path.isfile(path):
+                break
+        else:
+            continue
+        extension = load_extension_file(path)
+        defined.update(inst.replace(".", "_") for inst in extension.definitions)
+        for line in extension.lines:
+            if "$pseudo" in line:
+                name = pseudo_regex.findall(line)[0][2].replace(".", "_")
+                pseudo_ops.update((name, f"{name}_pseudo"))
+    return (pseudo_ops - defined) | {n for n in instr_dict if n.endswith("_pseudo")}
+
+
+class Change(NamedTuple):
+    """One difference between two databases, reported under extension."""
+
+    kind: str  # added, removed, renamed, re-encoded, fields, moved or overlap
+    extension: str
+    name: str
+    detail: str
+
+
+class InstrDiff:
+    """
+    Compares two instruction dictionaries. Instructions are matched by name
+    and, for the ones only present on one side, by (match, mask) through a
+    hash index of each dictionary, so that an instruction that changed name
+    only is reported as renamed. Overlaps are only searched for the
+    instructions whose encoding is new (through an OverlapIndex of the new
+    dictionary), and reported if the pair did not overlap before, as
+    create_inst_dict would: in the same base ISA and not for pseudo-ops (of
+    the extension files in opcodes_dir), which are not checked. The whole
+    comparison is linear in the size of the dictionaries, apart from the
+    instructions sharing an overlap bucket with a changed encoding.
+    """
+
+    def __init__(self, old: InstrDict, new: InstrDict, opcodes_dir: str = OPCODES_DIR):
+        self.old = old
+        self.new = new
+        self.changes: "List[Change]" = []
+
+        new_by_key = encoding_index(new)
+        renamed: "Dict[str, str]" = {}  # new name -> old name
+        for name, instr in old.items():
+            if name in new:
+                continue
+            candidates = [
+                n
+                for n in new_by_key.get(encoding_key(instr), [])
+                if n not in old and n not in renamed
+            ]
+            if candidates:
+                renamed[candidates[0]] = name
+                self.add("renamed", candidates[0], f"{name} -> {candidates[0]}")
+            else:
+                self.add("removed", name, instr["encoding"], old)
+
+        touched: "List[str]" = []
+        for name, instr in new.items():
+            old_name = renamed.get(name, name)
+            if old_name not in old:
+                self.add("added", name, instr["encoding"])
+                touched.append(name)
+                continue
+            before = old[old_name]
+            if encoding_key(before) != encoding_key(instr):
+                self.add(
+                    "re-encoded", name, f"{before['encoding']} -> {instr['encoding']}"
+                )
+                touched.append(name)
+            if before["variable_fields"] != instr["variable_fields"]:
+                self.add(
+                    "fields",
+                    name,
+                    f"{' '.join(before['variable_fields'])} -> "
+                    f"{' '.join(instr['variable_fields'])}",
+                )
+            if before["extension"] != instr["extension"]:
+                self.add(
+                    "moved",
+                    name,
+                    f"{','.join(before['extension'])} -> {','.join(instr['extension'])}",
+                )
+
+        # pseudo-ops are not checked for overlaps when parsing either
+        pseudo_ops = pseudo_op_names(new, opcodes_dir) if touched else set()
+        overlap_index = OverlapIndex.from_instr_dict(
+            {n: instr for n, instr in new.items() if n not in pseudo_ops}
+        )
+        reported: "Set[Tuple[str, str]]" = set()
+        for name in touched:
+            if name in pseudo_ops:
+                continue
+            key = encoding_key(new[name])
+            for other in overlap_index.candidates(new[name]["encoding"]):
+                pair = (min(name, other), max(name, other))
+                if (
+                    other == name
+                    or pair in reported
+                    or not encodings_overlap(key, encoding_key(new[other]))
+                    or not same_base_isa(
+                        new[name]["extension"][0], new[other]["extension"]
+                    )
+                    or self.overlapped(renamed, name, other)
+                ):
+                    continue
+                reported.add(pair)
+                allowed = instruction_overlap_allowed(name, other) or any(
+                    extension_overlap_allowed(x, y)
+                    for x in new[name]["extension"]
+                    for y in new[other]["extension"]
+                )
+                self.add(
+                    "overlap",
+                    name,
+                    f"{name} and {other}{' (allowed)' if allowed else ''}",
+                )
+
+    def add(
+        self, kind: str, name: str, detail: str, side: "Optional[InstrDict]" = None
+    ):
+        side = self.new if side is None else side
+        self.changes.append(Change(kind, side[name]["extension"][0], name, detail))
+
+    def overlapped(self, renamed: "Dict[str, str]", a: str, b: str) -> bool:
+        """Whether the instructions now named a and b overlapped in old."""
+        a, b = renamed.get(a, a), renamed.get(b, b)
+        return (
+            a in self.old
+            and b in self.old
+            and encodings_overlap(encoding_key(self.old[a]), encoding_key(self.old[b]))
+        )
+
+    def by_extension(self) -> "Dict[str, List[Change]]":
+        """The changes grouped by owning extension, in extension and name order."""
+        groups: "Dict[str, List[Change]]" = {}
+        for change in sorted(self.changes, key=lambda c: (c.extension, c.name)):
+            groups.setdefault(change.extension, []).append(change)
+        return groups
+
+    def summary(self) -> "Dict[str, int]":
+        counts: "Dict[str, int]" = {}
+        for change in self.changes:
+            counts[change.kind] = counts.get(change.kind, 0) + 1
+        return counts
+
+    def report(self) -> "Iterator[str]":
+        for extension, changes in self.by_extension().items():
+            yield f"{extension}:"
+            for change in changes:
+                yield f"  {change.kind:<10} {change.name:<20} {change.detail}"
+        counts = self.summary()
+        yield ", ".join(f"{n} {kind}" for kind, n in sorted(counts.items())) or (
+            "No differences"
+        )
+
+
+def main(argv: "Optional[list[str]]" = None):
+    parser = argparse.ArgumentParser(
+        prog="parse.py diff",
+        description="Compare two instruction databases (instr_dict.json or "
+        "instr_dict.bin) by extension",
+    )
+    parser.add_argument("old", help="Old instruction database")
+    parser.add_argument("new", help="New instruction database")
+    parser.add_argument("--json", action="store_true", help="Print the changes as JSON")
+    args = parser.parse_args(argv)
+
+    diff = InstrDiff(load_db(args.old), load_db(args.new))
+    if args.json:
+        grouped: "Dict[str, Any]" = {
+            ext: [change._asdict() for change in changes]
+            for ext, changes in diff.by_extension().items()
+        }
+        print(json.dumps(grouped, indent=2))
+        return
+    for line in diff.report():
+        print(line)
@@ -0,0 +1,127 @@
+from typing import Dict, Iterable, List, NamedTuple, TextIO, Tuple
+
+import constants
+from shared_utils import InstrDict, arg_lut
+
+# Number of characters collected by write_chunks before writing them out.
+# The backends generate their text in small chunks, so the text held in
+# memory is bounded by this, whatever the size of the output.
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+class InstrSymbol(NamedTuple):
+    """Spellings and values of one instruction, shared by the backends."""
+
+    name: str  # key in the instruction dictionary
+    c_name: str  # name with dots replaced, e.g. DECLARE_INSN(c_name, ...)
+    upper: str  # c_name upper-cased, e.g. MATCH_<upper>
+    compact: str  # upper-cased name without underscores, e.g. Go's A<compact>
+    encoding: str  # 32 characters of 1, 0 and -
+    bitpat: str  # encoding with ? for the variable bits
+    match: int
+    mask: int
+    match_hex: str
+    mask_hex: str
+    extension: str  # owning extension (first entry of "extension")
+    extensions: "Tuple[str, ...]"  # every entry of "extension"
+
+
+class CsrSymbol(NamedTuple):
+    number: int
+    name: str
+    upper: str
+    hex: str
+    rv32_only: bool
+
+
+class CauseSymbol(NamedTuple):
+    number: int
+    name: str
+    upper: str  # spaces replaced, e.g. CAUSE_<upper>
+    lower: str  # spaces replaced
+    hex: str
+
+
+class FieldSymbol(NamedTuple):
+    name: str
+    upper: str  # sanitized, e.g. INSN_FIELD_<upper>
+    msb: int
+    lsb: int
+    mask_hex: str
+
+
+class EmitContext:
+    """
+    Everything the backends print, computed once per instruction dictionary:
+    the symbols of its instructions (in dictionary order and grouped by
+    owning extension, sorted by extension name) and of the CSR, cause and
+    arg_lut field tables.
+    The CSR and cause tables are looked up on the constants module, so that
+    importing this module does not load them.
+    """
+
+    def __init__(self, instr_dict: InstrDict):
+        self.instrs: "List[InstrSymbol]" = []
+        self.extensions: "Dict[str, List[InstrSymbol]]" = {}
+        for name, instr in instr_dict.items():
+            c_name = name.replace(".", "_")
+            symbol = InstrSymbol(
+                name=name,
+                c_name=c_name,
+                upper=c_name.upper(),
+                compact=name.upper().replace("_", ""),
+                encoding=instr["encoding"],
+                bitpat=instr["encoding"].replace("-", "?"),
+                match=int(instr["match"], 16),
+                mask=int(instr["mask"], 16),
+                match_hex=instr["match"],
+                mask_hex=instr["mask"],
+                extension=instr["extension"][0],
+                extensions=tuple(instr["extension"]),
+            )
+            self.instrs.append(symbol)
+            self.extensions.setdefault(symbol.extension, []).append(symbol)
+        self.extensions = dict(sorted(self.extensions.items()))
+
+        self.csrs: "List[CsrSymbol]" = [
+            CsrSymbol(num, name, name.upper(), hex(num), rv32_only)
+            for table, rv32_only in ((constants.csrs, False), (constants.csrs32, True))
+            for num, name in table
+        ]
+        self.causes: "List[CauseSymbol]" = [
+            CauseSymbol(
+                num,
+                name,
+                name.upper().replace(" ", "_"),
+                name.lower().replace(" ", "_"),
+                hex(num),
+            )
+            for num, name in constants.causes
+        ]
+        self.fields: "List[FieldSymbol]" = [
+            FieldSymbol(
+                name,
+                name.replace(" ", "_").replace("=", "_eq_").upper(),
+                msb,
+                lsb,
+                hex(((1 << (msb - lsb + 1)) - 1) << lsb),
+            )
+            for name, (msb, lsb) in arg_lut.items()
+        ]
+
+
+def write_chunks(
+    out: TextIO, chunks: "Iterable[str]", buffer_size: int = WRITE_BUFFER_SIZE
+):
+    """Write the text chunks of a backend to out, buffer_size characters at a time."""
+    buffer: "List[str]" = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= buffer_size:
+            out.write("".join(buffer))
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        out.write("".join(buffer))
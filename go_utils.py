@@ -1,20 +1,23 @@
 import logging
 import pprint
-import sys
+from typing import Iterator, TextIO
 
-from constants import csrs
+from emit_utils import EmitContext, write_chunks
 from shared_utils import InstrDict, signed
 
 pp = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
+# Generator named in the "Code generated" line by default, e.g. by
+# parse.generate, so that inst.go only changes with the instructions. The
+# command line quotes itself instead.
+GENERATOR = "parse.py"
 
-def make_go(instr_dict: InstrDict):
 
-    args = " ".join(sys.argv)
-    prelude = f"""// Code generated by {args}; DO NOT EDIT."""
+def go_chunks(ctx: EmitContext, args: str) -> "Iterator[str]":
+    yield f"""// Code generated by {args}; DO NOT EDIT."""
 
-    prelude += """
+    yield """
 package riscv
 
 import "cmd/internal/obj"
@@ -32,33 +35,35 @@ func encode(a obj.As) *inst {
 	switch a {
 """
 
-    csrs_map_str = """  }
-	return nil
-}
-
-var csrs = map[uint16]string {
-"""
-
-    endoffile = """}
-"""
-
-    instr_str = ""
-    for i in instr_dict:
-        enc_match = int(instr_dict[i]["match"], 0)
+    for i in ctx.instrs:
+        enc_match = i.match
         opcode = (enc_match >> 0) & ((1 << 7) - 1)
         funct3 = (enc_match >> 12) & ((1 << 3) - 1)
         rs1 = (enc_match >> 15) & ((1 << 5) - 1)
         rs2 = (enc_match >> 20) & ((1 << 5) - 1)
         csr = (enc_match >> 20) & ((1 << 12) - 1)
         funct7 = (enc_match >> 25) & ((1 << 7) - 1)
-        instr_str += f"""  case A{i.upper().replace("_","")}:
+        yield f"""  case A{i.compact}:
     return &inst{{ {hex(opcode)}, {hex(funct3)}, {hex(rs1)}, {hex(rs2)}, {signed(csr,12)}, {hex(funct7)} }}
 """
-    for num, name in sorted(csrs, key=lambda row: row[0]):
-        csrs_map_str += f'{hex(num)} : "{name.upper()}",\n'
 
+    yield """  }
+	return nil
+}
+
+var csrs = map[uint16]string {
+"""
+    for c in sorted((c for c in ctx.csrs if not c.rv32_only), key=lambda c: c.number):
+        yield f'{c.hex} : "{c.upper}",\n'
+
+    yield """}
+"""
+
+
+def write_go(ctx: EmitContext, out: TextIO, args: str = GENERATOR):
+    write_chunks(out, go_chunks(ctx, args))
+
+
+def make_go(instr_dict: InstrDict):
     with open("inst.go", "w", encoding="utf-8") as file:
-        file.write(prelude)
-        file.write(instr_str)
-        file.write(csrs_map_str)
-        file.write(endoffile)
+        write_go(EmitContext(instr_dict), file)
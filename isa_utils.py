@@ -0,0 +1,466 @@
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from constants import pseudo_regex
+from shared_utils import (
+    OPCODES_DIR,
+    InstrDict,
+    OverlapIndex,
+    SingleInstr,
+    check_instruction_overlaps,
+    extension_file_names,
+    find_instruction_line,
+    log_and_exit,
+    process_enc_line,
+    process_imported_instructions,
+    process_standard_instructions,
+    read_lines,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Extensions implied by an extension, applied until nothing changes. The
+# compressed subsets of "c" depend on the other extensions and XLEN, see
+# implied_extensions.
+IMPLIED: "Dict[str, Tuple[str, ...]]" = {
+    "g": ("i", "m", "a", "f", "d", "zicsr", "zifencei"),
+    "e": ("i",),
+    "b": ("zba", "zbb", "zbs"),
+    "f": ("zicsr",),
+    "d": ("f",),
+    "q": ("d",),
+    "v": ("d",),
+    "zfh": ("zfhmin",),
+    "zfhmin": ("f",),
+    "zfa": ("f",),
+    "c": ("zca",),
+    "zcb": ("zca",),
+    "zcmp": ("zca",),
+    "zcmop": ("zca",),
+    "zcmt": ("zca", "zicsr"),
+    "zcd": ("zca", "d"),
+    "zcf": ("zca", "f"),
+    "zk": ("zkn", "zkr", "zkt"),
+    "zkn": ("zbkb", "zbkc", "zbkx", "zkne", "zknd", "zknh"),
+    "zks": ("zbkb", "zbkc", "zbkx", "zksed", "zksh"),
+    "zvkn": ("zvkned", "zvknhb", "zvkb", "zvkt"),
+    "zvks": ("zvksed", "zvksh", "zvkb", "zvkt"),
+    "zvkng": ("zvkn", "zvkg"),
+    "zvksg": ("zvks", "zvkg"),
+    "zvbb": ("zvkb",),
+}
+
+# Profiles: name -> (XLEN, mandatory extensions). Only the extensions that
+# define instructions matter; the ones with an extension file of their own
+# select it.
+RVA20U64 = ("i", "m", "a", "f", "d", "c", "zicsr", "zicntr")
+RVA22U64 = RVA20U64 + (
+    "zihintpause",
+    "zba",
+    "zbb",
+    "zbs",
+    "zicbom",
+    "zicbop",
+    "zicboz",
+    "zfhmin",
+    "zkt",
+)
+RVA23U64 = RVA22U64 + (
+    "v",
+    "zvfhmin",
+    "zvbb",
+    "zvkt",
+    "zihintntl",
+    "zicond",
+    "zimop",
+    "zcmop",
+    "zcb",
+    "zfa",
+    "zawrs",
+)
+PROFILES: "Dict[str, Tuple[int, Tuple[str, ...]]]" = {
+    "RVI20U32": (32, ("i",)),
+    "RVI20U64": (64, ("i",)),
+    "RVA20U64": (64, RVA20U64),
+    "RVA22U64": (64, RVA22U64),
+    "RVA22S64": (64, RVA22U64 + ("zifencei", "s", "svinval")),
+    "RVA23U64": (64, RVA23U64),
+    "RVA23S64": (64, RVA23U64 + ("zifencei", "s", "svinval", "h")),
+    "RVB23U64": (
+        64,
+        tuple(ext for ext in RVA23U64 if ext not in ("v", "zvfhmin", "zvbb", "zvkt")),
+    ),
+}
+
+# Tokens of extension file names that do not name the extension they need:
+# token -> the extensions of which one is enough (none: no requirement).
+FILE_TOKENS: "Dict[str, Tuple[str, ...]]" = {
+    "system": ("i",),
+    "zicbo": ("zicbom", "zicbop", "zicboz"),
+    "aliases": (),
+}
+
+# Extensions that need no file of their own: they define no instructions
+# (zkt, zvkt), a hint of another file (pause in rv_i) or a subset of V.
+WITHOUT_FILE = frozenset(("zihintpause", "zkt", "zvkt", "zvfhmin"))
+
+# The compressed instructions of a file named rv*_c_<token>.
+COMPRESSED_TOKENS = {"d": "zcd", "f": "zcf"}
+
+VERSION_REGEX = re.compile(r"\d+(p\d+)?$")
+SINGLE_LETTER_REGEX = re.compile(r"([a-z])(\d+(?:p\d+)?)?")
+
+
+def parse_isa(isa: str) -> "Tuple[int, List[str]]":
+    """
+    The XLEN and extensions of an ISA string such as rv64imafdc_zicsr_zba,
+    in order and without their versions. Single-letter extensions follow
+    the base; an underscore or a z, s or x starts a multi-letter one.
+    """
+    found = re.fullmatch(r"rv(\d+)([a-z0-9_]*)", isa.strip().lower())
+    if found is None:
+        log_and_exit(f"Invalid ISA string {isa!r}")
+    assert found is not None
+    xlen = int(found.group(1))
+    if xlen not in (32, 64):
+        log_and_exit(f"Unsupported XLEN {xlen} in ISA string {isa!r}")
+    tokens = found.group(2).split("_")
+    if not tokens[0] or tokens[0][0] not in "ieg":
+        log_and_exit(f"ISA string {isa!r} does not start with base I, E or G")
+
+    extensions: "List[str]" = []
+    for i, token in enumerate(tokens):
+        if not token:
+            continue
+        position = 0
+        while i == 0 and position < len(token) and token[position] not in "zsx":
+            letter = SINGLE_LETTER_REGEX.match(token, position)
+            if letter is None:
+                log_and_exit(f"Invalid extension {token[position:]!r} in {isa!r}")
+            assert letter is not None
+            extensions.append(letter.group(1))
+            position = letter.end()
+        name = token[position:]
+        if name:
+            if len(name) == 1:
+                log_and_exit(f"Invalid extension {name!r} in {isa!r}")
+            extensions.append(VERSION_REGEX.sub("", name) if name[0] in "zsx" else name)
+    return xlen, extensions
+
+
+def implied_extensions(xlen: int, extensions: "Iterable[str]") -> "Set[str]":
+    """The extensions with all the ones they imply (see IMPLIED)."""
+    enabled = set(extensions)
+    pending = list(enabled)
+    while pending:
+        for ext in IMPLIED.get(pending.pop(), ()):
+            if ext not in enabled:
+                enabled.add(ext)
+                pending.append(ext)
+        if not pending and "c" in enabled:
+            # C includes the compressed loads and stores of the enabled
+            # floating-point extensions, single-precision ones on RV32 only
+            for ext, compressed in (("d", "zcd"), ("f", "zcf")):
+                if ext in enabled and compressed not in enabled:
+                    if compressed == "zcd" or xlen == 32:
+                        enabled.add(compressed)
+                        pending.append(compressed)
+    return enabled
+
+
+def file_requirements(file_name: str) -> "List[Tuple[str, ...]]":
+    """
+    What an extension file needs to be selected, from its name: for each
+    token, the extensions of which one must be enabled, e.g. rv_d_zfa needs
+    d and zfa, rv_c_d needs zcd.
+    """
+    tokens = os.path.basename(file_name).split("_")[1:]
+    if tokens[0] == "c" and len(tokens) > 1 and tokens[1] in COMPRESSED_TOKENS:
+        tokens = [COMPRESSED_TOKENS[tokens[1]]] + tokens[2:]
+    requirements = []
+    for token in tokens:
+        alternatives = FILE_TOKENS.get(token, ("zca",) if token == "c" else (token,))
+        if alternatives:
+            requirements.append(alternatives)
+    return requirements
+
+
+def universe_globs(xlen: int) -> "List[str]":
+    """The globs of all the extension files of XLEN, ratified ones first."""
+    return ["rv_*", f"rv{xlen}_*", "unratified/rv_*", f"unratified/rv{xlen}_*"]
+
+
+def relative_name(file_name: str, opcodes_dir: str) -> str:
+    return os.path.relpath(file_name, opcodes_dir)
+
+
+# Resolved extension files: (ISA string or profile, opcodes_dir) -> names
+# relative to opcodes_dir, in parsing order.
+_resolutions: "Dict[Tuple[str, str], List[str]]" = {}
+
+
+def resolve(
+    xlen: int,
+    extensions: "Iterable[str]",
+    opcodes_dir: str,
+    source: "Optional[str]" = None,
+) -> "List[str]":
+    """
+    The extension files of XLEN whose requirements the extensions (and the
+    ones they imply) meet. With source, the ISA string or profile they come
+    from, the extensions that select no file (and need one) are reported.
+    """
+    extensions = list(extensions)
+    enabled = implied_extensions(xlen, extensions)
+    files: "List[str]" = []
+    used: "Set[str]" = set()
+    for file_name in extension_file_names(universe_globs(xlen), opcodes_dir):
+        requirements = file_requirements(file_name)
+        if all(enabled.intersection(alternatives) for alternatives in requirements):
+            files.append(relative_name(file_name, opcodes_dir))
+            used.update(ext for alternatives in requirements for ext in alternatives)
+    unused = [
+        ext
+        for ext in extensions
+        if ext not in WITHOUT_FILE and not implied_extensions(xlen, [ext]) & used
+    ]
+    if source and unused:
+        logging.warning(f"No extension file for {unused} of {source}")
+    return files
+
+
+def isa_extension_files(isa: str, opcodes_dir: str = OPCODES_DIR) -> "List[str]":
+    """The extension files of an ISA string, e.g. rv64gc_zba_zbb (see parse_isa)."""
+    key = (isa, opcodes_dir)
+    if key not in _resolutions:
+        xlen, extensions = parse_isa(isa)
+        _resolutions[key] = resolve(xlen, extensions, opcodes_dir, isa)
+    return _resolutions[key]
+
+
+def profile_extension_files(
+    profile: str, opcodes_dir: str = OPCODES_DIR
+) -> "List[str]":
+    """The extension files of a profile of PROFILES, e.g. RVA23U64."""
+    if profile not in PROFILES:
+        log_and_exit(f"Unknown profile {profile}, expected one of {sorted(PROFILES)}")
+    key = (profile, opcodes_dir)
+    if key not in _resolutions:
+        xlen, extensions = PROFILES[profile]
+        _resolutions[key] = resolve(xlen, extensions, opcodes_dir, profile)
+    return _resolutions[key]
+
+
+class IsaSelector:
+    """
+    The instructions of a set of extension files (all the ones of one XLEN
+    for isa_selector), parsed once, with the files of every instruction as
+    a bitset (one bit per file), so that the instruction dictionary of any
+    selection of the files is a mask test per instruction instead of a
+    parse. select() gives the same dictionary as create_inst_dict on the
+    selected files, in the order of file_names.
+
+    Overlaps are checked over all the files unless check_overlap is False,
+    in which case check_overlaps() checks each selection on its own.
+    """
+
+    def __init__(
+        self,
+        file_names: "List[str]",
+        opcodes_dir: str = OPCODES_DIR,
+        check_overlap: bool = True,
+    ):
+        self.opcodes_dir = opcodes_dir
+        self.bits = {
+            os.path.basename(file_name): 1 << i
+            for i, file_name in enumerate(file_names)
+        }
+
+        self.instr_dict: InstrDict = {}
+        overlap_index = OverlapIndex()
+        lines = {file_name: read_lines(file_name) for file_name in file_names}
+        for file_name in file_names:
+            process_standard_instructions(
+                lines[file_name],
+                self.instr_dict,
+                file_name,
+                overlap_index,
+                check_overlap,
+            )
+        # files defining each instruction, then the ones importing it too
+        self.standard = {
+            name: self.mask(instr["extension"])
+            for name, instr in self.instr_dict.items()
+        }
+        # (file bit, name, file) of every definition, in parsing order
+        self.definitions = sorted(
+            (
+                (self.bits[ext], name, ext)
+                for name, instr in self.instr_dict.items()
+                for ext in instr["extension"]
+            ),
+            key=lambda definition: definition[0],
+        )
+        for file_name in file_names:
+            process_imported_instructions(
+                lines[file_name], self.instr_dict, file_name, opcodes_dir
+            )
+        self.members = {
+            name: self.mask(instr["extension"])
+            for name, instr in self.instr_dict.items()
+        }
+
+        # (file bit, instruction it is a pseudo-op of, name, instruction)
+        self.pseudo_ops: "List[Tuple[int, str, str, SingleInstr]]" = []
+        for file_name in file_names:
+            for line in lines[file_name]:
+                if "$pseudo" not in line:
+                    continue
+                found = pseudo_regex.findall(line)[0]
+                ext, orig_inst, pseudo_inst, line_content = found
+                find_instruction_line(
+                    ext, orig_inst, opcodes_dir, file_name, f"pseudo_op {pseudo_inst}"
+                )
+                name, single_dict = process_enc_line(
+                    f"{pseudo_inst} {line_content}", file_name
+                )
+                self.pseudo_ops.append(
+                    (
+                        self.bits[os.path.basename(file_name)],
+                        orig_inst.replace(".", "_"),
+                        name,
+                        single_dict,
+                    )
+                )
+
+    def mask(self, files: "Iterable[str]") -> int:
+        """The bitset of extension files (names, optionally with a directory)."""
+        mask = 0
+        for file_name in files:
+            base = os.path.basename(file_name)
+            if base not in self.bits:
+                raise ValueError(f"Extension file {file_name} is not parsed")
+            mask |= self.bits[base]
+        return mask
+
+    def arg_aliases(self, files: "Iterable[str]") -> "Set[str]":
+        """
+        The arg_lut aliases, e.g. rs2=rs1, that create_inst_dict would add
+        for the given extension files: the ones of their instructions and
+        pseudo-ops, included or not.
+        """
+        selected = self.mask(files)
+        fields = [
+            instr["variable_fields"]
+            for name, instr in self.instr_dict.items()
+            if self.members[name] & selected
+        ]
+        fields += [
+            single_dict["variable_fields"]
+            for bit, _orig_inst, _name, single_dict in self.pseudo_ops
+            if bit & selected
+        ]
+        return {arg for args in fields for arg in args if "=" in arg}
+
+    def check_overlaps(self, files: "Iterable[str]"):
+        """
+        Exits if instructions of the given extension files overlap, as
+        create_inst_dict would on these files.
+        """
+        selected = self.mask(files)
+        instr_dict: InstrDict = {}
+        overlap_index = OverlapIndex()
+        for bit, name, ext_name in self.definitions:
+            if not bit & selected:
+                continue
+            if name in instr_dict:
+                instr_dict[name]["extension"].append(ext_name)
+                continue
+            single_dict = self.instr_dict[name]
+            check_instruction_overlaps(
+                instr_dict, name, single_dict, ext_name, overlap_index
+            )
+            copy: SingleInstr = {**single_dict, "extension": [ext_name]}
+            instr_dict[name] = copy
+            overlap_index.add(name, single_dict["encoding"])
+
+    def select(
+        self,
+        files: "Iterable[str]",
+        include_pseudo: bool = False,
+        include_pseudo_ops: "Optional[List[str]]" = None,
+    ) -> InstrDict:
+        """The instruction dictionary of the given extension files."""
+        selected = self.mask(files)
+        pseudo_ops = frozenset(include_pseudo_ops or ())
+
+        def instr_in(instr: SingleInstr) -> SingleInstr:
+            extension = [e for e in instr["extension"] if self.bits[e] & selected]
+            # a copy, as the outputs may update the instructions in place
+            copy: SingleInstr = {
+                **instr,
+                "variable_fields": list(instr["variable_fields"]),
+                "extension": extension,
+            }
+            return copy
+
+        instr_dict: InstrDict = {
+            name: instr_in(instr)
+            for name, instr in self.instr_dict.items()
+            if self.standard.get(name, 0) & selected
+        }
+        # pseudo-ops and imported instructions follow in the order of
+        # create_inst_dict, as whether they are included depends on the
+        # instructions already in
+        for bit, orig_inst, name, single_dict in self.pseudo_ops:
+            if not bit & selected:
+                continue
+            if orig_inst not in instr_dict or include_pseudo or name in pseudo_ops:
+                if name not in instr_dict:
+                    instr_dict[name] = instr_in(single_dict)
+                elif single_dict["match"] != instr_dict[name]["match"]:
+                    instr_dict[f"{name}_pseudo"] = instr_in(single_dict)
+                else:
+                    instr_dict[name]["extension"].extend(single_dict["extension"])
+        for name, instr in self.instr_dict.items():
+            if (
+                self.members[name] & selected
+                and not self.standard.get(name, 0) & selected
+            ):
+                if name in instr_dict:
+                    instr_dict[name]["extension"].extend(instr_in(instr)["extension"])
+                else:
+                    instr_dict[name] = instr_in(instr)
+        return instr_dict
+
+
+# Parsed instructions per (XLEN, opcodes_dir), see IsaSelector.
+_selectors: "Dict[Tuple[int, str], IsaSelector]" = {}
+
+
+def isa_selector(xlen: int, opcodes_dir: str = OPCODES_DIR) -> IsaSelector:
+    key = (xlen, opcodes_dir)
+    if key not in _selectors:
+        file_names = extension_file_names(universe_globs(xlen), opcodes_dir)
+        _selectors[key] = IsaSelector(file_names, opcodes_dir)
+    return _selectors[key]
+
+
+def select_isa(
+    isa: str,
+    include_pseudo: bool = False,
+    include_pseudo_ops: "Optional[List[str]]" = None,
+    opcodes_dir: str = OPCODES_DIR,
+) -> InstrDict:
+    """The instruction dictionary of an ISA string, or of a profile of PROFILES."""
+    if isa in PROFILES:
+        xlen = PROFILES[isa][0]
+        files = profile_extension_files(isa, opcodes_dir)
+    else:
+        xlen = parse_isa(isa)[0]
+        files = isa_extension_files(isa, opcodes_dir)
+    return isa_selector(xlen, opcodes_dir).select(
+        files, include_pseudo, include_pseudo_ops
+    )
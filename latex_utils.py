@@ -1,8 +1,9 @@
 import logging
 import pprint
-from typing import TextIO
+from typing import Any, Dict, Iterator, List, TextIO, Tuple, Union
 
 from constants import latex_fixed_fields, latex_inst_type, latex_mapping
+from emit_utils import write_chunks
 from shared_utils import InstrDict, arg_lut, create_inst_dict
 
 pp = pprint.PrettyPrinter(indent=2)
@@ -10,6 +11,11 @@ logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
 
 def make_priv_latex_table():
+    with open("priv-instr-table.tex", "w", encoding="utf-8") as latex_file:
+        write_priv_latex_table(latex_file)
+
+
+def write_priv_latex_table(latex_file: TextIO):
     type_list = ["R-type", "I-type"]
     system_instr = ["_h", "_s", "_system", "_svinval", "64_h", "_svinval_h"]
     dataset_list = [(system_instr, "Trap-Return Instructions", ["sret", "mret"], False)]
@@ -74,11 +80,15 @@ def make_priv_latex_table():
         )
     )
     caption = "\\caption{RISC-V Privileged Instructions}"
-    with open("priv-instr-table.tex", "w", encoding="utf-8") as latex_file:
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
 
 def make_latex_table():
+    with open("instr-table.tex", "w", encoding="utf-8") as latex_file:
+        write_latex_table(latex_file)
+
+
+def write_latex_table(latex_file: TextIO):
     """
     This function is mean to create the instr-table.tex that is meant to be used
     by the riscv-isa-manual. This function basically creates a single latext
@@ -98,90 +108,189 @@ def make_latex_table():
     The last table only has to be given a caption - as per the policy of the
     riscv-isa-manual.
     """
-    # open the file and use it as a pointer for all further dumps
-    with open("instr-table.tex", "w", encoding="utf-8") as latex_file:
+    # create the rv32i table first. Here we set the caption to empty. We use the
+    # files rv_i and rv32_i to capture instructions relevant for rv32i
+    # configuration. The dataset is a list of 4-element tuples :
+    # (list_of_extensions, title, list_of_instructions, include_pseudo_ops). If list_of_instructions
+    # is empty then it indicates that all instructions of the all the extensions
+    # in list_of_extensions need to be dumped. If not empty, then only the
+    # instructions listed in list_of_instructions will be dumped into latex.
+    caption = ""
+    type_list = ["R-type", "I-type", "S-type", "B-type", "U-type", "J-type"]
+    dataset_list: list[tuple[list[str], str, list[str], bool]] = [
+        (["_i", "32_i"], "RV32I Base Instruction Set", [], False)
+    ]
+    dataset_list.append((["_i"], "", ["fence_tso", "pause"], True))
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+
+    type_list = ["R-type", "I-type", "S-type"]
+    dataset_list = [
+        (["64_i"], "RV64I Base Instruction Set (in addition to RV32I)", [], False)
+    ]
+    dataset_list.append(
+        (["_zifencei"], "RV32/RV64 Zifencei Standard Extension", [], False)
+    )
+    dataset_list.append((["_zicsr"], "RV32/RV64 Zicsr Standard Extension", [], False))
+    dataset_list.append((["_m", "32_m"], "RV32M Standard Extension", [], False))
+    dataset_list.append(
+        (["64_m"], "RV64M Standard Extension (in addition to RV32M)", [], False)
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
-        # create the rv32i table first. Here we set the caption to empty. We use the
-        # files rv_i and rv32_i to capture instructions relevant for rv32i
-        # configuration. The dataset is a list of 4-element tuples :
-        # (list_of_extensions, title, list_of_instructions, include_pseudo_ops). If list_of_instructions
-        # is empty then it indicates that all instructions of the all the extensions
-        # in list_of_extensions need to be dumped. If not empty, then only the
-        # instructions listed in list_of_instructions will be dumped into latex.
-        caption = ""
-        type_list = ["R-type", "I-type", "S-type", "B-type", "U-type", "J-type"]
-        dataset_list: list[tuple[list[str], str, list[str], bool]] = [
-            (["_i", "32_i"], "RV32I Base Instruction Set", [], False)
-        ]
-        dataset_list.append((["_i"], "", ["fence_tso", "pause"], True))
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
-
-        type_list = ["R-type", "I-type", "S-type"]
-        dataset_list = [
-            (["64_i"], "RV64I Base Instruction Set (in addition to RV32I)", [], False)
-        ]
-        dataset_list.append(
-            (["_zifencei"], "RV32/RV64 Zifencei Standard Extension", [], False)
-        )
-        dataset_list.append(
-            (["_zicsr"], "RV32/RV64 Zicsr Standard Extension", [], False)
-        )
-        dataset_list.append((["_m", "32_m"], "RV32M Standard Extension", [], False))
-        dataset_list.append(
-            (["64_m"], "RV64M Standard Extension (in addition to RV32M)", [], False)
-        )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    type_list = ["R-type"]
+    dataset_list = [(["_a"], "RV32A Standard Extension", [], False)]
+    dataset_list.append(
+        (["64_a"], "RV64A Standard Extension (in addition to RV32A)", [], False)
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
-        type_list = ["R-type"]
-        dataset_list = [(["_a"], "RV32A Standard Extension", [], False)]
-        dataset_list.append(
-            (["64_a"], "RV64A Standard Extension (in addition to RV32A)", [], False)
-        )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    type_list = ["R-type", "R4-type", "I-type", "S-type"]
+    dataset_list = [(["_f"], "RV32F Standard Extension", [], False)]
+    dataset_list.append(
+        (["64_f"], "RV64F Standard Extension (in addition to RV32F)", [], False)
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
-        type_list = ["R-type", "R4-type", "I-type", "S-type"]
-        dataset_list = [(["_f"], "RV32F Standard Extension", [], False)]
-        dataset_list.append(
-            (["64_f"], "RV64F Standard Extension (in addition to RV32F)", [], False)
-        )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    type_list = ["R-type", "R4-type", "I-type", "S-type"]
+    dataset_list = [(["_d"], "RV32D Standard Extension", [], False)]
+    dataset_list.append(
+        (["64_d"], "RV64D Standard Extension (in addition to RV32D)", [], False)
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
-        type_list = ["R-type", "R4-type", "I-type", "S-type"]
-        dataset_list = [(["_d"], "RV32D Standard Extension", [], False)]
-        dataset_list.append(
-            (["64_d"], "RV64D Standard Extension (in addition to RV32D)", [], False)
-        )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    type_list = ["R-type", "R4-type", "I-type", "S-type"]
+    dataset_list = [(["_q"], "RV32Q Standard Extension", [], False)]
+    dataset_list.append(
+        (["64_q"], "RV64Q Standard Extension (in addition to RV32Q)", [], False)
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
 
-        type_list = ["R-type", "R4-type", "I-type", "S-type"]
-        dataset_list = [(["_q"], "RV32Q Standard Extension", [], False)]
-        dataset_list.append(
-            (["64_q"], "RV64Q Standard Extension (in addition to RV32Q)", [], False)
+    caption = "\\caption{Instruction listing for RISC-V}"
+    type_list = ["R-type", "R4-type", "I-type", "S-type"]
+    dataset_list = [
+        (["_zfh", "_d_zfh", "_q_zfh"], "RV32Zfh Standard Extension", [], False)
+    ]
+    dataset_list.append(
+        (
+            ["64_zfh"],
+            "RV64Zfh Standard Extension (in addition to RV32Zfh)",
+            [],
+            False,
         )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
-
-        caption = "\\caption{Instruction listing for RISC-V}"
-        type_list = ["R-type", "R4-type", "I-type", "S-type"]
-        dataset_list = [
-            (["_zfh", "_d_zfh", "_q_zfh"], "RV32Zfh Standard Extension", [], False)
-        ]
-        dataset_list.append(
-            (
-                ["64_zfh"],
-                "RV64Zfh Standard Extension (in addition to RV32Zfh)",
-                [],
-                False,
-            )
+    )
+    make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+
+    ## The following is demo to show that Compressed instructions can also be
+    # dumped in the same manner as above
+
+    # type_list = ['']
+    # dataset_list = [(['_c', '32_c', '32_c_f','_c_d'],'RV32C Standard Extension', [])]
+    # dataset_list.append((['64_c'],'RV64C Standard Extension (in addition to RV32C)', []))
+    # make_ext_latex_table(type_list, dataset_list, latex_file, 16, caption)
+
+
+# A row of a LaTeX encoding table: literal text (the cells, merged), (start,
+# end) slices of the instruction's encoding holding its fixed bits, and None
+# where the name of the instruction or type goes.
+LatexRowLayout = Tuple[Union[str, Tuple[int, int], None], ...]
+
+# Row layouts shared by the instructions and types with the same variable
+# fields (and arg_lut positions) and, for instructions, the same fixed-bit
+# boundaries. Keyed on the positions so that reloaded tables are honoured.
+_row_layouts: "Dict[Tuple[Any, ...], LatexRowLayout]" = {}
+
+# fixed bits of an encoding, replaced by x for the layout key
+FIXED_BITS = str.maketrans("01", "xx")
+
+
+def row_layout(
+    fields: "list[tuple[int, int, Union[str, Tuple[int, int]]]]", ilen: int
+) -> LatexRowLayout:
+    """
+    Lay out a table row from its (msb, lsb, cell contents) fields: one
+    multicolumn cell per field, in decreasing order of msb.
+    """
+    cline = f"\\cline{{2-{ilen+1}}}\n&\n\n"
+    if not fields:
+        return (cline,)
+    fields.sort(key=lambda y: y[0], reverse=True)
+    parts: "List[Union[str, Tuple[int, int], None]]" = []
+    for r, (msb, lsb, name) in enumerate(fields):
+        border = "|c|" if r in (0, len(fields) - 1) else "c|"
+        parts.append(f"\\multicolumn{{{msb - lsb + 1}}}{{{border}}}{{")
+        parts.append(name)
+        parts.append("} & " if r == len(fields) - 1 else "} &\n")
+    parts.extend([None, f" \\\\\n{cline}"])
+
+    # merge the literal text of neighbouring cells
+    merged: "List[Union[str, Tuple[int, int], None]]" = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return tuple(merged)
+
+
+def type_row_layout(inst_type: str, ilen: int) -> LatexRowLayout:
+    """Layout of the header row of an instruction type of latex_inst_type."""
+    variable_fields = latex_inst_type[inst_type]["variable_fields"]
+    key = ("type", ilen, tuple((f, arg_lut[f]) for f in variable_fields))
+    if key not in _row_layouts:
+        _row_layouts[key] = row_layout(
+            [(*arg_lut[f], latex_mapping.get(f, f)) for f in variable_fields], ilen
         )
-        make_ext_latex_table(type_list, dataset_list, latex_file, 32, caption)
+    return _row_layouts[key]
 
-        ## The following is demo to show that Compressed instructions can also be
-        # dumped in the same manner as above
 
-        # type_list = ['']
-        # dataset_list = [(['_c', '32_c', '32_c_f','_c_d'],'RV32C Standard Extension', [])]
-        # dataset_list.append((['64_c'],'RV64C Standard Extension (in addition to RV32C)', []))
-        # make_ext_latex_table(type_list, dataset_list, latex_file, 16, caption)
+def instr_row_layout(variable_fields: "list[str]", encoding: str) -> LatexRowLayout:
+    """
+    Layout of the row of an instruction: its variable fields, then the runs
+    of fixed bits between them, split at the latex_fixed_fields boundaries.
+    """
+    signature = encoding.translate(FIXED_BITS)
+    key = ("instr", signature, tuple((f, arg_lut[f]) for f in variable_fields))
+    if key in _row_layouts:
+        return _row_layouts[key]
+
+    fields: "list[tuple[int, int, Union[str, Tuple[int, int]]]]" = [
+        (*arg_lut[f], latex_mapping.get(f, f.replace("_", ".")))
+        for f in variable_fields
+    ]
+    # walk the bits from the msb; encoding[start:end] are the fixed bits
+    # collected since the last variable bit or boundary
+    ilen = len(encoding)
+    msb = ilen - 1
+    start = end = 0
+    for r in range(ilen):
+        if (msb, ilen - r) in latex_fixed_fields:
+            fields.append((msb, ilen - r, (start, end)))
+            msb = ilen - 1 - r
+            start = end = r
+        if signature[r] == "-":
+            if end > start:
+                fields.append((msb, ilen - r, (start, end)))
+            msb = ilen - 1 - r - 1
+            start = end = r + 1
+        else:
+            end = r + 1
+    if end > start:
+        fields.append((msb, 0, (start, end)))
+
+    _row_layouts[key] = row_layout(fields, ilen)
+    return _row_layouts[key]
+
+
+def latex_row(layout: LatexRowLayout, label: str, encoding: str = "") -> str:
+    """Fill in a row layout with the fixed bits of encoding and the label."""
+    return "".join(
+        (
+            part
+            if isinstance(part, str)
+            else label if part is None else encoding[part[0] : part[1]]
+        )
+        for part in layout
+    )
 
 
 def make_ext_latex_table(
@@ -192,8 +301,22 @@ def make_ext_latex_table(
     caption: str,
 ):
     """
-    For a given collection of extensions this function dumps out a complete
-    latex table which includes the encodings of the instructions.
+    Writes the latex table of ext_latex_table_chunks into latex_file through
+    a buffer, so that the table is never held in memory as a whole.
+    """
+    write_chunks(latex_file, ext_latex_table_chunks(type_list, dataset, ilen, caption))
+
+
+def ext_latex_table_chunks(
+    type_list: "list[str]",
+    dataset: "list[tuple[list[str], str, list[str], bool]]",
+    ilen: int,
+    caption: str,
+) -> "Iterator[str]":
+    """
+    For a given collection of extensions this function generates a complete
+    latex table which includes the encodings of the instructions, in chunks
+    of about one table row.
 
     The ilen input indicates the length of the instruction for which the table
     is created.
@@ -206,8 +329,6 @@ def make_ext_latex_table(
     Note, all elements of this list must be present in the latex_inst_type
     dictionary defined in constants.py
 
-    The latex_file is a file pointer to which the latex-table will dumped into
-
     The dataset is a list of 3-element tuples containing:
         (list_of_extensions, title, list_of_instructions)
     The list_of_extensions must contain all the set of extensions whose
@@ -240,6 +361,10 @@ def make_ext_latex_table(
         the position and assign the same string as the data of the
         multicolumn entry in the table.
 
+        The cells only depend on the variable fields and on which bits are
+        fixed, so each such row layout is built once (see instr_row_layout)
+        and only filled in with the fixed bits and name of every instruction.
+
     """
     column_size = "".join(["p{0.002in}"] * (ilen + 1))
 
@@ -283,59 +408,25 @@ def make_ext_latex_table(
 """
     )
 
-    # depending on the type_list input we create a subset dictionary of
-    # latex_inst_type dictionary present in constants.py
-    type_dict = {
-        key: value for key, value in latex_inst_type.items() if key in type_list
-    }
-
-    # iterate ovr each instruction type and create a table entry
-    for t in type_dict:
-        fields: list[tuple[int, int, str]] = []
-
-        # first capture all "arguments" of the type (funct3, funct7, rd, etc)
-        # and capture their positions using arg_lut.
-        for f in type_dict[t]["variable_fields"]:
-            (msb, lsb) = arg_lut[f]
-            name = f if f not in latex_mapping else latex_mapping[f]
-            fields.append((msb, lsb, name))
-
-        # iterate through the 32 bits, starting from the msb, and assign
-        # argument names to the relevant portions of the instructions. This
-        # information is stored as a 3-element tuple containing the msb, lsb
-        # position of the arugment and the name of the argument.
-        msb = ilen - 1
-        y = ""
-        for r in range(0, ilen):
-            if y != "":
-                fields.append((msb, ilen - 1 - r + 1, y))
-                y = ""
-            msb = ilen - 1 - r - 1
-            if r == 31:
-                if y != "":
-                    fields.append((msb, 0, y))
-                y = ""
-
-        # sort the arguments in decreasing order of msb position
-        fields.sort(key=lambda y: y[0], reverse=True)
-
-        # for each argument/string of 1s or 0s, create a multicolumn latex table
-        # entry
-        entry = ""
-        for r, (msb, lsb, name) in enumerate(fields):
-            if r == len(fields) - 1:
-                entry += (
-                    f"\\multicolumn{{{msb - lsb + 1}}}{{|c|}}{{{name}}} & {t} \\\\\n"
-                )
-            elif r == 0:
-                entry += f"\\multicolumn{{{msb - lsb + 1}}}{{|c|}}{{{name}}} &\n"
-            else:
-                entry += f"\\multicolumn{{{msb - lsb + 1}}}{{c|}}{{{name}}} &\n"
-        entry += f"\\cline{{2-{ilen+1}}}\n&\n\n"
-        type_entries += entry
+    # the header rows of the instruction types, in latex_inst_type order
+    for t in latex_inst_type:
+        if t in type_list:
+            type_entries += latex_row(type_row_layout(t, ilen), t)
+
+    yield f"""
+\\newpage
+
+\\begin{{table}}[p]
+\\begin{{small}}
+\\begin{{center}}
+    \\begin{{tabular}} {{{column_size}l}}
+    {" ".join(['&']*ilen)} \\\\
+
+            &
+{type_entries}
+"""
 
     # for each entry in the dataset create a table
-    content = ""
     for ext_list, title, filter_list, include_pseudo in dataset:
         instr_dict: InstrDict = {}
 
@@ -348,16 +439,27 @@ def make_ext_latex_table(
         # instructions that need to be dumped into the latex table
         inst_list = list(instr_dict.keys()) if not filter_list else filter_list
 
+        # the title of the dataset as sub-heading (sort-of) of its entries
+        if title != "":
+            yield f"""
+
+\\multicolumn{{{ilen}}}{{c}}{{}} & \\\\
+\\multicolumn{{{ilen}}}{{c}}{{\\bf {title} }} & \\\\
+\\cline{{2-{ilen+1}}}
+
+            &
+"""
+        else:
+            yield "\n"
+
         # for each instruction create an latex table entry just like how we did
         # above with the instruction-type table.
-        instr_entries = ""
         for inst in inst_list:
             if inst not in instr_dict:
                 logging.error(
                     f"in make_ext_latex_table: Instruction: {inst} not found in instr_dict"
                 )
                 raise SystemExit(1)
-            fields = []
 
             # only if the argument is available in arg_lut we consume it, else
             # throw error.
@@ -367,78 +469,14 @@ def make_ext_latex_table(
                         f"Found variable {f} in instruction {inst} whose mapping is not available"
                     )
                     raise SystemExit(1)
-                (msb, lsb) = arg_lut[f]
-                name = (
-                    f.replace("_", ".") if f not in latex_mapping else latex_mapping[f]
-                )
-                fields.append((msb, lsb, name))
-
-            msb = ilen - 1
-            y = ""
-            if ilen == 16:
-                encoding = instr_dict[inst]["encoding"][16:]
-            else:
-                encoding = instr_dict[inst]["encoding"]
-            for r in range(0, ilen):
-                x = encoding[r]
-                if (msb, ilen - 1 - r + 1) in latex_fixed_fields:
-                    fields.append((msb, ilen - 1 - r + 1, y))
-                    msb = ilen - 1 - r
-                    y = ""
-                if x == "-":
-                    if y != "":
-                        fields.append((msb, ilen - 1 - r + 1, y))
-                        y = ""
-                    msb = ilen - 1 - r - 1
-                else:
-                    y += str(x)
-                if r == ilen - 1:
-                    if y != "":
-                        fields.append((msb, 0, y))
-                    y = ""
-
-            fields.sort(key=lambda y: y[0], reverse=True)
-            entry = ""
-            for r, (msb, lsb, name) in enumerate(fields):
-                if r == len(fields) - 1:
-                    entry += f'\\multicolumn{{{msb - lsb + 1}}}{{|c|}}{{{name}}} & {inst.upper().replace("_",".")} \\\\\n'
-                elif r == 0:
-                    entry += f"\\multicolumn{{{msb - lsb + 1}}}{{|c|}}{{{name}}} &\n"
-                else:
-                    entry += f"\\multicolumn{{{msb - lsb + 1}}}{{c|}}{{{name}}} &\n"
-            entry += f"\\cline{{2-{ilen+1}}}\n&\n\n"
-            instr_entries += entry
-
-        # once an entry of the dataset is completed we create the whole table
-        # with the title of that dataset as sub-heading (sort-of)
-        if title != "":
-            content += f"""
 
-\\multicolumn{{{ilen}}}{{c}}{{}} & \\\\
-\\multicolumn{{{ilen}}}{{c}}{{\\bf {title} }} & \\\\
-\\cline{{2-{ilen+1}}}
+            encoding = instr_dict[inst]["encoding"][32 - ilen :]
+            layout = instr_row_layout(instr_dict[inst]["variable_fields"], encoding)
+            entry = latex_row(layout, inst.upper().replace("_", "."), encoding)
+            yield entry
+        yield "\n"
 
-            &
-{instr_entries}
-"""
-        else:
-            content += f"""
-{instr_entries}
-"""
-
-    header = f"""
-\\newpage
-
-\\begin{{table}}[p]
-\\begin{{small}}
-\\begin{{center}}
-    \\begin{{tabular}} {{{column_size}l}}
-    {" ".join(['&']*ilen)} \\\\
-
-            &
-{type_entries}
-"""
-    endtable = f"""
+    yield f"""
 
 \\end{{tabular}}
 \\end{{center}}
@@ -446,5 +484,3 @@ def make_ext_latex_table(
 {caption}
 \\end{{table}}
 """
-    # dump the contents and return
-    latex_file.write(header + content + endtable)
@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import re
+import sys
+from array import array
+from typing import Dict, Iterator, Optional
+
+from decoder_utils import Histogram, build_decoder, decode, decoder_costs, expected_cost
+from emit_utils import EmitContext
+from shared_utils import InstrDict, create_inst_dict, log_and_exit
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# The instruction word of a trace line: in parentheses as in Spike's commit
+# log, e.g. "core   0: 0x80000000 (0x00000297) auipc t0, 0x0", or else the
+# first token of the line, in hexadecimal.
+TRACE_WORD_REGEX = re.compile(r"\((0x[0-9a-fA-F]+)\)|^\s*((?:0x)?[0-9a-fA-F]+)(?:\s|$)")
+
+# Hottest instructions listed by the report.
+REPORT_TOP = 20
+
+
+def trace_words(path: str) -> "Iterator[int]":
+    """
+    The instruction words of a trace: a file of little-endian u32 words
+    (.bin, e.g. from stream_utils), or a text trace with one word per line.
+    """
+    if path.endswith(".bin"):
+        words = array("I")
+        with open(path, "rb") as f:
+            words.frombytes(f.read())
+        if sys.byteorder == "big":
+            words.byteswap()
+        yield from words
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            found = TRACE_WORD_REGEX.search(line)
+            if found:
+                yield int(found.group(1) or found.group(2), 16)
+
+
+def load_histogram(path: str, instr_dict: InstrDict) -> Histogram:
+    """
+    An instruction histogram: a JSON object of instruction names to counts,
+    or the counts of the instructions decoded from a trace (see
+    trace_words). Names or words of no instruction of instr_dict are
+    reported and left out.
+    """
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            counts = json.load(f)
+        if not isinstance(counts, dict):
+            log_and_exit(f"{path} is not a JSON object of instruction counts")
+        unknown = sorted(set(counts) - set(instr_dict))
+        if unknown:
+            logging.warning(f"Ignoring {len(unknown)} unknown instructions: {unknown}")
+        return {
+            name: float(count) for name, count in counts.items() if name in instr_dict
+        }
+
+    tree = build_decoder(
+        (int(instr["mask"], 16), int(instr["match"], 16), name)
+        for name, instr in instr_dict.items()
+    )
+    histogram: "Dict[str, float]" = {}
+    unknown_words = 0
+    for word in trace_words(path):
+        name = decode(tree, word)
+        if name is None:
+            unknown_words += 1
+        else:
+            histogram[name] = histogram.get(name, 0.0) + 1
+    if unknown_words:
+        logging.warning(f"Ignoring {unknown_words} words of no selected instruction")
+    return histogram
+
+
+def layout_report(instr_dict: InstrDict, weights: Histogram) -> "Iterator[str]":
+    """Compares the decoder laid out for the histogram with the default one."""
+    candidates = [
+        (int(instr["mask"], 16), int(instr["match"], 16), name)
+        for name, instr in instr_dict.items()
+    ]
+    default = build_decoder(candidates)
+    weighted = build_decoder(candidates, weights=weights)
+    before = expected_cost(default, weights)
+    after = expected_cost(weighted, weights)
+    total = sum(weights.values())
+    yield (
+        f"Histogram: {total:.0f} words, {len(weights)} distinct instructions "
+        f"out of {len(instr_dict)}"
+    )
+    change = f" ({(after - before) / before:+.1%})" if before else ""
+    yield f"Expected tests per word: {before:.2f} default, {after:.2f} weighted{change}"
+    yield ""
+    yield f"{'instruction':<20} {'share':>7}  tests (default -> weighted)"
+    default_costs = decoder_costs(default)
+    weighted_costs = decoder_costs(weighted)
+    hottest = sorted(weights.items(), key=lambda item: (-item[1], item[0]))
+    for name, weight in hottest[:REPORT_TOP]:
+        yield (
+            f"{name:<20} {weight / total:>7.1%}  "
+            f"{default_costs[name]:.3g} -> {weighted_costs[name]:.3g}"
+        )
+
+
+def main(argv: "Optional[list[str]]" = None):
+    parser = argparse.ArgumentParser(
+        prog="parse.py layout",
+        description="Lay the decoder out for an instruction histogram and "
+        "report the expected decode cost",
+    )
+    parser.add_argument(
+        "histogram",
+        help="JSON object of instruction counts (.json), binary trace of u32 "
+        "words (.bin) or text trace with one instruction word per line",
+    )
+    parser.add_argument(
+        "extensions",
+        nargs="*",
+        default=["rv*"],
+        help="Extension globs of the decoder (default: rv*)",
+    )
+    parser.add_argument(
+        "-pseudo", action="store_true", help="Include pseudo-instructions"
+    )
+    parser.add_argument(
+        "-python",
+        action="store_true",
+        help="Also generate inst.py with the decoder laid out for the histogram",
+    )
+    args = parser.parse_args(argv)
+
+    instr_dict = dict(sorted(create_inst_dict(args.extensions, args.pseudo).items()))
+    weights = load_histogram(args.histogram, instr_dict)
+    if not weights:
+        log_and_exit("The histogram counts no selected instruction")
+    for line in layout_report(instr_dict, weights):
+        print(line)
+
+    if args.python:
+        # pylint: disable-next=import-outside-toplevel
+        from python_utils import write_python
+
+        with open("inst.py", "w", encoding="utf-8") as python_file:
+            write_python(EmitContext(instr_dict), python_file, weights)
+        logging.info("inst.py generated successfully")
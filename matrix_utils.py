@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+from isa_utils import IsaSelector, isa_extension_files, profile_extension_files
+from shared_utils import OPCODES_DIR, arg_lut, extension_file_names, log_and_exit
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Keys of a configuration of the matrix file.
+CONFIG_KEYS = ("isa", "profile", "extensions", "pseudo")
+
+# Configuration names, used as output directories.
+CONFIG_NAME_REGEX = re.compile(r"[\w+-][\w.+-]*")
+
+
+class MatrixConfig(NamedTuple):
+    """One configuration of a matrix build."""
+
+    files: "List[str]"  # extension files, relative to opcodes_dir
+    include_pseudo: bool
+
+
+def config_files(name: str, config: "Dict[str, Any]", opcodes_dir: str) -> "List[str]":
+    """
+    The extension files of a configuration: the ones of its "isa" string or
+    "profile" and of its "extensions" globs, without duplicates.
+    """
+    files: "List[str]" = []
+    if "isa" in config:
+        files += isa_extension_files(config["isa"], opcodes_dir)
+    if "profile" in config:
+        files += profile_extension_files(config["profile"], opcodes_dir)
+    globs = config.get("extensions", [])
+    if not isinstance(globs, list):
+        log_and_exit(f"The extensions of configuration {name} must be a list")
+    files += [
+        os.path.relpath(file_name, opcodes_dir)
+        for file_name in extension_file_names(globs, opcodes_dir)
+    ]
+    if not files:
+        log_and_exit(f"Configuration {name} selects no extension file")
+    return list(dict.fromkeys(files))
+
+
+def load_matrix(path: str, opcodes_dir: str = OPCODES_DIR) -> "Dict[str, MatrixConfig]":
+    """
+    The configurations of a matrix file, a JSON object of configuration
+    names to objects with any of "isa" (an ISA string), "profile", the
+    "extensions" globs and "pseudo" (to include pseudo-instructions).
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log_and_exit(f"Cannot read matrix file {path}: {e}")
+    if not isinstance(data, dict) or not data:
+        log_and_exit(f"{path} is not a JSON object of configurations")
+
+    configs: "Dict[str, MatrixConfig]" = {}
+    for name, config in data.items():
+        if not CONFIG_NAME_REGEX.fullmatch(name):
+            log_and_exit(f"Invalid configuration name {name!r}")
+        if not isinstance(config, dict):
+            log_and_exit(f"Configuration {name} is not an object")
+        unknown = sorted(set(config) - set(CONFIG_KEYS))
+        if unknown:
+            log_and_exit(f"Unknown keys {unknown} in configuration {name}")
+        configs[name] = MatrixConfig(
+            config_files(name, config, opcodes_dir), bool(config.get("pseudo"))
+        )
+    return configs
+
+
+def parsing_order(files: "List[str]") -> "List[str]":
+    """
+    The extension files in the order every configuration is parsed in:
+    ratified files first, rv_ files before rv32_ and rv64_ ones, each group
+    in reverse name order as the rv* globs list them (see isa_utils).
+    """
+    by_name = sorted(files, key=os.path.basename, reverse=True)
+    return sorted(
+        by_name,
+        key=lambda f: (
+            os.path.dirname(f) != "",
+            not os.path.basename(f).startswith("rv_"),
+        ),
+    )
+
+
+def matrix_selector(
+    configs: "Dict[str, MatrixConfig]", opcodes_dir: str = OPCODES_DIR
+) -> IsaSelector:
+    """
+    The instructions of the union of the files of all configurations,
+    parsed once. Overlaps are left to IsaSelector.check_overlaps, per
+    configuration, as files of different configurations may overlap.
+    """
+    files = parsing_order(
+        list(dict.fromkeys(f for config in configs.values() for f in config.files))
+    )
+    names = {os.path.basename(f) for f in files}
+    if len(names) != len(files):
+        log_and_exit("Extension files of the same name in different directories")
+    return IsaSelector(
+        [os.path.join(opcodes_dir, f) for f in files], opcodes_dir, check_overlap=False
+    )
+
+
+def restrict_arg_lut(table: "Dict[str, Tuple[int, int]]", aliases: "Set[str]"):
+    """
+    Leaves the fields of table in arg_lut, except for the aliases (e.g.
+    rs2=rs1, which parsing adds to arg_lut) not in aliases, so that the
+    field masks of a configuration are the ones parsing its files alone
+    gives. arg_lut is updated in place, see constants.reload_tables.
+    """
+    arg_lut.clear()
+    arg_lut.update(
+        (arg, bits) for arg, bits in table.items() if "=" not in arg or arg in aliases
+    )
@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 
 import argparse
+import importlib
+import io
 import json
 import logging
+import os
 import pprint
+import sys
+from contextlib import contextmanager
+from typing import IO, Any, Callable, ContextManager, Iterator, Optional, Union
 
-from c_utils import make_c
-from chisel_utils import make_chisel
 from constants import emitted_pseudo_ops
-from go_utils import make_go
-from latex_utils import make_latex_table, make_priv_latex_table
-from rust_utils import make_rust
-from shared_utils import add_segmented_vls_insn, create_inst_dict
-from sverilog_utils import make_sverilog
+from emit_utils import EmitContext
+from profile_utils import enable_profiling, span
+from shared_utils import InstrDict, add_segmented_vls_insn, arg_lut, create_inst_dict
 
 LOG_FORMAT = "%(levelname)s:: %(message)s"
 LOG_LEVEL = logging.INFO
@@ -20,6 +22,313 @@ LOG_LEVEL = logging.INFO
 pretty_printer = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 
+# Registry of output writers: backend name -> (module, function). Modules are
+# only imported when their backend is selected. Each writer takes the
+# instruction dictionary (binary, sqlite, shards, rvc_lut) or its shared
+# emit_utils.EmitContext (the source code backends), if it needs either, and
+# the file object to write to, except for "shards", "c_split" and "rvc_lut"
+# which open their files through the OpenOutput callback.
+BACKENDS = {
+    "binary": ("binary_utils", "write_binary"),
+    "sqlite": ("sqlite_utils", "write_sqlite"),
+    "shards": ("shard_utils", "write_shards"),
+    "c": ("c_utils", "write_c"),
+    "c_split": ("c_utils", "write_c_split"),
+    "chisel": ("chisel_utils", "write_chisel"),
+    "sverilog": ("sverilog_utils", "write_sverilog"),
+    "rust": ("rust_utils", "write_rust"),
+    "go": ("go_utils", "write_go"),
+    "python": ("python_utils", "write_python"),
+    "rvc_lut": ("rvc_utils", "write_rvc_lut"),
+    "latex": ("latex_utils", "write_latex_table"),
+    "priv_latex": ("latex_utils", "write_priv_latex_table"),
+}
+
+# Subcommands of parse.py: name -> (module, function taking the remaining
+# command line arguments). Modules are only imported when their subcommand
+# is run.
+SUBCOMMANDS = {
+    "query": ("query_utils", "main"),
+    "diff": ("diff_utils", "main"),
+    "layout": ("layout_utils", "main"),
+}
+
+# Opens the named artifact for writing (in binary mode if the flag is set).
+OpenOutput = Callable[[str, bool], ContextManager[IO[Any]]]
+
+# The last file written by the outputs spread over a directory, logged on
+# behalf of the whole directory.
+DIRECTORY_SUMMARIES = ("instr_dict/index.json", "encoding/all.h")
+
+# Outputs generated from the C instruction dictionary.
+C_OUTPUTS = {"c", "c_split"}
+
+
+def load_backend(name: str) -> "Callable[..., Any]":
+    """Import the module implementing a backend and return its writer."""
+    module_name, function_name = BACKENDS[name]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def emit_outputs(
+    instr_dict: InstrDict,
+    instr_dict_c: "Optional[InstrDict]",
+    outputs: "set[str]",
+    open_output: OpenOutput,
+    commit: str = "",
+    command: "Optional[str]" = None,
+):
+    """
+    Write the selected outputs: "json" (instr_dict.json) or any BACKENDS key,
+    with "spinalhdl" selecting the SpinalHDL flavour of the Chisel backend and
+    "latex" both LaTeX tables. instr_dict must be sorted; instr_dict_c is the
+    dictionary for the C headers and is only needed when "c" or "c_split"
+    is selected.
+    commit is the revision quoted in the C header, command the command line
+    quoted in inst.go (go_utils.GENERATOR if None).
+    """
+
+    @contextmanager
+    def output(name: str, filename: str, binary: bool) -> "Iterator[IO[Any]]":
+        with span(name, "output"), open_output(filename, binary) as out:
+            yield out
+
+    with span("nf_expansion"):
+        instr_dict_expanded = add_segmented_vls_insn(instr_dict)
+
+    # The symbol tables shared by the source code backends, built once.
+    ctx = ctx_c = None
+    with span("emit_context"):
+        if outputs & {"chisel", "spinalhdl", "sverilog", "rust", "go", "python"}:
+            ctx = EmitContext(instr_dict)
+        if outputs & C_OUTPUTS and instr_dict_c is not None:
+            ctx_c = EmitContext(instr_dict_c)
+
+    if "json" in outputs:
+        with output("json", "instr_dict.json", False) as out:
+            json.dump(instr_dict_expanded, out, indent=2)
+
+    if "binary" in outputs:
+        with output("binary", "instr_dict.bin", True) as out:
+            load_backend("binary")(instr_dict_expanded, out)
+
+    if "sqlite" in outputs:
+        with output("sqlite", "instr_dict.sqlite", True) as out:
+            load_backend("sqlite")(instr_dict_expanded, out)
+
+    if "shards" in outputs:
+        with span("shards", "output"):
+            load_backend("shards")(instr_dict_expanded, open_output)
+
+    if "c" in outputs:
+        with output("c", "encoding.out.h", False) as out:
+            load_backend("c")(ctx_c, out, commit)
+
+    if "c_split" in outputs:
+        with span("c_split", "output"):
+            load_backend("c_split")(ctx_c, open_output, commit)
+
+    if "chisel" in outputs:
+        with output("chisel", "inst.chisel", False) as out:
+            load_backend("chisel")(ctx, out)
+
+    if "spinalhdl" in outputs:
+        with output("spinalhdl", "inst.spinalhdl", False) as out:
+            load_backend("chisel")(ctx, out, True)
+
+    if "sverilog" in outputs:
+        with output("sverilog", "inst.sverilog", False) as out:
+            load_backend("sverilog")(ctx, out)
+
+    if "rust" in outputs:
+        with output("rust", "inst.rs", False) as out:
+            load_backend("rust")(ctx, out)
+
+    if "go" in outputs:
+        with output("go", "inst.go", False) as out:
+            load_backend("go")(ctx, out, *(() if command is None else (command,)))
+
+    if "python" in outputs:
+        with output("python", "inst.py", False) as out:
+            load_backend("python")(ctx, out)
+
+    if "rvc_lut" in outputs:
+        with span("rvc_lut", "output"):
+            load_backend("rvc_lut")(instr_dict, open_output)
+
+    if "latex" in outputs:
+        with output("latex", "instr-table.tex", False) as out:
+            load_backend("latex")(out)
+        with output("priv_latex", "priv-instr-table.tex", False) as out:
+            load_backend("priv_latex")(out)
+
+
+@contextmanager
+def open_output_file(filename: str, binary: bool) -> "Iterator[IO[Any]]":
+    """
+    Opens an artifact relative to the current directory and logs once it is
+    written (for outputs spread over a directory, only once their last file
+    is written, see DIRECTORY_SUMMARIES).
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(
+        filename, "wb" if binary else "w", encoding=None if binary else "utf-8"
+    ) as out:
+        yield out
+    if filename != "instr_dict.json" and (
+        not directory or filename in DIRECTORY_SUMMARIES
+    ):
+        logging.info(f"{filename} generated successfully")
+
+
+def write_outputs(
+    instr_dict: InstrDict,
+    instr_dict_c: "Optional[InstrDict]",
+    outputs: "set[str]",
+):
+    """
+    Write the selected outputs (see emit_outputs) into the current directory,
+    inst.go quoting the command line.
+    """
+    commit = ""
+    if outputs & C_OUTPUTS:
+        commit = importlib.import_module("c_utils").git_commit()
+    emit_outputs(
+        instr_dict,
+        instr_dict_c,
+        outputs,
+        open_output_file,
+        commit,
+        " ".join(sys.argv),
+    )
+
+
+def generate(
+    extensions: "list[str]",
+    backends: "list[str]",
+    include_pseudo: bool = False,
+    streams: "Optional[dict[str, IO[Any]]]" = None,
+    git_commit: bool = False,
+) -> "dict[str, Union[str, bytes]]":
+    """
+    Library entry point: parse the extensions matching the given globs and
+    generate the outputs of the given backends ("json" or any BACKENDS key,
+    see emit_outputs) without touching the current directory.
+
+    Artifacts are returned as {file name: contents}, str for text outputs and
+    bytes for binary ones. Artifacts whose file name is a key of streams are
+    written to that file object instead (and left open) and are not part of
+    the returned dict. The commit hash in the C header is only looked up with
+    `git log` if git_commit is set.
+    """
+    outputs = set(backends)
+    unknown = outputs - set(BACKENDS) - {"json", "spinalhdl"}
+    if unknown:
+        raise ValueError(f"Unknown backends: {sorted(unknown)}")
+
+    instr_dict = dict(sorted(create_inst_dict(extensions, include_pseudo).items()))
+    instr_dict_c = None
+    if outputs & C_OUTPUTS:
+        instr_dict_c = create_inst_dict(
+            extensions, False, include_pseudo_ops=emitted_pseudo_ops
+        )
+        instr_dict_c = dict(sorted(instr_dict_c.items()))
+
+    artifacts: "dict[str, Union[str, bytes]]" = {}
+
+    @contextmanager
+    def open_output(filename: str, binary: bool) -> "Iterator[IO[Any]]":
+        if streams is not None and filename in streams:
+            yield streams[filename]
+            return
+        buffer: "IO[Any]" = io.BytesIO() if binary else io.StringIO()
+        yield buffer
+        artifacts[filename] = buffer.getvalue()
+
+    commit = ""
+    if git_commit and outputs & C_OUTPUTS:
+        commit = importlib.import_module("c_utils").git_commit()
+    emit_outputs(instr_dict, instr_dict_c, outputs, open_output, commit)
+    return artifacts
+
+
+def generate_matrix(matrix_file: str, outputs: "set[str]"):
+    """
+    Write the selected outputs (see emit_outputs) of every configuration of
+    a matrix file (see matrix_utils.load_matrix) into a directory named
+    after the configuration. The extension files of all the configurations
+    are read and parsed once; overlaps are checked per configuration.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from matrix_utils import load_matrix, matrix_selector, restrict_arg_lut
+
+    configs = load_matrix(matrix_file)
+    with span("matrix_parse"):
+        selector = matrix_selector(configs)
+    table = dict(arg_lut)
+    commit = ""
+    if outputs & C_OUTPUTS:
+        commit = importlib.import_module("c_utils").git_commit()
+
+    try:
+        for name, config in configs.items():
+            with span(name, "matrix"):
+                selector.check_overlaps(config.files)
+                restrict_arg_lut(table, selector.arg_aliases(config.files))
+                instr_dict = selector.select(config.files, config.include_pseudo)
+                instr_dict = dict(sorted(instr_dict.items()))
+                instr_dict_c = None
+                if outputs & C_OUTPUTS:
+                    instr_dict_c = selector.select(
+                        config.files, False, emitted_pseudo_ops
+                    )
+                    instr_dict_c = dict(sorted(instr_dict_c.items()))
+
+                def open_output(
+                    filename: str, binary: bool, directory: str = name
+                ) -> "ContextManager[IO[Any]]":
+                    return open_output_file(os.path.join(directory, filename), binary)
+
+                emit_outputs(instr_dict, instr_dict_c, outputs, open_output, commit)
+            logging.info(f"{name}/ generated successfully")
+    finally:
+        restrict_arg_lut(table, set(table))
+
+
+def selected_outputs(
+    c: bool,
+    chisel: bool,
+    spinalhdl: bool,
+    sverilog: bool,
+    rust: bool,
+    go: bool,
+    latex: bool,
+    binary: bool,
+    sqlite: bool,
+    shards: bool = False,
+    c_split: bool = False,
+    python: bool = False,
+    rvc_lut: bool = False,
+) -> "set[str]":
+    flags = {
+        "c": c,
+        "chisel": chisel,
+        "spinalhdl": spinalhdl,
+        "sverilog": sverilog,
+        "rust": rust,
+        "go": go,
+        "latex": latex,
+        "binary": binary,
+        "sqlite": sqlite,
+        "shards": shards,
+        "c_split": c_split,
+        "python": python,
+        "rvc_lut": rvc_lut,
+    }
+    return {"json"} | {name for name, selected in flags.items() if selected}
+
 
 def generate_extensions(
     extensions: list[str],
@@ -31,54 +340,114 @@ def generate_extensions(
     rust: bool,
     go: bool,
     latex: bool,
+    binary: bool = False,
+    sqlite: bool = False,
+    shards: bool = False,
+    c_split: bool = False,
+    python: bool = False,
+    rvc_lut: bool = False,
 ):
     instr_dict = create_inst_dict(extensions, include_pseudo)
     instr_dict = dict(sorted(instr_dict.items()))
 
-    with open("instr_dict.json", "w", encoding="utf-8") as outfile:
-        json.dump(add_segmented_vls_insn(instr_dict), outfile, indent=2)
-
-    if c:
+    instr_dict_c = None
+    if c or c_split:
         instr_dict_c = create_inst_dict(
             extensions, False, include_pseudo_ops=emitted_pseudo_ops
         )
         instr_dict_c = dict(sorted(instr_dict_c.items()))
-        make_c(instr_dict_c)
-        logging.info("encoding.out.h generated successfully")
 
-    if chisel:
-        make_chisel(instr_dict)
-        logging.info("inst.chisel generated successfully")
+    write_outputs(
+        instr_dict,
+        instr_dict_c,
+        selected_outputs(
+            c,
+            chisel,
+            spinalhdl,
+            sverilog,
+            rust,
+            go,
+            latex,
+            binary,
+            sqlite,
+            shards,
+            c_split,
+            python,
+            rvc_lut,
+        ),
+    )
 
-    if spinalhdl:
-        make_chisel(instr_dict, True)
-        logging.info("inst.spinalhdl generated successfully")
 
-    if sverilog:
-        make_sverilog(instr_dict)
-        logging.info("inst.sverilog generated successfully")
+def run(args: argparse.Namespace):
+    outputs = selected_outputs(
+        args.c,
+        args.chisel,
+        args.spinalhdl,
+        args.sverilog,
+        args.rust,
+        args.go,
+        args.latex,
+        args.binary,
+        args.sqlite,
+        args.shards,
+        args.c_split,
+        args.python,
+        args.rvc_lut,
+    )
+
+    if args.matrix:
+        generate_matrix(args.matrix, outputs)
+        return
 
-    if rust:
-        make_rust(instr_dict)
-        logging.info("inst.rs generated successfully")
+    if args.serve:
+        # pylint: disable-next=import-outside-toplevel
+        from service_utils import serve
 
-    if go:
-        make_go(instr_dict)
-        logging.info("inst.go generated successfully")
+        serve(args.extensions, args.pseudo, args.serve, args.interval)
+        return
 
-    if latex:
-        make_latex_table()
-        logging.info("instr-table.tex generated successfully")
-        make_priv_latex_table()
-        logging.info("priv-instr-table.tex generated successfully")
+    if args.watch:
+        # pylint: disable-next=import-outside-toplevel
+        from watch_utils import watch
+
+        watch(args.extensions, args.pseudo, outputs, write_outputs, args.interval)
+        return
+
+    generate_extensions(
+        args.extensions,
+        args.pseudo,
+        args.c,
+        args.chisel,
+        args.spinalhdl,
+        args.sverilog,
+        args.rust,
+        args.go,
+        args.latex,
+        args.binary,
+        args.sqlite,
+        args.shards,
+        args.c_split,
+        args.python,
+        args.rvc_lut,
+    )
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        module_name, function_name = SUBCOMMANDS[sys.argv[1]]
+        getattr(importlib.import_module(module_name), function_name)(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Generate RISC-V constants headers")
     parser.add_argument(
         "-pseudo", action="store_true", help="Include pseudo-instructions"
     )
     parser.add_argument("-c", action="store_true", help="Generate output for C")
+    parser.add_argument(
+        "-c-split",
+        action="store_true",
+        help="Generate per-extension C headers in encoding/",
+    )
     parser.add_argument(
         "-chisel", action="store_true", help="Generate output for Chisel"
     )
@@ -90,7 +459,72 @@ def main():
     )
     parser.add_argument("-rust", action="store_true", help="Generate output for Rust")
     parser.add_argument("-go", action="store_true", help="Generate output for Go")
+    parser.add_argument(
+        "-python",
+        action="store_true",
+        help="Generate a Python module with the constants and a decoder",
+    )
+    parser.add_argument(
+        "-rvc-lut",
+        action="store_true",
+        help="Generate C and Rust lookup tables decoding compressed instructions",
+    )
     parser.add_argument("-latex", action="store_true", help="Generate output for Latex")
+    parser.add_argument(
+        "-binary",
+        action="store_true",
+        help="Generate a memory-mappable binary instruction database",
+    )
+    parser.add_argument(
+        "-sqlite", action="store_true", help="Generate an indexed SQLite database"
+    )
+    parser.add_argument(
+        "-shards",
+        action="store_true",
+        help="Generate one JSON file per extension plus an index in instr_dict/",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate the outputs whenever the extension files or CSV tables change",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Polling interval in seconds for --watch and --serve",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Keep the instructions loaded and answer queries on a Unix socket, reloading them whenever the extension files or CSV tables change",
+    )
+    parser.add_argument(
+        "--matrix",
+        metavar="CONFIG",
+        help="Generate the outputs of every configuration of a JSON matrix file into a directory per configuration, parsing the extension files once",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the run: print a summary per phase and write a Chrome trace",
+    )
+    parser.add_argument(
+        "--profile-out",
+        default="trace.json",
+        metavar="TRACE",
+        help="File of the Chrome trace written by --profile (default: trace.json)",
+    )
+    isa = parser.add_mutually_exclusive_group()
+    isa.add_argument(
+        "--isa",
+        help="Add the extension files of an ISA string, e.g. rv64imafdc_zicsr_zba_zbb",
+    )
+    isa.add_argument(
+        "--isa-profile",
+        metavar="PROFILE",
+        help="Add the extension files of a profile, e.g. RVA23U64",
+    )
     parser.add_argument(
         "extensions",
         nargs="*",
@@ -98,20 +532,30 @@ def main():
     )
 
     args = parser.parse_args()
+    if args.isa or args.isa_profile:
+        # pylint: disable-next=import-outside-toplevel
+        from isa_utils import isa_extension_files, profile_extension_files
+
+        if args.isa:
+            args.extensions = isa_extension_files(args.isa) + args.extensions
+        else:
+            args.extensions = (
+                profile_extension_files(args.isa_profile) + args.extensions
+            )
 
     print(f"Extensions selected : {args.extensions}")
 
-    generate_extensions(
-        args.extensions,
-        args.pseudo,
-        args.c,
-        args.chisel,
-        args.spinalhdl,
-        args.sverilog,
-        args.rust,
-        args.go,
-        args.latex,
-    )
+    if args.profile:
+        profiler = enable_profiling()
+        try:
+            run(args)
+        finally:
+            profiler.write_chrome_trace(args.profile_out)
+            print(profiler.summary())
+            logging.info(f"{args.profile_out} generated successfully")
+        return
+
+    run(args)
 
 
 if __name__ == "__main__":
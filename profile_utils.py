@@ -0,0 +1,122 @@
+import json
+import sys
+import time
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, NamedTuple, Optional
+
+# Spans are only recorded while a Profiler is enabled. Otherwise span()
+# returns a shared no-op context manager, so instrumented code only pays for
+# one function call.
+NULL_SPAN: "ContextManager[None]" = nullcontext()
+
+
+class SpanEvent(NamedTuple):
+    name: str
+    category: str
+    start_ns: int
+    duration_ns: int
+    # net number of memory blocks allocated during the span
+    blocks: int
+
+
+class Span:
+    """Times a block and records it in the profiler on exit."""
+
+    __slots__ = ("profiler", "name", "category", "start_ns", "blocks")
+
+    def __init__(self, profiler: "Profiler", name: str, category: str):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.start_ns = 0
+        self.blocks = 0
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.start_ns = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info: Any):
+        end_ns = time.perf_counter_ns()
+        self.profiler.events.append(
+            SpanEvent(
+                self.name,
+                self.category,
+                self.start_ns,
+                end_ns - self.start_ns,
+                sys.getallocatedblocks() - self.blocks,
+            )
+        )
+
+
+class Profiler:
+    """Collects the spans of one run (see enable_profiling)."""
+
+    def __init__(self):
+        self.events: "List[SpanEvent]" = []
+        self.origin_ns = time.perf_counter_ns()
+
+    def chrome_trace(self) -> "Dict[str, Any]":
+        """The spans in Chrome trace-event format (chrome://tracing, Perfetto)."""
+        return {
+            "traceEvents": [
+                {
+                    "name": event.name,
+                    "cat": event.category,
+                    "ph": "X",
+                    "ts": (event.start_ns - self.origin_ns) / 1000,
+                    "dur": event.duration_ns / 1000,
+                    "pid": 1,
+                    "tid": 1,
+                    "args": {"allocated_blocks": event.blocks},
+                }
+                for event in sorted(self.events, key=lambda e: e.start_ns)
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def write_chrome_trace(self, filename: str):
+        with open(filename, "w", encoding="utf-8") as out:
+            json.dump(self.chrome_trace(), out)
+
+    def summary(self) -> str:
+        """
+        Table of the calls, total wall time and allocated blocks per span name,
+        slowest first. Totals of enclosing spans include their nested spans.
+        """
+        totals: "Dict[str, List[int]]" = {}
+        for event in self.events:
+            total = totals.setdefault(event.name, [0, 0, 0])
+            total[0] += 1
+            total[1] += event.duration_ns
+            total[2] += event.blocks
+        width = max((len(name) for name in totals), default=4)
+        lines = [f"{'span':<{width}}  {'calls':>7}  {'total ms':>10}  {'blocks':>9}"]
+        for name, (calls, duration_ns, blocks) in sorted(
+            totals.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                f"{name:<{width}}  {calls:>7}  {duration_ns / 1e6:>10.2f}  {blocks:>9}"
+            )
+        return "\n".join(lines)
+
+
+_profiler: "Optional[Profiler]" = None
+
+
+def enable_profiling() -> Profiler:
+    """Start recording spans into a new Profiler."""
+    global _profiler  # pylint: disable=global-statement
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler  # pylint: disable=global-statement
+    _profiler = None
+
+
+def span(name: str, category: str = "phase") -> "ContextManager[None]":
+    """Context manager recording the enclosed block if profiling is enabled."""
+    if _profiler is None:
+        return NULL_SPAN
+    return Span(_profiler, name, category)
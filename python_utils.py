@@ -0,0 +1,83 @@
+import logging
+import pprint
+from typing import Iterator, Optional, TextIO
+
+from decoder_utils import Histogram, build_decoder, decoder_source
+from emit_utils import EmitContext, write_chunks
+
+pp = pprint.PrettyPrinter(indent=2)
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# decode() of the generated module, see decoder_utils.decode
+DECODE_SOURCE = '''
+
+def decode(insn: int) -> "str | None":
+    """Name of the instruction encoded by insn, None if there is none."""
+    node = DECODER
+    while isinstance(node, tuple):
+        node = node[1].get(insn & node[0], [])
+    for mask, match, name in node:
+        if insn & mask == match:
+            return name
+    return None
+'''
+
+# decode() of a module whose decoder has hot lists (see build_decoder)
+HOT_DECODE_SOURCE = '''
+
+def decode(insn: int) -> "str | None":
+    """Name of the instruction encoded by insn, None if there is none."""
+    node = DECODER
+    while isinstance(node, tuple):
+        if len(node) > 2:
+            for mask, match, name in node[2]:
+                if insn & mask == match:
+                    return name
+        node = node[1].get(insn & node[0], [])
+    for mask, match, name in node:
+        if insn & mask == match:
+            return name
+    return None
+'''
+
+
+def python_chunks(
+    ctx: EmitContext, weights: "Optional[Histogram]" = None
+) -> "Iterator[str]":
+    """
+    The text of inst.py: a module of literals only, so importing it does not
+    read or parse anything. weights lays the decoder out for an instruction
+    histogram (see decoder_utils.build_decoder).
+    """
+    yield '"""Automatically generated by parse_opcodes. Do not edit."""\n\n'
+    for i in ctx.instrs:
+        yield f"MATCH_{i.upper} = {i.match_hex}\nMASK_{i.upper} = {i.mask_hex}\n"
+    yield "\n"
+    for c in ctx.csrs:
+        yield f"CSR_{c.upper} = {c.hex}\n"
+    yield "\n"
+    for c in ctx.causes:
+        yield f"CAUSE_{c.upper} = {c.hex}\n"
+
+    yield "\n# name: (match, mask, owning extension)\nINSTRUCTIONS = {\n"
+    for i in ctx.instrs:
+        yield f"    {i.name!r}: ({i.match_hex}, {i.mask_hex}, {i.extension!r}),\n"
+    yield "}\n\nCSRS = {\n"
+    for c in ctx.csrs:
+        yield f"    {c.hex}: {c.name!r},\n"
+    yield "}\n\nCAUSES = {\n"
+    for c in ctx.causes:
+        yield f"    {c.hex}: {c.name!r},\n"
+    yield "}\n\n"
+
+    yield "# (mask, {insn & mask: subtree}) nodes, [(mask, match, name)] leaves\n"
+    yield "DECODER = "
+    yield from decoder_source(
+        build_decoder(((i.mask, i.match, i.name) for i in ctx.instrs), weights=weights)
+    )
+    yield "\n"
+    yield DECODE_SOURCE if weights is None else HOT_DECODE_SOURCE
+
+
+def write_python(ctx: EmitContext, out: TextIO, weights: "Optional[Histogram]" = None):
+    write_chunks(out, python_chunks(ctx, weights))
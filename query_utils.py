@@ -0,0 +1,274 @@
+import argparse
+import fnmatch
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import constants
+from shared_utils import (
+    OPCODES_DIR,
+    InstrDict,
+    OverlapIndex,
+    create_inst_dict,
+    extension_dependencies,
+    extension_file_names,
+    log_and_exit,
+    overlap_key,
+    overlaps,
+)
+from watch_utils import TABLE_FILES, file_signature
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Layout of instr_index.json:
+#
+#   {"version": 1,
+#    "filter": [extension globs], "pseudo": bool,
+#    "signatures": {path: [mtime_ns, size]},  the files the index was built
+#                                            from, with their dependencies
+#    "instructions": {name: entry as in instr_dict.json},
+#    "fields": {variable field: [names]},
+#    "extensions": {extension: [names]},
+#    "buckets": {overlap_key: [names]}}
+#
+# The index is rebuilt whenever the extension globs, the pseudo-instruction
+# flag or the signature of one of the files differ from the ones recorded.
+# It is stored next to parse.py (the parent of the extensions directory),
+# whatever the current directory.
+INDEX_FILE = "instr_index.json"
+INDEX_PATH = os.path.join(os.path.dirname(OPCODES_DIR), INDEX_FILE)
+INDEX_VERSION = 1
+DEFAULT_EXTENSIONS = ["rv*", "unratified/rv*"]
+QUERY_KINDS = ("word", "name", "extension", "field", "pattern")
+
+
+def index_signatures(
+    file_filter: "list[str]", opcodes_dir: str
+) -> "Dict[str, Optional[List[int]]]":
+    paths = extension_dependencies(
+        extension_file_names(file_filter, opcodes_dir), opcodes_dir
+    ) + [os.path.join(constants.TABLES_DIR, name) for name in TABLE_FILES]
+    signatures: "Dict[str, Optional[List[int]]]" = {}
+    for path in paths:
+        signature = file_signature(path)
+        signatures[path] = None if signature is None else list(signature)
+    return signatures
+
+
+def inverted_index(instr_dict: InstrDict, key: str) -> "Dict[str, List[str]]":
+    """
+    The names of the instructions listing each value of their key list
+    ("extension" or "variable_fields"), sorted by value.
+    """
+    index: "Dict[str, List[str]]" = {}
+    for name, instr in instr_dict.items():
+        for value in instr[key]:
+            index.setdefault(value, []).append(name)
+    return dict(sorted(index.items()))
+
+
+def build_index(
+    instr_dict: InstrDict,
+    file_filter: "list[str]",
+    include_pseudo: bool,
+    signatures: "Dict[str, Optional[List[int]]]",
+) -> "Dict[str, Any]":
+    buckets: "Dict[str, List[str]]" = {}
+    for name, instr in instr_dict.items():
+        buckets.setdefault(overlap_key(instr["encoding"]), []).append(name)
+    return {
+        "version": INDEX_VERSION,
+        "filter": file_filter,
+        "pseudo": include_pseudo,
+        "signatures": signatures,
+        "instructions": instr_dict,
+        "fields": inverted_index(instr_dict, "variable_fields"),
+        "extensions": inverted_index(instr_dict, "extension"),
+        "buckets": buckets,
+    }
+
+
+class InstrIndex:
+    """
+    Answers the queries of `parse.py query` from the inverted indexes of
+    instr_index.json. Name, extension and field queries take exact names or
+    glob patterns; results are in instruction name order.
+    """
+
+    def __init__(self, data: "Dict[str, Any]"):
+        self.instructions: InstrDict = data["instructions"]
+        self.fields: "Dict[str, List[str]]" = data["fields"]
+        self.extensions: "Dict[str, List[str]]" = data["extensions"]
+        self.buckets = OverlapIndex.from_buckets(data["buckets"])
+
+    def lookup(self, table: "Dict[str, List[str]]", pattern: str) -> "List[str]":
+        """Names listed under the keys of table matching the glob pattern."""
+        if pattern in table:
+            return table[pattern]
+        return sorted(
+            {name for key in fnmatch.filter(table, pattern) for name in table[key]}
+        )
+
+    def by_name(self, pattern: str) -> "List[str]":
+        if pattern in self.instructions:
+            return [pattern]
+        return fnmatch.filter(self.instructions, pattern)
+
+    def by_extension(self, pattern: str) -> "List[str]":
+        return self.lookup(self.extensions, pattern)
+
+    def by_field(self, pattern: str) -> "List[str]":
+        return self.lookup(self.fields, pattern)
+
+    def by_pattern(self, pattern: str) -> "List[str]":
+        """
+        Instructions whose encoding can match a word of pattern, a string of
+        0, 1 and - (or ?) from bit 31 (or the highest given) down to bit 0.
+        """
+        pattern = pattern.replace("?", "-").replace("_", "")
+        if not pattern or len(pattern) > 32 or set(pattern) - set("01-"):
+            log_and_exit(f"Invalid encoding pattern {pattern!r}")
+        pattern = pattern.rjust(32, "-")
+        return sorted(
+            name
+            for name in self.buckets.candidates(pattern)
+            if overlaps(self.instructions[name]["encoding"], pattern)
+        )
+
+    def by_word(self, word: int) -> "List[str]":
+        """
+        Instructions matching word, the one it decodes to first: most fixed
+        bits first, as in decoder_utils.build_decoder.
+        """
+        found = []
+        for name in self.buckets.candidates(f"{word & 0xFFFFFFFF:032b}"):
+            mask = int(self.instructions[name]["mask"], 16)
+            if word & mask == int(self.instructions[name]["match"], 16):
+                found.append((-bin(mask).count("1"), name))
+        return [name for _bits, name in sorted(found)]
+
+    def query(self, kind: str, value: str) -> "List[str]":
+        if kind == "word":
+            try:
+                return self.by_word(int(value, 0))
+            except ValueError:
+                log_and_exit(f"Invalid instruction word {value!r}")
+        if kind == "pattern":
+            return self.by_pattern(value)
+        return {
+            "name": self.by_name,
+            "extension": self.by_extension,
+            "field": self.by_field,
+        }[kind](value)
+
+
+def load_index(
+    file_filter: "list[str]",
+    include_pseudo: bool = False,
+    path: str = INDEX_PATH,
+    opcodes_dir: str = OPCODES_DIR,
+) -> InstrIndex:
+    """
+    The index of the instructions of file_filter stored at path, rebuilt and
+    stored again first if it is missing or stale.
+    """
+    signatures = index_signatures(file_filter, opcodes_dir)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    if (
+        data.get("version") != INDEX_VERSION
+        or data.get("filter") != file_filter
+        or data.get("pseudo") != include_pseudo
+        or data.get("signatures") != signatures
+    ):
+        logging.info(f"Building the query index {path}")
+        instr_dict = create_inst_dict(
+            file_filter, include_pseudo, opcodes_dir=opcodes_dir
+        )
+        data = build_index(
+            dict(sorted(instr_dict.items())), file_filter, include_pseudo, signatures
+        )
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    return InstrIndex(data)
+
+
+def field_values(
+    instr: "Dict[str, Any]",
+    word: int,
+    positions: "Optional[Dict[str, Tuple[int, int]]]" = None,
+) -> "Dict[str, int]":
+    """The values in word of the variable fields of instr, placed as in arg_lut."""
+    positions = constants.arg_lut if positions is None else positions
+    values = {}
+    for field in instr["variable_fields"]:
+        msb, lsb = positions[field]
+        values[field] = (word >> lsb) & ((1 << (msb - lsb + 1)) - 1)
+    return values
+
+
+def main(argv: "Optional[list[str]]" = None):
+    parser = argparse.ArgumentParser(
+        prog="parse.py query",
+        description="Look up instructions without generating any output",
+    )
+    parser.add_argument(
+        "kind",
+        choices=QUERY_KINDS,
+        help="What to look up: the instructions matching an instruction word, "
+        "named like a glob, of an extension, using a variable field, or whose "
+        "encoding can match a pattern of 0, 1 and -",
+    )
+    parser.add_argument(
+        "value",
+        help="Word, name, extension, field or pattern (use ? in patterns, or "
+        "put -- before a pattern starting with -)",
+    )
+    parser.add_argument(
+        "extensions",
+        nargs="*",
+        default=DEFAULT_EXTENSIONS,
+        help=f"Extension globs to index (default: {' '.join(DEFAULT_EXTENSIONS)})",
+    )
+    parser.add_argument(
+        "-pseudo", action="store_true", help="Include pseudo-instructions"
+    )
+    parser.add_argument(
+        "--index",
+        default=INDEX_PATH,
+        help=f"Index file, rebuilt when stale (default: {INDEX_PATH})",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the instructions as JSON"
+    )
+    args = parser.parse_args(argv)
+
+    index = load_index(args.extensions, args.pseudo, args.index)
+    names = index.query(args.kind, args.value)
+    word = int(args.value, 0) if args.kind == "word" else None
+    results = []
+    for name in names:
+        instr = index.instructions[name]
+        result: "Dict[str, Any]" = {"name": name, **instr}
+        if word is not None:
+            result["values"] = field_values(instr, word)
+        results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if not results:
+        logging.info("No instruction found")
+    for result in results:
+        fields = " ".join(
+            f"{f}={v}" for f, v in result.get("values", {}).items()
+        ) or " ".join(result["variable_fields"])
+        print(
+            f"{result['name']:<20} {result['encoding']}  "
+            f"{','.join(result['extension'])}  {fields}".rstrip()
+        )
@@ -1,28 +1,30 @@
 import logging
 import pprint
+from typing import Iterator, TextIO
 
-from constants import causes, csrs, csrs32
+from emit_utils import EmitContext, write_chunks
 from shared_utils import InstrDict
 
 pp = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
 
+def rust_chunks(ctx: EmitContext) -> "Iterator[str]":
+    yield "\n/* Automatically generated by parse_opcodes */\n"
+    for i in ctx.instrs:
+        yield f"const MATCH_{i.upper}: u32 = {i.match_hex};\n"
+        yield f"const MASK_{i.upper}: u32 = {i.mask_hex};\n"
+    for c in ctx.csrs:
+        yield f"const CSR_{c.upper}: u16 = {c.hex};\n"
+    for c in ctx.causes:
+        yield f"const CAUSE_{c.upper}: u8 = {c.hex};\n"
+    yield "\n"
+
+
+def write_rust(ctx: EmitContext, out: TextIO):
+    write_chunks(out, rust_chunks(ctx))
+
+
 def make_rust(instr_dict: InstrDict):
-    mask_match_str = ""
-    for i in instr_dict:
-        mask_match_str += f'const MATCH_{i.upper().replace(".","_")}: u32 = {(instr_dict[i]["match"])};\n'
-        mask_match_str += f'const MASK_{i.upper().replace(".","_")}: u32 = {(instr_dict[i]["mask"])};\n'
-    for num, name in csrs + csrs32:
-        mask_match_str += f"const CSR_{name.upper()}: u16 = {hex(num)};\n"
-    for num, name in causes:
-        mask_match_str += (
-            f'const CAUSE_{name.upper().replace(" ","_")}: u8 = {hex(num)};\n'
-        )
     with open("inst.rs", "w", encoding="utf-8") as rust_file:
-        rust_file.write(
-            f"""
-/* Automatically generated by parse_opcodes */
-{mask_match_str}
-"""
-        )
+        write_rust(EmitContext(instr_dict), rust_file)
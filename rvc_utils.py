@@ -0,0 +1,59 @@
+import logging
+import pprint
+from typing import IO, Any, Callable, ContextManager, Iterator
+
+from decoder_utils import CompressedLUT, build_compressed_lut
+from emit_utils import write_chunks
+from shared_utils import InstrDict
+
+pp = pprint.PrettyPrinter(indent=2)
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+OpenOutput = Callable[[str, bool], ContextManager[IO[Any]]]
+
+# Table entries per line of the generated sources
+ENTRIES_PER_LINE = 32
+
+
+def table_rows(lut: CompressedLUT) -> "Iterator[str]":
+    for start in range(0, len(lut.table), ENTRIES_PER_LINE):
+        row = lut.table[start : start + ENTRIES_PER_LINE]
+        yield "  " + ", ".join(map(str, row)) + ",\n"
+
+
+def rvc_lut_c_chunks(luts: "list[CompressedLUT]") -> "Iterator[str]":
+    yield "/* Automatically generated by parse_opcodes. */\n"
+    yield "#ifndef RISCV_RVC_LUT_H\n#define RISCV_RVC_LUT_H\n#include <stdint.h>\n"
+    for lut in luts:
+        ctype = "uint8_t" if lut.table.itemsize == 1 else "uint16_t"
+        names = ", ".join(f'"{name}"' for name in lut.names)
+        yield f"\n/* rvc_lut_rv{lut.xlen}[halfword] indexes rvc_names_rv{lut.xlen}, 0 is no instruction */\n"
+        yield f"static const char *const rvc_names_rv{lut.xlen}[{len(lut.names)}] = {{{names}}};\n"
+        yield f"static const {ctype} rvc_lut_rv{lut.xlen}[{len(lut.table)}] = {{\n"
+        yield from table_rows(lut)
+        yield "};\n"
+    yield "#endif\n"
+
+
+def rvc_lut_rust_chunks(luts: "list[CompressedLUT]") -> "Iterator[str]":
+    yield "/* Automatically generated by parse_opcodes */\n"
+    for lut in luts:
+        rtype = "u8" if lut.table.itemsize == 1 else "u16"
+        names = ", ".join(f'"{name}"' for name in lut.names)
+        yield f"\n/// RVC_LUT_RV{lut.xlen}[halfword] indexes RVC_NAMES_RV{lut.xlen}, 0 is no instruction\n"
+        yield f"pub static RVC_NAMES_RV{lut.xlen}: [&str; {len(lut.names)}] = [{names}];\n"
+        yield f"pub static RVC_LUT_RV{lut.xlen}: [{rtype}; {len(lut.table)}] = [\n"
+        yield from table_rows(lut)
+        yield "];\n"
+
+
+def write_rvc_lut(instr_dict: InstrDict, open_output: OpenOutput):
+    """
+    Write the compressed instruction lookup tables for RV32 and RV64 as C
+    (rvc_lut.h) and Rust (rvc_lut.rs) static arrays.
+    """
+    luts = [build_compressed_lut(instr_dict, xlen) for xlen in (32, 64)]
+    with open_output("rvc_lut.h", False) as out:
+        write_chunks(out, rvc_lut_c_chunks(luts))
+    with open_output("rvc_lut.rs", False) as out:
+        write_chunks(out, rvc_lut_rust_chunks(luts))
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from decoder_utils import build_decoder, decode, field_constraints, for_xlen
+from emit_utils import EmitContext
+from query_utils import field_values, inverted_index
+from shared_utils import OPCODES_DIR, InstrDict, log_and_exit
+from watch_utils import InstrDictWatcher
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Longest request line accepted, batches included.
+MAX_REQUEST_SIZE = 1 << 24
+
+Request = Dict[str, Any]
+Response = Dict[str, Any]
+
+
+def request_int(request: Request, key: str) -> int:
+    """An integer argument of a request, given as a number or a string like "0x33"."""
+    if key not in request:
+        raise ValueError(f"Missing argument {key!r}")
+    value = request[key]
+    if isinstance(value, str):
+        return int(value, 0)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"Argument {key!r} must be an integer")
+    return value
+
+
+def request_str(request: Request, key: str) -> str:
+    if not isinstance(request.get(key), str):
+        raise ValueError(f"Missing argument {key!r}")
+    return request[key]
+
+
+class InstrQueries:
+    """
+    Answers the queries of the service on one build of the instruction
+    dictionary. Everything is indexed once here, so a query only costs a
+    few dictionary lookups (or a walk down the decoder tree for decode).
+    The field positions, CSRs and reserved field values are copied from the
+    constants tables, which a later build may reload while these queries are
+    still answered.
+    """
+
+    def __init__(self, instr_dict: InstrDict):
+        self.instr_dict = instr_dict
+        # one decoder per XLEN, as RV32 and RV64 compressed encodings clash
+        self.decoders = {
+            xlen: build_decoder(
+                (int(instr["mask"], 16), int(instr["match"], 16), name)
+                for name, instr in instr_dict.items()
+                if for_xlen(instr["extension"], xlen)
+            )
+            for xlen in (32, 64)
+        }
+        self.extensions = inverted_index(instr_dict, "extension")
+        ctx = EmitContext(instr_dict)
+        self.csrs_by_name = {c.name: c for c in ctx.csrs}
+        self.csrs_by_number = {c.number: c for c in ctx.csrs}
+        self.fields = {f.name: f for f in ctx.fields}
+        self.positions = {f.name: (f.msb, f.lsb) for f in ctx.fields}
+        self.constraints = {
+            name: field_constraints(instr["variable_fields"])
+            for name, instr in instr_dict.items()
+        }
+        self.ops: "Dict[str, Callable[[Request], Any]]" = {
+            "decode": self.decode,
+            "encode": self.encode,
+            "instruction": self.instruction,
+            "extension": self.extension,
+            "csr": self.csr,
+            "field": self.field,
+        }
+
+    def lookup(self, name: str):
+        if name not in self.instr_dict:
+            raise ValueError(f"Unknown instruction {name!r}")
+        return self.instr_dict[name]
+
+    def decode(self, request: Request) -> "Optional[Dict[str, Any]]":
+        """
+        The instruction encoded by "word" for "xlen" (32 or 64) and its field
+        values, None if none.
+        """
+        word = request_int(request, "word")
+        xlen = request_int(request, "xlen")
+        if xlen not in self.decoders:
+            raise ValueError(f"Unsupported XLEN {xlen}")
+        name = decode(self.decoders[xlen], word)
+        if name is None:
+            return None
+        instr = self.instr_dict[name]
+        return {
+            "name": name,
+            "extension": instr["extension"],
+            "fields": field_values(instr, word, self.positions),
+        }
+
+    def encode(self, request: Request) -> int:
+        """
+        The word of instruction "name" with the "fields" values, keyed by
+        arg_lut field (split immediates take their hi and lo parts).
+        Negative values are stored in two's complement.
+        """
+        name = request_str(request, "name")
+        instr = self.lookup(name)
+        values = request.get("fields", {})
+        if not isinstance(values, dict):
+            raise ValueError("Argument 'fields' must be an object")
+        unknown = sorted(set(values) - set(instr["variable_fields"]))
+        if unknown:
+            raise ValueError(f"{name} has no fields {unknown}")
+        missing = [f for f in instr["variable_fields"] if f not in values]
+        if missing:
+            raise ValueError(f"Missing values for the fields {missing} of {name}")
+
+        word = int(instr["match"], 16)
+        for field in instr["variable_fields"]:
+            value = request_int(values, field)
+            msb, lsb = self.positions[field]
+            width = msb - lsb + 1
+            if not -(1 << (width - 1)) <= value < (1 << width):
+                raise ValueError(
+                    f"Value {value} of {field} does not fit in {width} bits"
+                )
+            word |= (value & ((1 << width) - 1)) << lsb
+        for mask, value in self.constraints[name]:
+            if word & mask == value:
+                raise ValueError(f"The field values are reserved for {name}")
+        return word
+
+    def instruction(self, request: Request) -> "Dict[str, Any]":
+        """Instruction "name" as in instr_dict.json, with its field layout."""
+        name = request_str(request, "name")
+        instr = self.lookup(name)
+        return {
+            "name": name,
+            **instr,
+            "fields": {f: list(self.positions[f]) for f in instr["variable_fields"]},
+        }
+
+    def extension(self, request: Request) -> "List[str]":
+        """Names of the instructions of extension "name", e.g. rv_i."""
+        name = request_str(request, "name")
+        if name not in self.extensions:
+            raise ValueError(f"Unknown extension {name!r}")
+        return self.extensions[name]
+
+    def csr(self, request: Request) -> "Dict[str, Any]":
+        """CSR "name" or "number"."""
+        if "name" in request:
+            csr = self.csrs_by_name.get(request_str(request, "name"))
+        else:
+            csr = self.csrs_by_number.get(request_int(request, "number"))
+        if csr is None:
+            raise ValueError("Unknown CSR")
+        return {"name": csr.name, "number": csr.number, "rv32_only": csr.rv32_only}
+
+    def field(self, request: Request) -> "Dict[str, Any]":
+        """Bit positions of arg_lut field "name"."""
+        name = request_str(request, "name")
+        if name not in self.fields:
+            raise ValueError(f"Unknown field {name!r}")
+        field = self.fields[name]
+        return {"msb": field.msb, "lsb": field.lsb, "mask": field.mask_hex}
+
+    def answer(self, request: Request) -> Response:
+        """
+        The response to one request: {"result": ...} or {"error": message},
+        with the "id" of the request if it has one.
+        """
+        response: Response = {}
+        if not isinstance(request, dict):
+            response["error"] = "A request must be an object"
+            return response
+        if "id" in request:
+            response["id"] = request["id"]
+        op = request.get("op")
+        if not isinstance(op, str) or op not in self.ops:
+            response["error"] = f"Unknown op {op!r}"
+            return response
+        try:
+            response["result"] = self.ops[op](request)
+        except ValueError as e:
+            response["error"] = str(e)
+        except (KeyError, TypeError) as e:
+            response["error"] = f"Invalid request: {e!r}"
+        return response
+
+
+class QueryService:
+    """
+    Serves queries on the instruction dictionary over a Unix socket. The
+    extension files are parsed once at startup and polled every interval
+    seconds afterwards; a change is rebuilt incrementally (see
+    InstrDictWatcher) and swapped in between two requests, while a failed
+    rebuild leaves the previous build in service.
+
+    The protocol is one JSON value per line each way: a request object, e.g.
+    {"op": "decode", "word": 51, "xlen": 64}, gets a response object, and a list of
+    requests (a batch) gets the list of their responses, in order.
+    """
+
+    def __init__(
+        self,
+        file_filter: "list[str]",
+        include_pseudo: bool,
+        interval: float = 1.0,
+        opcodes_dir: str = OPCODES_DIR,
+    ):
+        self.watcher = InstrDictWatcher(file_filter, include_pseudo, set(), opcodes_dir)
+        self.interval = interval
+        self.queries: "Optional[InstrQueries]" = None
+        self.reloads = 0
+        self.watch_task: "Optional[asyncio.Future[None]]" = None
+
+    def build(self) -> "Optional[InstrQueries]":
+        """
+        The queries of a new build if a watched file changed, None otherwise.
+        Errors are fatal on the first build only.
+        """
+        changed = self.watcher.poll()
+        if not changed:
+            return None
+        start = time.perf_counter()
+        try:
+            _regenerate, instr_dict, _instr_dict_c = self.watcher.rebuild(changed)
+        except SystemExit:
+            if self.queries is None:
+                raise
+            self.watcher.mark_failed()
+            logging.error("Reload failed, still serving the previous build")
+            return None
+        queries = InstrQueries(instr_dict)
+        logging.info(
+            f"Loaded {len(instr_dict)} instructions in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        return queries
+
+    async def reload(self) -> bool:
+        """
+        Builds in a worker thread, so requests are answered meanwhile, and
+        swaps the new queries in on the event loop thread.
+        """
+        loop = asyncio.get_running_loop()
+        queries = await loop.run_in_executor(None, self.build)
+        if queries is None:
+            return False
+        self.queries = queries
+        self.reloads += 1
+        return True
+
+    async def watch(self):
+        """
+        Reloads every interval. A failing reload is logged and the previous
+        build kept, as the task would otherwise end without a word.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logging.exception("Reload failed, still serving the previous build")
+
+    def answer_line(self, line: bytes) -> bytes:
+        assert self.queries is not None
+        try:
+            request: "Union[Request, List[Request]]" = json.loads(line)
+        except (RecursionError, ValueError) as e:
+            response: "Union[Response, List[Response]]" = {
+                "error": f"Invalid JSON: {e}"
+            }
+        else:
+            if isinstance(request, list):
+                response = [self.queries.answer(r) for r in request]
+            else:
+                response = self.queries.answer(request)
+        return json.dumps(response).encode() + b"\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"error": "Request too long"}\n')
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(self.answer_line(line))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path: str) -> "asyncio.AbstractServer":
+        """Loads the instructions and starts serving on the socket at path."""
+        await self.reload()
+        remove_stale_socket(path)
+        server = await asyncio.start_unix_server(
+            self.handle, path, limit=MAX_REQUEST_SIZE
+        )
+        os.chmod(path, 0o600)
+        self.watch_task = asyncio.ensure_future(self.watch())
+        return server
+
+
+def remove_stale_socket(path: str):
+    """Removes the socket left at path by a service that is gone."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        log_and_exit(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    log_and_exit(f"A service is already listening on {path}")
+
+
+def serve(
+    file_filter: "list[str]",
+    include_pseudo: bool,
+    path: str,
+    interval: float = 1.0,
+    opcodes_dir: str = OPCODES_DIR,
+):
+    """Serves queries on the socket at path until interrupted."""
+
+    async def run():
+        service = QueryService(file_filter, include_pseudo, interval, opcodes_dir)
+        server = await service.start(path)
+        logging.info(f"Serving queries on {path}, press Ctrl-C to stop")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logging.info("Stopped serving")
+
+
+def query(
+    path: str, request: "Union[Request, List[Request]]"
+) -> "Union[Response, List[Response]]":
+    """Sends one request (or batch) to the service at path and returns its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
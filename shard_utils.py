@@ -0,0 +1,129 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+from typing import IO, Any, Callable, ContextManager, Dict, Iterable, List
+
+from shared_utils import InstrDict, group_by_extension, log_and_exit
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Layout of the sharded instruction dictionary:
+#
+#   instr_dict/<extension>.json : the instructions owned by the extension
+#                                 (first entry of their "extension" list), in
+#                                 the format of instr_dict.json.
+#   instr_dict/index.json       : {"version": 1,
+#                                  "shards": {shard: {"file", "count", "sha256"}},
+#                                  "extensions": {extension: [shards]}}
+#
+# "extensions" lists, for every extension an instruction belongs to, the
+# shards holding such instructions, since imported and merged instructions
+# live in the shard of their owning extension only.
+SHARDS_DIR = "instr_dict"
+SHARD_INDEX = "index.json"
+SHARD_VERSION = 1
+
+OpenOutput = Callable[[str, bool], ContextManager[IO[Any]]]
+
+
+def write_shards(instr_dict: InstrDict, open_output: OpenOutput):
+    """
+    Write one JSON file per extension and the index into SHARDS_DIR, through
+    open_output(file name, binary) as used by parse.emit_outputs.
+    """
+    index: "Dict[str, Any]" = {"version": SHARD_VERSION, "shards": {}}
+    extensions: "Dict[str, List[str]]" = {}
+    for shard, shard_dict in group_by_extension(instr_dict).items():
+        data = json.dumps(shard_dict, indent=2).encode("utf-8")
+        filename = f"{shard}.json"
+        with open_output(f"{SHARDS_DIR}/{filename}", True) as out:
+            out.write(data)
+        index["shards"][shard] = {
+            "file": filename,
+            "count": len(shard_dict),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        for instr in shard_dict.values():
+            for ext in instr["extension"]:
+                shards = extensions.setdefault(ext, [])
+                if shard not in shards:
+                    shards.append(shard)
+    index["extensions"] = dict(sorted(extensions.items()))
+
+    with open_output(f"{SHARDS_DIR}/{SHARD_INDEX}", False) as out:
+        json.dump(index, out, indent=2)
+
+
+class ShardedInstrDB:
+    """
+    Loads instructions of selected extensions from a sharded instruction
+    dictionary. Only the shards holding instructions of the requested
+    extensions are read, each at most once, and checked against the hash
+    recorded in the index.
+    """
+
+    def __init__(self, directory: str = SHARDS_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, SHARD_INDEX), encoding="utf-8") as f:
+            self.index: "Dict[str, Any]" = json.load(f)
+        if self.index.get("version") != SHARD_VERSION:
+            log_and_exit(f"Unsupported shard index version {self.index.get('version')}")
+        self.shards: "Dict[str, InstrDict]" = {}
+
+    def extensions(self) -> "List[str]":
+        return list(self.index["extensions"])
+
+    def resolve(self, patterns: "Iterable[str]") -> "List[str]":
+        """Expand extension names or glob patterns (e.g. 'rv*_c') to extensions."""
+        selected: "List[str]" = []
+        for pattern in patterns:
+            matches = fnmatch.filter(self.index["extensions"], pattern)
+            if not matches:
+                log_and_exit(f"Extension {pattern} not found in {self.directory}")
+            selected.extend(ext for ext in matches if ext not in selected)
+        return selected
+
+    def shard(self, shard: str) -> InstrDict:
+        """The (cached) contents of one shard."""
+        if shard not in self.shards:
+            entry = self.index["shards"][shard]
+            with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+                log_and_exit(f"Shard {entry['file']} does not match its index hash")
+            logging.debug("Loaded shard %s", entry["file"])
+            self.shards[shard] = json.loads(data)
+        return self.shards[shard]
+
+    def load(self, patterns: "Iterable[str]") -> InstrDict:
+        """
+        Instructions belonging to any of the given extensions (names or glob
+        patterns), sorted by name as in instr_dict.json. The instruction
+        entries are shared with the shard cache and must not be modified.
+        """
+        extensions = set(self.resolve(patterns))
+        shards = {s for ext in extensions for s in self.index["extensions"][ext]}
+        instr_dict: InstrDict = {}
+        for shard in sorted(shards):
+            for name, instr in self.shard(shard).items():
+                if extensions.intersection(instr["extension"]):
+                    instr_dict[name] = instr
+        return dict(sorted(instr_dict.items()))
+
+
+_databases: "Dict[str, ShardedInstrDB]" = {}
+
+
+def load_extensions(
+    patterns: "Iterable[str]", directory: str = SHARDS_DIR
+) -> InstrDict:
+    """
+    Load the instructions of the given extensions from the sharded dictionary
+    in directory, reusing the index and shards loaded by earlier calls.
+    """
+    key = os.path.realpath(directory)
+    if key not in _databases:
+        _databases[key] = ShardedInstrDB(directory)
+    return _databases[key].load(patterns)
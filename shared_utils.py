@@ -4,12 +4,12 @@ import glob
 import logging
 import os
 import pprint
-import re
 from itertools import chain
-from typing import Dict, Optional, TypedDict
+from typing import Dict, NamedTuple, Optional, TypedDict
 
 from constants import (
     arg_lut,
+    encoding_token,
     fixed_ranges,
     imported_regex,
     overlapping_extensions,
@@ -17,6 +17,7 @@ from constants import (
     pseudo_regex,
     single_fixed,
 )
+from profile_utils import span
 
 LOG_FORMAT = "%(levelname)s:: %(message)s"
 LOG_LEVEL = logging.INFO
@@ -147,6 +148,54 @@ def update_encoding_args(encoding_args: "list[str]", arg: str, msb: int, lsb: in
         encoding_args[31 - ind] = arg
 
 
+# Check that none of the given bits was assigned before
+def check_free_bits(used: int, bits: int, line: str):
+    """
+    Bit mask version of check_overlapping_bits: reports the lowest bit of bits
+    that is already set in used.
+    """
+    overlap = used & bits
+    if overlap:
+        ind = (overlap & -overlap).bit_length() - 1
+        log_and_exit(
+            f'{line.split(" ")[0]:<10} has {ind} bit overlapping in its opcodes'
+        )
+
+
+# Split the encoding part of an instruction line into its tokens
+def tokenize_encoding(
+    remaining: str,
+) -> "tuple[list[tuple[str, str, str]], list[tuple[str, str]], list[str]]":
+    """
+    Scans the encoding part of an instruction line once and returns its fixed
+    ranges as (msb, lsb, value), its single fixed bits as (lsb, value) and its
+    argument names, each in order of appearance.
+    """
+    ranges: "list[tuple[str, str, str]]" = []
+    bits: "list[tuple[str, str]]" = []
+    args: "list[str]" = []
+    for msb, lsb, val, bit, bit_val, arg in encoding_token.findall(remaining):
+        if arg:
+            args.append(arg)
+        elif bit:
+            bits.append((bit, bit_val))
+        else:
+            ranges.append((msb, lsb, val))
+    return ranges, bits, args
+
+
+ENCODING_DIGITS = str.maketrans("012", "-01")
+
+
+# Build the encoding string from match and mask
+def match_mask_to_encoding(match: int, mask: int) -> str:
+    """Encoding string with 1/0 for the bits set in mask and '-' elsewhere."""
+    # Adding the binary digits of mask and match read as decimal numbers gives
+    # one digit per bit: 0 (not in mask), 1 (fixed to 0) or 2 (fixed to 1).
+    digits = int(format(mask, "b")) + int(format(match, "b"))
+    return f"{digits:032d}".translate(ENCODING_DIGITS)
+
+
 # Compute match and mask
 def convert_encoding_to_match_mask(encoding: "list[str]") -> "tuple[str, str]":
     """Convert the encoding list to match and mask strings."""
@@ -192,33 +241,54 @@ def process_enc_line(line: str, ext: str) -> "tuple[str, SingleInstr]":
         - mask: hex value representin the bits that need to be masked to extract
           the value required for matching.
     """
-    encoding = initialize_encoding()
-
-    # Parse the instruction line
-    name, remaining = parse_instruction_line(line)
-
-    # Process fixed ranges
-    remaining = process_fixed_ranges(remaining, encoding, line)
-
-    # Process single fixed assignments
-    process_single_fixed(remaining, encoding, line)
-
-    # Convert the list of encodings into a match and mask
-    match, mask = convert_encoding_to_match_mask(encoding)
-
-    # Check arguments in arg_lut
-    args = single_fixed.sub(" ", remaining).split()
-    encoding_args = encoding.copy()
-
-    check_arg_lut(args, encoding_args, name)
+    with span("process_enc_line", "parse"):
+        # Parse the instruction line
+        name, remaining = parse_instruction_line(line)
+        ranges, bits, args = tokenize_encoding(remaining)
+
+        # Process fixed ranges, then single fixed assignments, accumulating
+        # the bits as integers
+        match = mask = 0
+        for s2, s1, entry in ranges:
+            msb, lsb, entry_value = int(s2), int(s1), int(entry, 0)
+            validate_bit_range(msb, lsb, entry_value, line)
+            if msb > 31:
+                log_and_exit(
+                    f'{line.split(" ")[0]:<10} has position {msb} beyond bit 31 in its encoding'
+                )
+            field = ((1 << (msb - lsb + 1)) - 1) << lsb
+            check_free_bits(mask, field, line)
+            mask |= field
+            match |= entry_value << lsb
+
+        for s1, entry in bits:
+            lsb, entry_value = int(s1, 0), int(entry, 0)
+            check_free_bits(mask, 1 << lsb, line)
+            validate_bit_range(lsb, lsb, entry_value, line)
+            if lsb > 31:
+                log_and_exit(
+                    f'{line.split(" ")[0]:<10} has position {lsb} beyond bit 31 in its encoding'
+                )
+            mask |= 1 << lsb
+            match |= entry_value << lsb
+
+        # Check arguments in arg_lut and that they do not overlap
+        used = mask
+        for arg in args:
+            if arg not in arg_lut:
+                arg = handle_arg_lut_mapping(arg, name)
+            msb, lsb = arg_lut[arg]
+            field = ((1 << (msb - lsb + 1)) - 1) << lsb
+            check_free_bits(used, field, arg)
+            used |= field
 
     # Return single_dict
     return name, {
-        "encoding": "".join(encoding),
+        "encoding": match_mask_to_encoding(match, mask),
         "variable_fields": args,
         "extension": [os.path.basename(ext)],
-        "match": match,
-        "mask": mask,
+        "match": hex(match),
+        "mask": hex(mask),
     }
 
 
@@ -293,6 +363,76 @@ def instruction_overlap_allowed(x: str, y: str) -> bool:
     return overlap_allowed(overlapping_instructions, x, y)
 
 
+# Bits (funct3 and the major opcode) whose values bucket instructions for the
+# overlap checks. Two instructions whose keys conflict can never overlap.
+OVERLAP_KEY_BITS = (14, 13, 12, 6, 5, 4, 3, 2, 1, 0)
+
+
+# Compute the overlap bucket key of an encoding
+def overlap_key(encoding: str) -> str:
+    """Extracts the OVERLAP_KEY_BITS of an encoding string ('-' where unset)."""
+    return "".join(
+        encoding[-1 - bit] if bit < len(encoding) else "-" for bit in OVERLAP_KEY_BITS
+    )
+
+
+class OverlapIndex:
+    """
+    Buckets instructions by their overlap_key so that a new instruction only
+    has to be compared against the instructions it can possibly overlap with,
+    rather than against the whole dictionary. Keys without don't-care bits are
+    looked up directly; keys with don't-care bits are few and are matched
+    against the new key character by character.
+    """
+
+    def __init__(self):
+        self.fixed: "dict[str, list[tuple[int, str]]]" = {}
+        self.wild: "dict[str, list[tuple[int, str]]]" = {}
+        self.count = 0
+
+    @classmethod
+    def from_instr_dict(cls, instr_dict: "InstrDict") -> "OverlapIndex":
+        index = cls()
+        for name, instr in instr_dict.items():
+            index.add(name, instr["encoding"])
+        return index
+
+    @classmethod
+    def from_buckets(cls, buckets: "dict[str, list[str]]") -> "OverlapIndex":
+        """The index of the names listed under each overlap_key."""
+        index = cls()
+        for key, names in buckets.items():
+            for name in names:
+                index.add_key(name, key)
+        return index
+
+    def add(self, name: str, encoding: str):
+        self.add_key(name, overlap_key(encoding))
+
+    def add_key(self, name: str, key: str):
+        buckets = self.wild if "-" in key else self.fixed
+        buckets.setdefault(key, []).append((self.count, name))
+        self.count += 1
+
+    def compatible_keys(self, key: str) -> "list[str]":
+        """Returns the keys of all buckets that may overlap with key."""
+        keys = [k for k in self.wild if overlaps(k, key)]
+        if "-" in key:
+            keys.extend(k for k in self.fixed if overlaps(k, key))
+        elif key in self.fixed:
+            keys.append(key)
+        return keys
+
+    def candidates(self, encoding: str) -> "list[str]":
+        """Returns the instructions that may overlap, in insertion order."""
+        entries = [
+            entry
+            for k in self.compatible_keys(overlap_key(encoding))
+            for entry in self.fixed.get(k, self.wild.get(k, []))
+        ]
+        return [name for _count, name in sorted(entries)]
+
+
 # Check 'nf' field
 def is_segmented_instruction(instruction: SingleInstr) -> bool:
     """Checks if an instruction contains the 'nf' field."""
@@ -397,48 +537,97 @@ def create_expanded_instruction(
 # Return a list of relevant lines from the specified file
 def read_lines(file: str) -> "list[str]":
     """Reads lines from a file and returns non-blank, non-comment lines."""
-    with open(file, encoding="utf-8") as fp:
+    with span("read_lines", "io"), open(file, encoding="utf-8") as fp:
         lines = (line.rstrip() for line in fp)
         return [line for line in lines if line and not line.startswith("#")]
 
 
+# Add a standard instruction to the instruction dictionary
+def add_standard_instruction(
+    instr_dict: InstrDict,
+    name: str,
+    single_dict: SingleInstr,
+    ext_name: str,
+    overlap_index: OverlapIndex,
+    check_overlap: bool = True,
+):
+    """
+    Adds a single standard instruction to the instruction dictionary, merging
+    it with a same-named instruction from another base ISA. New instructions
+    are checked for overlaps against the candidates of overlap_index, unless
+    check_overlap is False because the caller knows they were validated before.
+    """
+    if name in instr_dict:
+        var = instr_dict[name]["extension"]
+        if same_base_isa(ext_name, var):
+            log_and_exit(
+                f"Instruction {name} from {ext_name} is already added from {var} in same base ISA"
+            )
+        elif instr_dict[name]["encoding"] != single_dict["encoding"]:
+            log_and_exit(
+                f"Instruction {name} from {ext_name} has different encodings in different base ISAs"
+            )
+
+        instr_dict[name]["extension"].extend(single_dict["extension"])
+    else:
+        if check_overlap:
+            check_instruction_overlaps(
+                instr_dict, name, single_dict, ext_name, overlap_index
+            )
+        instr_dict[name] = single_dict
+        overlap_index.add(name, single_dict["encoding"])
+
+
+# Reject a new instruction overlapping one of the instruction dictionary
+def check_instruction_overlaps(
+    instr_dict: InstrDict,
+    name: str,
+    single_dict: SingleInstr,
+    ext_name: str,
+    overlap_index: OverlapIndex,
+):
+    """
+    Exits if instruction name of extension file ext_name overlaps one of the
+    candidates of overlap_index in the same base ISA, unless the overlap is
+    allowed for the extensions or the instructions.
+    """
+    with span("overlap_check", "parse"):
+        for key in overlap_index.candidates(single_dict["encoding"]):
+            item = instr_dict[key]
+            if (
+                overlaps(item["encoding"], single_dict["encoding"])
+                and not extension_overlap_allowed(ext_name, item["extension"][0])
+                and not instruction_overlap_allowed(name, key)
+                and same_base_isa(ext_name, item["extension"])
+            ):
+                log_and_exit(
+                    f'Instruction {name} in extension {ext_name} overlaps with {key} in {item["extension"]}'
+                )
+
+
 # Update the instruction dictionary
 def process_standard_instructions(
-    lines: "list[str]", instr_dict: InstrDict, file_name: str
+    lines: "list[str]",
+    instr_dict: InstrDict,
+    file_name: str,
+    overlap_index: "Optional[OverlapIndex]" = None,
+    check_overlap: bool = True,
 ):
-    """Processes standard instructions from the given lines and updates the instruction dictionary."""
+    """
+    Processes standard instructions from the given lines and updates the
+    instruction dictionary, checking overlaps unless check_overlap is False.
+    """
+    if overlap_index is None:
+        overlap_index = OverlapIndex.from_instr_dict(instr_dict)
     for line in lines:
         if "$import" in line or "$pseudo" in line:
             continue
-        logging.debug(f"Processing line: {line}")
+        logging.debug("Processing line: %s", line)
         name, single_dict = process_enc_line(line, file_name)
         ext_name = os.path.basename(file_name)
-
-        if name in instr_dict:
-            var = instr_dict[name]["extension"]
-            if same_base_isa(ext_name, var):
-                log_and_exit(
-                    f"Instruction {name} from {ext_name} is already added from {var} in same base ISA"
-                )
-            elif instr_dict[name]["encoding"] != single_dict["encoding"]:
-                log_and_exit(
-                    f"Instruction {name} from {ext_name} has different encodings in different base ISAs"
-                )
-
-            instr_dict[name]["extension"].extend(single_dict["extension"])
-        else:
-            for key, item in instr_dict.items():
-                if (
-                    overlaps(item["encoding"], single_dict["encoding"])
-                    and not extension_overlap_allowed(ext_name, item["extension"][0])
-                    and not instruction_overlap_allowed(name, key)
-                    and same_base_isa(ext_name, item["extension"])
-                ):
-                    log_and_exit(
-                        f'Instruction {name} in extension {ext_name} overlaps with {key} in {item["extension"]}'
-                    )
-
-            instr_dict[name] = single_dict
+        add_standard_instruction(
+            instr_dict, name, single_dict, ext_name, overlap_index, check_overlap
+        )
 
 
 # Incorporate pseudo instructions into the instruction dictionary based on given conditions
@@ -454,11 +643,11 @@ def process_pseudo_instructions(
     for line in lines:
         if "$pseudo" not in line:
             continue
-        logging.debug(f"Processing pseudo line: {line}")
+        logging.debug("Processing pseudo line: %s", line)
         ext, orig_inst, pseudo_inst, line_content = pseudo_regex.findall(line)[0]
-        ext_file = find_extension_file(ext, opcodes_dir)
-        # print("ext_file",ext_file)
-        validate_instruction_in_extension(orig_inst, ext_file, file_name, pseudo_inst)
+        find_instruction_line(
+            ext, orig_inst, opcodes_dir, file_name, f"pseudo_op {pseudo_inst}"
+        )
 
         name, single_dict = process_enc_line(f"{pseudo_inst} {line_content}", file_name)
         if (
@@ -468,7 +657,7 @@ def process_pseudo_instructions(
         ):
             if name not in instr_dict:
                 instr_dict[name] = single_dict
-                logging.debug(f"Including pseudo_op: {name}")
+                logging.debug("Including pseudo_op: %s", name)
             else:
                 if single_dict["match"] != instr_dict[name]["match"]:
                     instr_dict[f"{name}_pseudo"] = single_dict
@@ -485,25 +674,20 @@ def process_imported_instructions(
     for line in lines:
         if "$import" not in line:
             continue
-        logging.debug(f"Processing imported line: {line}")
+        logging.debug("Processing imported line: %s", line)
         import_ext, reg_instr = imported_regex.findall(line)[0]
-        ext_filename = find_extension_file(import_ext, opcodes_dir)
-
-        validate_instruction_in_extension(reg_instr, ext_filename, file_name, line)
-
-        with open(ext_filename, encoding="utf-8") as ext_file:
-            for oline in ext_file:
-                if re.findall(f"^\\s*{reg_instr}\\s+", oline):
-                    name, single_dict = process_enc_line(oline, file_name)
-                    if name in instr_dict:
-                        if instr_dict[name]["encoding"] != single_dict["encoding"]:
-                            log_and_exit(
-                                f"Imported instruction {name} from {os.path.basename(file_name)} has different encodings"
-                            )
-                        instr_dict[name]["extension"].extend(single_dict["extension"])
-                    else:
-                        instr_dict[name] = single_dict
-                    break
+        oline = find_instruction_line(
+            import_ext.strip(), reg_instr.strip(), opcodes_dir, file_name, line
+        )
+        name, single_dict = process_enc_line(oline, file_name)
+        if name in instr_dict:
+            if instr_dict[name]["encoding"] != single_dict["encoding"]:
+                log_and_exit(
+                    f"Imported instruction {name} from {os.path.basename(file_name)} has different encodings"
+                )
+            instr_dict[name]["extension"].extend(single_dict["extension"])
+        else:
+            instr_dict[name] = single_dict
 
 
 # Locate the path of the specified extension file, checking fallback directories
@@ -523,23 +707,143 @@ def validate_instruction_in_extension(
     inst: str, ext_filename: str, file_name: str, pseudo_inst: str
 ):
     """Validates if the original instruction exists in the dependent extension."""
-    found = False
-    with open(ext_filename, encoding="utf-8") as ext_file:
-        for oline in ext_file:
-            if re.findall(f"^\\s*{inst}\\s+", oline):
-                found = True
-                break
-    if not found:
+    if inst not in load_extension_file(ext_filename).definitions:
         log_and_exit(
-            f"Original instruction {inst} required by pseudo_op {pseudo_inst} in {file_name} not found in {ext_file}"
+            f"Original instruction {inst} required by pseudo_op {pseudo_inst} in {file_name} not found in {ext_filename}"
         )
 
 
+class ExtensionFile(NamedTuple):
+    """An extension file as parsed from, and what other files need from it."""
+
+    signature: "tuple[int, int]"  # mtime_ns and size of the file when read
+    lines: "list[str]"  # as returned by read_lines
+    definitions: "Dict[str, str]"  # instruction, as written -> defining line
+    imports: "Dict[str, str]"  # instruction -> extension it is imported from
+    dependencies: "list[str]"  # extensions named by $import and $pseudo_op lines
+
+
+# Extension files read by create_inst_dict, selected or depended on: path ->
+# ExtensionFile, read again once the file changes.
+_extension_files: "Dict[str, ExtensionFile]" = {}
+
+
+def load_extension_file(path: str) -> ExtensionFile:
+    """The lines, definitions and dependencies of the extension file at path."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _extension_files.get(path)
+    if cached is not None and cached.signature == signature:
+        return cached
+
+    definitions: "Dict[str, str]" = {}
+    imports: "Dict[str, str]" = {}
+    dependencies: "list[str]" = []
+    lines = read_lines(path)
+    for line in lines:
+        if "$import" in line:
+            ext, inst = (part.strip() for part in imported_regex.findall(line)[0])
+            imports.setdefault(inst, ext)
+        elif "$pseudo" in line:
+            ext = pseudo_regex.findall(line)[0][0]
+        else:
+            definitions.setdefault(line.split()[0], line)
+            continue
+        if ext != os.path.basename(path) and ext not in dependencies:
+            dependencies.append(ext)
+    _extension_files[path] = ExtensionFile(
+        signature, lines, definitions, imports, dependencies
+    )
+    return _extension_files[path]
+
+
+# Find the line defining an instruction a pseudo-op or an import refers to
+def find_instruction_line(
+    ext: str, inst: str, opcodes_dir: str, file_name: str, required_by: str
+) -> str:
+    """
+    The line defining instruction inst in extension ext, following the
+    $import lines of ext if it only imports inst. required_by (a pseudo-op
+    or an $import line of file_name) is named in the errors.
+    """
+    visited = [ext]
+    while True:
+        ext_file = find_extension_file(ext, opcodes_dir)
+        extension = load_extension_file(ext_file)
+        if inst in extension.definitions:
+            return extension.definitions[inst]
+        if inst not in extension.imports:
+            log_and_exit(
+                f"Original instruction {inst} required by {required_by} in {file_name} not found in {ext_file}"
+            )
+        ext = extension.imports[inst]
+        if ext in visited:
+            log_and_exit(
+                f"Instruction {inst} required by {required_by} in {file_name} is imported in a cycle: {' -> '.join(visited + [ext])}"
+            )
+        visited.append(ext)
+
+
+# Cycles of extension files already reported by extension_dependencies
+_reported_cycles: "set[frozenset[str]]" = set()
+
+
+# Order extension files after the ones they depend on
+def extension_dependencies(file_names: "list[str]", opcodes_dir: str) -> "list[str]":
+    """
+    The paths of file_names and of the extension files they depend on
+    through $import and $pseudo_op lines, transitively, each after its
+    dependencies (loading them on the way, see load_extension_file). Files
+    may depend on each other through different instructions, e.g. rv64_zbb
+    and rv64_zbkb: such a cycle is broken where it is found, and reported
+    once.
+    """
+    order: "list[str]" = []
+    listed: "Dict[str, bool]" = {}  # path -> whether it is in order yet
+    visiting: "list[str]" = []
+
+    def visit(path: str):
+        if path in listed:
+            if not listed[path]:
+                cycle = visiting[visiting.index(path) :] + [path]
+                if frozenset(cycle) not in _reported_cycles:
+                    _reported_cycles.add(frozenset(cycle))
+                    names = " -> ".join(os.path.basename(p) for p in cycle)
+                    logging.warning(f"Extension files depending on each other: {names}")
+            return
+        listed[path] = False
+        visiting.append(path)
+        for ext in load_extension_file(path).dependencies:
+            visit(find_extension_file(ext, opcodes_dir))
+        visiting.pop()
+        listed[path] = True
+        order.append(path)
+
+    for file_name in file_names:
+        visit(file_name)
+    return order
+
+
+# Default location of the rv* extension files
+OPCODES_DIR = os.path.dirname(os.path.realpath(__file__)) + "/extensions"
+
+
+# Expand the extension globs into the list of files to parse
+def extension_file_names(file_filter: "list[str]", opcodes_dir: str) -> "list[str]":
+    """Returns the files matched by each glob of file_filter, in parsing order."""
+    return [
+        file
+        for fil in file_filter
+        for file in sorted(glob.glob(f"{opcodes_dir}/{fil}"), reverse=True)
+    ]
+
+
 # Construct a dictionary of instructions filtered by specified criteria
 def create_inst_dict(
     file_filter: "list[str]",
     include_pseudo: bool = False,
     include_pseudo_ops: "Optional[list[str]]" = None,
+    opcodes_dir: str = OPCODES_DIR,
 ) -> InstrDict:
     """
     Creates a dictionary of instructions based on the provided file filters.
@@ -575,47 +879,68 @@ def create_inst_dict(
     if include_pseudo_ops is None:
         include_pseudo_ops = []
 
-    opcodes_dir = os.path.dirname(os.path.realpath(__file__)) + "/extensions"
     instr_dict: InstrDict = {}
+    overlap_index = OverlapIndex()
 
-    file_names = [
-        file
-        for fil in file_filter
-        for file in sorted(glob.glob(f"{opcodes_dir}/{fil}"), reverse=True)
-    ]
+    with span("glob", "io"):
+        file_names = extension_file_names(file_filter, opcodes_dir)
+
+    # Only a preload: the files are parsed in the order of file_filter, which
+    # gives the order of the extensions of each instruction, and the files
+    # named by $import and $pseudo_op lines are read once here.
+    logging.debug("Loading the dependencies")
+    with span("dependencies", "io"):
+        extension_dependencies(file_names, opcodes_dir)
+
+    lines = {
+        file_name: load_extension_file(file_name).lines for file_name in file_names
+    }
 
     logging.debug("Collecting standard instructions")
-    for file_name in file_names:
-        logging.debug(f"Parsing File: {file_name} for standard instructions")
-        lines = read_lines(file_name)
-        process_standard_instructions(lines, instr_dict, file_name)
+    with span("standard_instructions"):
+        for file_name in file_names:
+            logging.debug("Parsing File: %s for standard instructions", file_name)
+            process_standard_instructions(
+                lines[file_name], instr_dict, file_name, overlap_index
+            )
 
     logging.debug("Collecting pseudo instructions")
-    for file_name in file_names:
-        logging.debug(f"Parsing File: {file_name} for pseudo instructions")
-        lines = read_lines(file_name)
-        process_pseudo_instructions(
-            lines,
-            instr_dict,
-            file_name,
-            opcodes_dir,
-            include_pseudo,
-            include_pseudo_ops,
-        )
+    with span("pseudo_instructions"):
+        for file_name in file_names:
+            logging.debug("Parsing File: %s for pseudo instructions", file_name)
+            process_pseudo_instructions(
+                lines[file_name],
+                instr_dict,
+                file_name,
+                opcodes_dir,
+                include_pseudo,
+                include_pseudo_ops,
+            )
 
     logging.debug("Collecting imported instructions")
-
-    for file_name in file_names:
-        logging.debug(f"Parsing File: {file_name} for imported instructions")
-        lines = read_lines(file_name)
-        process_imported_instructions(lines, instr_dict, file_name, opcodes_dir)
+    with span("imported_instructions"):
+        for file_name in file_names:
+            logging.debug("Parsing File: %s for imported instructions", file_name)
+            process_imported_instructions(
+                lines[file_name], instr_dict, file_name, opcodes_dir
+            )
 
     return instr_dict
 
 
-# Extracts the extensions used in an instruction dictionary
+# Extracts the extensions used in an instruction dictionary, sorted by name
 def instr_dict_2_extensions(instr_dict: InstrDict) -> "list[str]":
-    return list({item["extension"][0] for item in instr_dict.values()})
+    return list(group_by_extension(instr_dict))
+
+
+# Splits an instruction dictionary by owning extension (first entry of
+# "extension") in a single pass. Extensions are sorted by name, instructions
+# keep their order.
+def group_by_extension(instr_dict: InstrDict) -> "Dict[str, InstrDict]":
+    groups: "Dict[str, InstrDict]" = {}
+    for name, instr in instr_dict.items():
+        groups.setdefault(instr["extension"][0], {})[name] = instr
+    return dict(sorted(groups.items()))
 
 
 # Returns signed interpretation of a value within a given width
@@ -0,0 +1,173 @@
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from typing import BinaryIO
+
+from constants import causes, csrs, csrs32
+from shared_utils import InstrDict, arg_lut
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# The instruction <-> extension and instruction <-> field relations keep a
+# position column so that the list order of instr_dict (e.g. the owning
+# extension first) survives the round trip.
+#
+# The decode view answers "which instructions match word X": insert the
+# word(s) into decode_word and select from decode, e.g.
+#   INSERT INTO decode_word VALUES (0x00b50533);
+#   SELECT word, name, extension FROM decode;
+SQLITE_SCHEMA = """
+CREATE TABLE extensions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE instructions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    encoding TEXT NOT NULL,
+    match INTEGER NOT NULL,
+    mask INTEGER NOT NULL
+);
+CREATE TABLE instruction_extensions (
+    instruction_id INTEGER NOT NULL REFERENCES instructions(id),
+    extension_id INTEGER NOT NULL REFERENCES extensions(id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (instruction_id, position)
+);
+CREATE TABLE fields (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    msb INTEGER NOT NULL,
+    lsb INTEGER NOT NULL
+);
+CREATE TABLE instruction_fields (
+    instruction_id INTEGER NOT NULL REFERENCES instructions(id),
+    field_id INTEGER NOT NULL REFERENCES fields(id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (instruction_id, position)
+);
+CREATE TABLE csrs (
+    number INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    rv32_only INTEGER NOT NULL
+);
+CREATE TABLE causes (
+    number INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE decode_word (
+    word INTEGER NOT NULL
+);
+
+CREATE INDEX instructions_match ON instructions(match);
+CREATE INDEX instructions_mask ON instructions(mask, match);
+CREATE INDEX instruction_extensions_extension ON instruction_extensions(extension_id);
+CREATE INDEX instruction_fields_field ON instruction_fields(field_id);
+CREATE INDEX csrs_number ON csrs(number);
+CREATE INDEX csrs_name ON csrs(name);
+
+CREATE VIEW instruction_listing AS
+    SELECT i.name, e.name AS extension, i.match, i.mask, i.encoding
+    FROM instructions AS i
+    JOIN instruction_extensions AS ie ON ie.instruction_id = i.id AND ie.position = 0
+    JOIN extensions AS e ON e.id = ie.extension_id;
+
+CREATE VIEW decode AS
+    SELECT w.word, l.name, l.extension, l.match, l.mask
+    FROM decode_word AS w
+    JOIN instruction_listing AS l ON (w.word & l.mask) = l.match;
+"""
+
+
+def populate_sqlite(conn: sqlite3.Connection, instr_dict: InstrDict):
+    """
+    Create the schema in an empty database and bulk-load the instructions,
+    arg_lut fields, CSRs and causes in a single transaction.
+    """
+    extension_ids: dict[str, int] = {}
+    for instr in instr_dict.values():
+        for ext in instr["extension"]:
+            extension_ids.setdefault(ext, len(extension_ids) + 1)
+    field_ids = {name: i for i, name in enumerate(arg_lut, start=1)}
+    for instr in instr_dict.values():
+        for field in instr["variable_fields"]:
+            field_ids.setdefault(field, len(field_ids) + 1)
+    instr_ids = {name: i for i, name in enumerate(instr_dict, start=1)}
+
+    conn.executescript(SQLITE_SCHEMA)
+    with conn:
+        conn.executemany(
+            "INSERT INTO extensions VALUES (?, ?)",
+            ((i, name) for name, i in extension_ids.items()),
+        )
+        conn.executemany(
+            "INSERT INTO fields VALUES (?, ?, ?, ?)",
+            ((i, name, *arg_lut[name]) for name, i in field_ids.items()),
+        )
+        conn.executemany(
+            "INSERT INTO instructions VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    instr_ids[name],
+                    name,
+                    instr["encoding"],
+                    int(instr["match"], 16),
+                    int(instr["mask"], 16),
+                )
+                for name, instr in instr_dict.items()
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO instruction_extensions VALUES (?, ?, ?)",
+            (
+                (instr_ids[name], extension_ids[ext], pos)
+                for name, instr in instr_dict.items()
+                for pos, ext in enumerate(instr["extension"])
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO instruction_fields VALUES (?, ?, ?)",
+            (
+                (instr_ids[name], field_ids[field], pos)
+                for name, instr in instr_dict.items()
+                for pos, field in enumerate(instr["variable_fields"])
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO csrs VALUES (?, ?, ?)",
+            [(num, name, 0) for num, name in csrs]
+            + [(num, name, 1) for num, name in csrs32],
+        )
+        conn.executemany("INSERT INTO causes VALUES (?, ?)", causes)
+
+
+def write_sqlite(instr_dict: InstrDict, out: BinaryIO):
+    """
+    Write the database image to a binary file object. The database is built
+    in memory, see write_image.
+    """
+    with closing(sqlite3.connect(":memory:")) as conn:
+        populate_sqlite(conn, instr_dict)
+        write_image(conn, out)
+
+
+def write_image(conn: sqlite3.Connection, out: BinaryIO):
+    """
+    Write the image of the database of conn to a binary file object,
+    serialized where sqlite3 can (Python 3.11+). Older versions have no
+    other way to get the image than to back the database up to a temporary
+    file and read it back.
+    """
+    serialize = getattr(conn, "serialize", None)
+    if serialize is not None:
+        out.write(serialize())
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "instr_dict.sqlite")
+        with closing(sqlite3.connect(path)) as db_file_conn:
+            conn.backup(db_file_conn)
+        with open(path, "rb") as db_file:
+            shutil.copyfileobj(db_file, out)
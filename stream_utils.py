@@ -0,0 +1,261 @@
+import logging
+from itertools import groupby
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from decoder_utils import (
+    exclusive_clashes,
+    field_constraints,
+    for_xlen,
+    is_compressed,
+    takes_priority,
+)
+from shared_utils import InstrDict
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# classify() result for words that match no instruction, and for words
+# whose matching instructions take no priority over each other
+UNKNOWN = -1
+AMBIGUOUS = -2
+
+# Rounds of redrawing the words that violate a field constraint before
+# giving up on an instruction whose constraints cannot be met.
+MAX_REDRAWS = 64
+
+
+class InstrStream:
+    """
+    Draws random legal instruction words from an instruction dictionary with
+    NumPy (imported by the methods needing it, so that this module imports
+    without it): the instruction of every word is drawn by weight, its fixed bits
+    come from match and its free bits are random, redrawn while they violate
+    a field constraint (see field_constraints). Compressed instructions only
+    use the low 16 bits.
+
+    xlen (32 or 64) leaves out the instructions of the other XLEN, as
+    several RV32 and RV64 compressed instructions share their encodings and
+    words of one would not decode to the instruction they were drawn for.
+    For the same reason, instr_dict is of one configuration: instructions of
+    mutually exclusive extensions sharing encodings (see
+    decoder_utils.exclusive_clashes) are a ValueError.
+    weights maps instruction or extension names to relative weights (the
+    name of an instruction first, then its extensions in order, 1.0 if none
+    is listed); instructions of weight 0 are never drawn.
+    """
+
+    def __init__(
+        self,
+        instr_dict: InstrDict,
+        xlen: int,
+        weights: "Optional[Dict[str, float]]" = None,
+    ):
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        if xlen not in (32, 64):
+            raise ValueError(f"Unsupported XLEN {xlen}")
+        clashes = exclusive_clashes(instr_dict, xlen)
+        if clashes:
+            raise ValueError(
+                f"Instructions of mutually exclusive extensions share encodings, "
+                f"e.g. {' and '.join(clashes[0])}"
+            )
+        weights = weights or {}
+        self.names: "List[str]" = []
+        matches: "List[int]" = []
+        masks: "List[int]" = []
+        frees: "List[int]" = []
+        probabilities: "List[float]" = []
+        constraints: "List[List[Tuple[int, int]]]" = []
+        for name, instr in instr_dict.items():
+            if not for_xlen(instr["extension"], xlen):
+                continue
+            match, mask = int(instr["match"], 16), int(instr["mask"], 16)
+            weight = weights.get(name)
+            for ext in instr["extension"]:
+                if weight is None:
+                    weight = weights.get(ext)
+            self.names.append(name)
+            matches.append(match)
+            masks.append(mask)
+            frees.append(~mask & (0xFFFF if is_compressed(mask, match) else 0xFFFFFFFF))
+            probabilities.append(1.0 if weight is None else weight)
+            constraints.append(field_constraints(instr["variable_fields"]))
+
+        total = sum(probabilities)
+        if total <= 0:
+            raise ValueError("At least one instruction needs a positive weight")
+        self.match = np.array(matches, dtype=np.uint32)
+        self.mask = np.array(masks, dtype=np.uint32)
+        self.free = np.array(frees, dtype=np.uint32)
+        self.probability = np.array(probabilities) / total
+
+        # constraints padded to the same count per instruction; the padding
+        # (mask 0, value 1) can never be violated
+        width = max((len(c) for c in constraints), default=0)
+        self.constraint_mask = np.zeros((len(self.names), width), dtype=np.uint32)
+        self.constraint_value = np.ones((len(self.names), width), dtype=np.uint32)
+        for i, instr_constraints in enumerate(constraints):
+            for j, (mask, value) in enumerate(instr_constraints):
+                self.constraint_mask[i, j] = mask
+                self.constraint_value[i, j] = value
+
+        # for classify(): per distinct mask, the sorted matches and their
+        # instructions; of instructions sharing mask and match, the first one
+        # is found by the lookup and the others are its twins
+        self.by_mask: "List[Tuple[int, np.ndarray, np.ndarray]]" = []
+        self.twins: "Dict[int, List[int]]" = {}
+        for mask in sorted(set(masks)):
+            indices = sorted(
+                (i for i in range(len(self.names)) if masks[i] == mask),
+                key=lambda i: matches[i],
+            )
+            for _, group in groupby(indices, key=lambda i: matches[i]):
+                first, *twins = group
+                if twins:
+                    self.twins[first] = twins
+            self.by_mask.append(
+                (
+                    mask,
+                    np.array([matches[i] for i in indices], dtype=np.uint32),
+                    np.array(indices),
+                )
+            )
+        self.duplicated = np.zeros(len(self.names), dtype=bool)
+        self.duplicated[list(self.twins)] = True
+        self.winners: "Dict[Tuple[int, int], int]" = {}
+
+    def violations(self, words: "np.ndarray", indices: "np.ndarray") -> "np.ndarray":
+        """Whether each word violates a field constraint of its instruction."""
+        return (
+            (words[:, None] & self.constraint_mask[indices])
+            == self.constraint_value[indices]
+        ).any(axis=1)
+
+    def generate(
+        self, count: int, rng: "np.random.Generator"
+    ) -> "Tuple[np.ndarray, np.ndarray]":
+        """
+        Draws count words, returned as uint32 words and the indices of their
+        instructions in names.
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        indices = rng.choice(len(self.names), size=count, p=self.probability)
+        words = self.match[indices] | (
+            rng.integers(0, 1 << 32, size=count, dtype=np.uint32) & self.free[indices]
+        )
+        redraw = np.flatnonzero(self.violations(words, indices))
+        for _ in range(MAX_REDRAWS):
+            if redraw.size == 0:
+                return words, indices
+            redrawn = indices[redraw]
+            words[redraw] = self.match[redrawn] | (
+                rng.integers(0, 1 << 32, size=redraw.size, dtype=np.uint32)
+                & self.free[redrawn]
+            )
+            redraw = redraw[self.violations(words[redraw], redrawn)]
+        names = sorted({self.names[i] for i in indices[redraw]})
+        raise ValueError(f"Cannot meet the field constraints of {names}")
+
+    def winner(self, a: int, b: int) -> int:
+        """The instruction a word matching both a and b decodes to."""
+        if (a, b) not in self.winners:
+            priority = takes_priority(
+                (int(self.mask[a]), int(self.match[a]), self.names[a]),
+                (int(self.mask[b]), int(self.match[b]), self.names[b]),
+            )
+            self.winners[a, b] = AMBIGUOUS if priority is None else a if priority else b
+        return self.winners[a, b]
+
+    def best(self, candidates: "List[int]") -> "List[int]":
+        """The candidates no other candidate takes priority over."""
+        return [
+            b
+            for b in candidates
+            if not any(a != b and self.winner(a, b) == a for a in candidates)
+        ]
+
+    def classify(self, words: "np.ndarray") -> "np.ndarray":
+        """
+        The instruction (index in names) each word decodes to, with the
+        priorities of decoder_utils.takes_priority where several match, or
+        UNKNOWN or AMBIGUOUS.
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        found = np.full(len(words), UNKNOWN)
+        # words matched by instructions taking no priority over each other:
+        # position -> the instructions besides found[position]
+        tied: "Dict[int, List[int]]" = {}
+        for mask, matches, indices in self.by_mask:
+            keys = words & np.uint32(mask)
+            positions = np.minimum(np.searchsorted(matches, keys), len(matches) - 1)
+            hits = np.flatnonzero(matches[positions] == keys)
+            if hits.size == 0:
+                continue
+            new = indices[positions[hits]]
+            current = found[hits]
+            first = current == UNKNOWN
+            found[hits[first]] = new[first]
+            # words matched before: resolve each distinct pair once
+            both = np.flatnonzero(~first)
+            resolved = np.full(hits.size, UNKNOWN)
+            if both.size:
+                pairs = np.stack([new[both], current[both]], axis=1)
+                unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+                winners = np.array([self.winner(a, b) for a, b in unique.tolist()])
+                resolved[both] = winners[inverse.reshape(-1)]
+                found[hits[both]] = resolved[both]
+            # words left with several candidates, resolved one by one
+            pending = self.duplicated[new] | (resolved == AMBIGUOUS)
+            if tied:
+                pending |= np.isin(hits, list(tied))
+            for i in np.flatnonzero(pending).tolist():
+                position, a = int(hits[i]), int(new[i])
+                candidates = [a] + self.twins.get(a, [])
+                if not first[i]:
+                    candidates += [int(current[i])] + tied.pop(position, [])
+                candidates = self.best(candidates) or candidates
+                found[position] = candidates[0]
+                if len(candidates) > 1:
+                    tied[position] = candidates[1:]
+        found[list(tied)] = AMBIGUOUS
+        return found
+
+    def round_trip(self, words: "np.ndarray", indices: "np.ndarray") -> "np.ndarray":
+        """Positions of the words that do not classify as their instruction."""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        return np.flatnonzero(self.classify(words) != indices)
+
+
+def random_instructions(
+    instr_dict: InstrDict,
+    count: int,
+    xlen: int,
+    seed: int = 0,
+    weights: "Optional[Dict[str, float]]" = None,
+    check: bool = False,
+) -> "np.ndarray":
+    """
+    count random legal instruction words (uint32) of instr_dict, the same
+    for the same seed. With check, every word is classified again and a
+    ValueError raised if one does not decode to the instruction it was
+    drawn for.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    stream = InstrStream(instr_dict, xlen, weights)
+    words, indices = stream.generate(count, np.random.default_rng(seed))
+    if check:
+        mismatches = stream.round_trip(words, indices)
+        if mismatches.size:
+            i = mismatches[0]
+            raise ValueError(
+                f"{mismatches.size} words do not round-trip, e.g. {hex(words[i])} "
+                f"drawn for {stream.names[indices[i]]}"
+            )
+    return words
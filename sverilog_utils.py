@@ -1,30 +1,28 @@
 import logging
 import pprint
-from pathlib import Path
+from typing import Iterator, TextIO
 
-from constants import csrs, csrs32
+from emit_utils import EmitContext, write_chunks
 from shared_utils import InstrDict
 
 pp = pprint.PrettyPrinter(indent=2)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
 
 
+def sverilog_chunks(ctx: EmitContext) -> "Iterator[str]":
+    yield "\n/* Automatically generated by parse_opcodes */\npackage riscv_instr;\n"
+    for i in ctx.instrs:
+        yield f"  localparam [31:0] {i.upper:<18s} = 32'b{i.bitpat};\n"
+    yield "  /* CSR Addresses */\n"
+    for c in ctx.csrs:
+        yield f"  localparam logic [11:0] CSR_{c.upper} = 12'h{c.hex[2:]};\n"
+    yield "\nendpackage\n"
+
+
+def write_sverilog(ctx: EmitContext, out: TextIO):
+    write_chunks(out, sverilog_chunks(ctx))
+
+
 def make_sverilog(instr_dict: InstrDict):
-    names_str = ""
-    for i in instr_dict:
-        names_str += f"  localparam [31:0] {i.upper().replace('.','_'):<18s} = 32'b{instr_dict[i]['encoding'].replace('-','?')};\n"
-    names_str += "  /* CSR Addresses */\n"
-    for num, name in csrs + csrs32:
-        names_str += (
-            f"  localparam logic [11:0] CSR_{name.upper()} = 12'h{hex(num)[2:]};\n"
-        )
-
-    Path("inst.sverilog").write_text(
-        f"""
-/* Automatically generated by parse_opcodes */
-package riscv_instr;
-{names_str}
-endpackage
-""",
-        encoding="utf-8",
-    )
+    with open("inst.sverilog", "w", encoding="utf-8") as sverilog_file:
+        write_sverilog(EmitContext(instr_dict), sverilog_file)
@@ -0,0 +1,146 @@
+import logging
+import os
+import random
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Synthetic extension files for scale testing. Every instruction is a 32-bit
+# encoding (1..0=3) under one of the 32 major opcodes (6..2). The funct7
+# value (31..25) picks one of four layouts, so instructions with different
+# layouts never share their fixed bits and cannot overlap:
+#   f7 % 4 == 0: rd rs1 rs2, 31..25 fixed with a range
+#   f7 % 4 == 1: rd rs1, 31..25 and 24..20 fixed with ranges
+#   f7 % 4 == 2: rd rs1 rs2, 31..25 fixed with a range and a single bit
+#   f7 % 4 == 3: rd rs1, 31..25 fixed with a range, 24..20 with a range
+#                and a single bit
+# Within a layout every (funct7, funct3[, rs2]) value is used once.
+SYNTHETIC_PREFIX = "rv_synth"
+MAJOR_OPCODES = 32
+UNARY_VARIANTS = 32
+OPCODE_CAPACITY = (128 // 2) * 8 * (1 + UNARY_VARIANTS)
+
+# (name, variable fields, fixed bits) of a synthetic instruction
+SyntheticInstr = Tuple[str, str, str]
+
+
+def opcode_encodings(opcode: int) -> "Iterator[Tuple[str, str]]":
+    """
+    Yields the (variable fields, fixed bits) of the instructions that fit
+    under a major opcode, cycling over funct3 first so that every funct3
+    bucket fills up at the same rate.
+    """
+    for f7 in range(128):
+        for f3 in range(8):
+            tail = f"14..12={f3} 6..2=0x{opcode:02x} 1..0=3"
+            layout = f7 % 4
+            if layout == 0:
+                yield "rd rs1 rs2", f"31..25=0x{f7:02x} {tail}"
+            elif layout == 2:
+                yield "rd rs1 rs2", f"31..26=0x{f7 >> 1:02x} 25={f7 & 1} {tail}"
+            else:
+                for rs2 in range(UNARY_VARIANTS):
+                    if layout == 1:
+                        fixed = f"31..25=0x{f7:02x} 24..20={rs2}"
+                    else:
+                        fixed = f"31..25=0x{f7:02x} 24..21={rs2 >> 1} 20={rs2 & 1}"
+                    yield "rd rs1", f"{fixed} {tail}"
+
+
+def opcode_counts(count: int, density: "Optional[Dict[int, float]]") -> "List[int]":
+    """
+    Splits count instructions over the major opcodes proportionally to the
+    density weights (uniform if density is None, missing opcodes get none).
+    """
+    if density is None:
+        density = {opcode: 1.0 for opcode in range(MAJOR_OPCODES)}
+    if any(not 0 <= opcode < MAJOR_OPCODES for opcode in density):
+        raise ValueError(f"Major opcodes must be in [0, {MAJOR_OPCODES})")
+    total = sum(density.values())
+    if total <= 0:
+        raise ValueError("At least one major opcode needs a positive density")
+
+    shares = [
+        count * density.get(opcode, 0.0) / total for opcode in range(MAJOR_OPCODES)
+    ]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(
+        range(MAJOR_OPCODES), key=lambda opcode: counts[opcode] - shares[opcode]
+    )
+    for opcode in by_remainder[: count - sum(counts)]:
+        counts[opcode] += 1
+
+    for opcode, opcode_count in enumerate(counts):
+        if opcode_count > OPCODE_CAPACITY:
+            raise ValueError(
+                f"{opcode_count} instructions do not fit under major opcode "
+                f"{opcode} (at most {OPCODE_CAPACITY})"
+            )
+    return counts
+
+
+def synthesize_isa(
+    count: int,
+    seed: int = 0,
+    density: "Optional[Dict[int, float]]" = None,
+    per_file: int = 500,
+    conflicts: int = 0,
+    pseudo_ops: int = 0,
+    imports: int = 0,
+) -> "Dict[str, List[str]]":
+    """
+    Generates count non-overlapping instructions and spreads them randomly
+    (seeded) over extension files of per_file instructions each. density maps
+    major opcodes (the value of bits 6..2) to relative weights. On top of
+    that, the files get:
+        - conflicts: copies of existing encodings under new names, which
+          create_inst_dict must reject as overlapping;
+        - pseudo_ops: $pseudo_op lines fixing rs2 of a rd rs1 rs2 instruction;
+        - imports: $import lines of instructions of another file.
+    Returns {file name: lines}.
+    """
+    rng = random.Random(seed)
+    instrs: "List[SyntheticInstr]" = []
+    for opcode, opcode_count in enumerate(opcode_counts(count, density)):
+        encodings = opcode_encodings(opcode)
+        for index in range(opcode_count):
+            fields, fixed = next(encodings)
+            instrs.append((f"s{opcode:02d}_{index}", fields, fixed))
+    rng.shuffle(instrs)
+
+    file_count = max(1, -(-count // per_file))
+    file_names = [f"{SYNTHETIC_PREFIX}{i:04d}" for i in range(file_count)]
+    files: "Dict[str, List[str]]" = {name: [] for name in file_names}
+    owner: "Dict[str, str]" = {}
+    for i, (name, fields, fixed) in enumerate(instrs):
+        file_name = file_names[i // per_file]
+        owner[name] = file_name
+        files[file_name].append(f"{name} {fields} {fixed}")
+
+    def other_file(name: str) -> str:
+        candidates = [f for f in file_names if f != owner[name]] or file_names
+        return rng.choice(candidates)
+
+    for i, (name, fields, fixed) in enumerate(rng.sample(instrs, conflicts)):
+        files[other_file(name)].append(f"conflict{i} {fields} {fixed}")
+
+    binary_instrs = [instr for instr in instrs if instr[1] == "rd rs1 rs2"]
+    for name, _fields, fixed in rng.sample(binary_instrs, pseudo_ops):
+        files[other_file(name)].append(
+            f"$pseudo_op {owner[name]}::{name} p_{name} rd rs1 24..20=0 {fixed}"
+        )
+
+    for name, _fields, _fixed in rng.sample(instrs, imports):
+        files[other_file(name)].append(f"$import {owner[name]}::{name}")
+
+    return files
+
+
+def write_isa(directory: str, files: "Dict[str, List[str]]"):
+    """Writes the files returned by synthesize_isa into directory."""
+    os.makedirs(directory, exist_ok=True)
+    for file_name, lines in files.items():
+        with open(os.path.join(directory, file_name), "w", encoding="utf-8") as out:
+            out.write(f"# {file_name}\n\n")
+            out.write("\n".join(lines) + "\n")
+    logging.debug("Wrote %d synthetic extension files to %s", len(files), directory)
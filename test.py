@@ -1,13 +1,78 @@
 #!/usr/bin/env python3
+# pylint: disable=too-many-lines
 
+import asyncio
+import io
+import json
 import logging
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest.mock import Mock, patch
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bench import all_benchmarks, compare_results, measure
+from binary_utils import (
+    HEADER_FORMAT,
+    BinaryInstrDB,
+    encode_binary,
+    load_binary,
+    u32_words,
+)
+from constants import pseudo_regex, single_fixed
+from decoder_utils import (
+    DecoderNode,
+    build_compressed_lut,
+    build_decoder,
+    decode,
+    decoder_costs,
+    exclusive_clashes,
+    expected_cost,
+)
+from diff_utils import InstrDiff, load_db
+from emit_utils import EmitContext, write_chunks
+from isa_utils import (
+    PROFILES,
+    isa_extension_files,
+    isa_selector,
+    parse_isa,
+    profile_extension_files,
+    select_isa,
+)
+from latex_utils import instr_row_layout, latex_row
+from layout_utils import load_histogram
+from matrix_utils import load_matrix, matrix_selector
+from parse import BACKENDS, generate, generate_matrix
+from parse import main as parse_main
+from profile_utils import NULL_SPAN, disable_profiling, enable_profiling, span
+from python_utils import python_chunks
+from query_utils import load_index
+from query_utils import main as query_main
+from service_utils import InstrQueries, QueryService, query
+from shard_utils import ShardedInstrDB
 from shared_utils import (
+    OPCODES_DIR,
     InstrDict,
+    OverlapIndex,
+    add_segmented_vls_insn,
+    arg_lut,
     check_arg_lut,
     check_overlapping_bits,
+    convert_encoding_to_match_mask,
+    create_inst_dict,
+    extension_dependencies,
+    extension_file_names,
     extract_isa_type,
     find_extension_file,
     handle_arg_lut_mapping,
@@ -18,11 +83,17 @@ from shared_utils import (
     parse_instruction_line,
     process_enc_line,
     process_fixed_ranges,
+    process_single_fixed,
     process_standard_instructions,
+    read_lines,
     same_base_isa,
     update_encoding_for_fixed_range,
     validate_bit_range,
 )
+from sqlite_utils import populate_sqlite, write_image
+from stream_utils import AMBIGUOUS, InstrStream, random_instructions
+from synthetic_utils import opcode_counts, synthesize_isa, write_isa
+from watch_utils import InstrDictWatcher
 
 
 class EncodingUtilsTest(unittest.TestCase):
@@ -253,5 +324,1522 @@ class InstructionProcessingTest(unittest.TestCase):
             self.assertIn("sub", instr_dict)
 
 
+class TempDirTestCase(unittest.TestCase):
+    """Base of the tests that work in a temporary directory, self.tmp"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmp.cleanup)
+
+
+class BinaryDatabaseTest(unittest.TestCase):
+    """Tests for the memory-mappable binary instruction database"""
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.instr_dict: InstrDict = dict(
+            [
+                process_enc_line(
+                    "add rd rs1 rs2 31..25=0 14..12=0 6..2=0x0C 1..0=3", "rv_i"
+                ),
+                process_enc_line(
+                    "c.addi rd_rs1_n0 c_nzimm6lo c_nzimm6hi 1..0=1 15..13=0", "rv_c"
+                ),
+            ]
+        )
+        self.instr_dict["add"]["extension"].append("rv32_i")
+
+    def test_round_trip(self):
+        """Test that the image decodes back to the original dictionary"""
+        db = BinaryInstrDB(encode_binary(self.instr_dict))
+        self.assertEqual(len(db), 2)
+        self.assertEqual(db.name(1), "c_addi")
+        self.assertEqual(db.to_instr_dict(), self.instr_dict)
+        db.close()
+
+    def test_words_of_either_host(self):
+        """Test that the u32 words are read as little-endian whatever the host"""
+        words = [1, 0x300, 0x12345678]
+        image = memoryview(struct.pack("<3I", *words))
+        self.assertEqual(u32_words(image).tolist(), words)
+        # as if on a host of the other byte order, the words read here are
+        # the big-endian ones
+        other = "big" if sys.byteorder == "little" else "little"
+        swapped = memoryview(struct.pack(">3I", *words))
+        self.assertEqual(u32_words(swapped, other).tolist(), words)
+
+    def test_sections_aligned(self):
+        """Test that every section starts on an 8 byte boundary"""
+        for count in (1, 2):
+            image = encode_binary(dict(list(self.instr_dict.items())[:count]))
+            offsets = struct.unpack_from(HEADER_FORMAT, image)[-3:]
+            self.assertEqual([offset % 8 for offset in offsets], [0, 0, 0])
+
+    @unittest.skipUnless(numpy, "NumPy is not installed (optional dependency)")
+    def test_close_with_arrays(self):
+        """Test that unmapping fails while NumPy views are alive, then succeeds"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "instr_dict.bin")
+            with open(path, "wb") as f:
+                f.write(encode_binary(self.instr_dict))
+            db = load_binary(path)
+            arrays = db.as_numpy()
+            self.assertEqual(arrays["records"]["match"][0], 0x33)
+            with self.assertRaises(BufferError):
+                db.close()
+            del arrays
+            db.close()
+
+    def test_load_binary(self):
+        """Test memory-mapped loading from a file"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "instr_dict.bin")
+            with open(path, "wb") as f:
+                f.write(encode_binary(self.instr_dict))
+            with load_binary(path) as db:
+                _name, match, mask, *_rest = db.record(0)
+                self.assertEqual(hex(match), self.instr_dict["add"]["match"])
+                self.assertEqual(hex(mask), self.instr_dict["add"]["mask"])
+
+    def test_bad_magic(self):
+        """Test that foreign files are rejected"""
+        with self.assertRaises(SystemExit):
+            BinaryInstrDB(b"\0" * 64)
+
+
+class SqliteExportTest(unittest.TestCase):
+    """Tests for the SQLite export"""
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.conn = sqlite3.connect(":memory:")
+        populate_sqlite(
+            self.conn,
+            dict(
+                [
+                    process_enc_line(
+                        "add rd rs1 rs2 31..25=0 14..12=0 6..2=0x0C 1..0=3", "rv_i"
+                    ),
+                    process_enc_line(
+                        "sub rd rs1 rs2 31..25=0x20 14..12=0 6..2=0x0C 1..0=3", "rv_i"
+                    ),
+                ]
+            ),
+        )
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_decode_view(self):
+        """Test that the decode view finds the matching instruction"""
+        self.conn.execute("INSERT INTO decode_word VALUES (?)", (0x40B50533,))
+        self.assertEqual(
+            self.conn.execute("SELECT name, extension FROM decode").fetchall(),
+            [("sub", "rv_i")],
+        )
+
+    def test_instruction_fields(self):
+        """Test that field order and positions are preserved"""
+        rows = self.conn.execute(
+            "SELECT f.name, f.msb, f.lsb FROM instruction_fields AS x "
+            "JOIN fields AS f ON f.id = x.field_id "
+            "JOIN instructions AS i ON i.id = x.instruction_id "
+            "WHERE i.name = 'add' ORDER BY x.position"
+        ).fetchall()
+        self.assertEqual(rows, [("rd", 11, 7), ("rs1", 19, 15), ("rs2", 24, 20)])
+
+    def test_image_without_serialize(self):
+        """Test that the image is the same where sqlite3 cannot serialize"""
+
+        class BackupOnly:
+            """A connection of a sqlite3 without serialize (Python < 3.11)."""
+
+            def __init__(self, conn: sqlite3.Connection):
+                self.backup = conn.backup
+
+        images = []
+        for source in (self.conn, BackupOnly(self.conn)):
+            out = io.BytesIO()
+            write_image(source, out)  # type: ignore
+            images.append(out.getvalue())
+        self.assertTrue(images[1].startswith(b"SQLite format 3"))
+        dumps = []
+        for image in images:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "instr_dict.sqlite")
+                with open(path, "wb") as f:
+                    f.write(image)
+                conn = sqlite3.connect(path)
+                dumps.append(list(conn.iterdump()))
+                conn.close()
+        self.assertEqual(dumps[0], dumps[1])
+
+
+class StartupTest(unittest.TestCase):
+    """Tests for import cost and working-directory independence"""
+
+    def run_python(self, code: str) -> str:
+        package_dir = os.path.dirname(os.path.realpath(__file__))
+        with tempfile.TemporaryDirectory() as tmp:
+            return subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    f"import sys; sys.path.insert(0, {package_dir!r}); {code}",
+                ],
+                cwd=tmp,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+
+    def test_backends_loaded_lazily(self):
+        """Test that no backend module or lazy table is loaded on import"""
+        loaded = self.run_python(
+            "import parse, constants; "
+            "print(sorted(m for m in parse.BACKENDS.values() if m[0] in sys.modules), "
+            "sorted(t for t in constants._lazy_tables if t in vars(constants)))"
+        )
+        self.assertEqual(loaded.strip(), "[] []")
+
+    def test_tables_loaded_on_import(self):
+        """Test that importing parse.py loads arg_lut and only arg_lut"""
+        loaded = self.run_python(
+            "import parse, constants; "
+            "print(sorted(t for t in ('arg_lut', *constants._lazy_tables) "
+            "if t in vars(constants)))"
+        )
+        self.assertEqual(loaded.strip(), "['arg_lut']")
+
+    def test_imports_without_numpy(self):
+        """Test that the modules and every backend import without NumPy"""
+        loaded = self.run_python(
+            "sys.modules['numpy'] = None; import parse, stream_utils, bench; "
+            "print(len([parse.load_backend(b) for b in parse.BACKENDS]))"
+        )
+        self.assertEqual(int(loaded), len(BACKENDS))
+
+    def test_tables_independent_of_cwd(self):
+        """Test that the CSV tables load from outside the package directory"""
+        count = self.run_python("import constants; print(len(constants.csrs))")
+        self.assertGreater(int(count), 0)
+
+
+class OverlapIndexTest(unittest.TestCase):
+    """Tests for the bucketed overlap candidate lookup"""
+
+    def test_candidates(self):
+        """Test that only compatible buckets are returned, in insertion order"""
+        index = OverlapIndex()
+        index.add("add", "0000000----------000-----0110011")
+        index.add("lui", "-------------------------0110111")
+        index.add("c_addi", "----------------000-----------01")
+        index.add("jalr", "-----------------000-----1100111")
+        self.assertEqual(index.candidates("0100000----------000-----0110011"), ["add"])
+        self.assertEqual(index.candidates("-------------------------0110111"), ["lui"])
+        self.assertEqual(
+            index.candidates("--------------------------------"),
+            ["add", "lui", "c_addi", "jalr"],
+        )
+
+
+class WatchTest(TempDirTestCase):
+    """Tests for the incremental rebuilds of --watch"""
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+        for ext in ("rv_i", "rv_m", "rv_zicsr"):
+            shutil.copy(os.path.join(OPCODES_DIR, ext), self.tmp.name)
+        self.watcher = InstrDictWatcher(["rv*"], False, {"json", "c"}, self.tmp.name)
+
+    def append_line(self, ext: str, line: str):
+        with open(os.path.join(self.tmp.name, ext), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def test_incremental_rebuild(self):
+        """Test that a rebuild re-parses only changed files and matches a full parse"""
+        regenerate, instr_dict, _instr_dict_c = self.watcher.rebuild(
+            self.watcher.poll()
+        )
+        self.assertEqual(regenerate, {"json", "c"})
+        self.assertEqual(
+            instr_dict,
+            dict(sorted(create_inst_dict(["rv*"], opcodes_dir=self.tmp.name).items())),
+        )
+        self.assertEqual(self.watcher.poll(), set())
+
+        self.append_line("rv_m", "mulx rd rs1 rs2 31..25=2 14..12=0 6..2=0x0C 1..0=3")
+        changed = self.watcher.poll()
+        self.assertEqual(changed, {os.path.join(self.tmp.name, "rv_m")})
+        with patch("watch_utils.read_lines", wraps=read_lines) as mock_read:
+            regenerate, instr_dict, _instr_dict_c = self.watcher.rebuild(changed)
+        self.assertEqual(mock_read.call_count, 1)
+        self.assertEqual(regenerate, {"json", "c"})
+        self.assertIn("mulx", instr_dict)
+
+    def test_overlap_after_change(self):
+        """Test that an overlap introduced by an edit is still detected"""
+        self.watcher.rebuild(self.watcher.poll())
+        self.append_line("rv_m", "addx rd rs1 rs2 31..25=0 14..12=0 6..2=0x0C 1..0=3")
+        with self.assertRaises(SystemExit):
+            self.watcher.rebuild(self.watcher.poll())
+        self.watcher.mark_failed()
+        self.assertEqual(self.watcher.poll(), set())
+
+
+class GenerateTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+
+    def test_in_memory_outputs(self):
+        """Test that generate returns the artifacts without writing files"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with patch("os.popen") as mock_popen:
+                    artifacts = generate(["rv_i"], ["c", "rust", "json", "binary"])
+                mock_popen.assert_not_called()
+                self.assertEqual(os.listdir(tmp), [])
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(
+            set(artifacts),
+            {"encoding.out.h", "inst.rs", "instr_dict.json", "instr_dict.bin"},
+        )
+        self.assertIn("#define MATCH_ADD 0x33", artifacts["encoding.out.h"])
+        self.assertIsInstance(artifacts["instr_dict.bin"], bytes)
+        with BinaryInstrDB(artifacts["instr_dict.bin"]) as db:
+            self.assertIn("add", db.to_instr_dict())
+
+    def test_streams(self):
+        """Test that artifacts given a stream are written to it"""
+        stream = io.StringIO()
+        artifacts = generate(["rv_i"], ["go", "json"], streams={"inst.go": stream})
+        self.assertEqual(set(artifacts), {"instr_dict.json"})
+        self.assertTrue(
+            stream.getvalue().startswith(
+                "// Code generated by parse.py; DO NOT EDIT.\n"
+            )
+        )
+        self.assertIn("package riscv", stream.getvalue())
+        self.assertFalse(stream.closed)
+
+    def test_cli_go_header(self):
+        """Test that inst.go written by the command line quotes it"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with patch("sys.argv", ["parse.py", "-go", "rv_i"]):
+                    parse_main()
+                with open("inst.go", encoding="utf-8") as f:
+                    header = f.readline()
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(
+            header, "// Code generated by parse.py -go rv_i; DO NOT EDIT.\n"
+        )
+
+    def test_unknown_backend(self):
+        """Test that unknown backends are rejected"""
+        with self.assertRaises(ValueError):
+            generate(["rv_i"], ["cobol"])
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+
+    def test_measure(self):
+        """Test that measure runs the benchmark and reports statistics"""
+        calls = []
+        stats = measure(lambda: len(calls), calls.append, warmup=2, repeat=3)
+        self.assertEqual(calls, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(stats["repeat"], 3)
+        self.assertLessEqual(stats["min"], stats["median"])
+        self.assertLessEqual(stats["median"], stats["max"])
+        self.assertGreaterEqual(stats["peak_memory"], 0)
+
+    def test_compare_results(self):
+        """Test that only metrics growing beyond the threshold are reported"""
+        baseline = {"benchmarks": {"a": {"median": 1.0, "peak_memory": 100}}}
+        current = {
+            "benchmarks": {
+                "a": {"median": 1.05, "peak_memory": 150},
+                "new": {"median": 9.0, "peak_memory": 9},
+            }
+        }
+        regressions = compare_results(current, baseline, 0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("a peak_memory"))
+
+    def test_all_benchmarks_run(self):
+        """Test that every registered benchmark runs once without failing"""
+        for name, (setup, run) in all_benchmarks().items():
+            with self.subTest(name):
+                run(setup())
+
+
+class SyntheticIsaTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+
+    def test_parses_without_overlaps(self):
+        """Test that the generated instructions are valid and distinct"""
+        files = synthesize_isa(2000, seed=3, per_file=300, pseudo_ops=5, imports=5)
+        self.assertEqual(len(files), 7)
+        write_isa(self.tmp.name, files)
+        instr_dict = create_inst_dict(["rv*"], True, opcodes_dir=self.tmp.name)
+        self.assertEqual(len(instr_dict), 2005)
+        self.assertEqual(sum(len(i["extension"]) > 1 for i in instr_dict.values()), 5)
+
+    def test_seeded(self):
+        """Test that the same seed gives the same files"""
+        self.assertEqual(synthesize_isa(100, seed=1), synthesize_isa(100, seed=1))
+        self.assertNotEqual(synthesize_isa(100, seed=1), synthesize_isa(100, seed=2))
+
+    def test_conflicts_detected(self):
+        """Test that seeded conflicts are rejected by the parser"""
+        write_isa(self.tmp.name, synthesize_isa(200, conflicts=1))
+        with self.assertRaises(SystemExit):
+            create_inst_dict(["rv*"], opcodes_dir=self.tmp.name)
+
+    def test_density(self):
+        """Test that instructions are split according to the density"""
+        counts = opcode_counts(11, {0x0C: 3, 0x04: 1})
+        self.assertEqual((counts[0x0C], counts[0x04], sum(counts)), (8, 3, 11))
+        with self.assertRaises(ValueError):
+            opcode_counts(10**6, {0x0C: 1})
+
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.addCleanup(disable_profiling)
+
+    def test_disabled(self):
+        """Test that spans are no-ops unless profiling is enabled"""
+        self.assertIs(span("read_lines"), NULL_SPAN)
+
+    def test_cli_extensions_after_profile(self):
+        """Test that --profile does not take the extension following it"""
+        with tempfile.TemporaryDirectory() as tmp:
+            trace = os.path.join(tmp, "trace.json")
+            argv = ["parse.py", "--profile-out", trace, "-c", "--profile", "rv_i"]
+            with patch("sys.argv", argv), patch("parse.run") as mock_run, patch(
+                "sys.stdout", io.StringIO()
+            ):
+                parse_main()
+            self.assertEqual(mock_run.call_args.args[0].extensions, ["rv_i"])
+            with open(trace, encoding="utf-8") as f:
+                self.assertIn("traceEvents", json.load(f))
+
+    def test_phases_recorded(self):
+        """Test that parsing records its phases in the trace and summary"""
+        profiler = enable_profiling()
+        with patch.dict("shared_utils._extension_files", clear=True):
+            create_inst_dict(["rv_i"])
+        names = {event["name"] for event in profiler.chrome_trace()["traceEvents"]}
+        self.assertTrue(
+            {"glob", "read_lines", "process_enc_line", "overlap_check"} <= names
+        )
+        self.assertTrue(
+            all(e["ph"] == "X" for e in profiler.chrome_trace()["traceEvents"])
+        )
+        self.assertIn("standard_instructions", profiler.summary())
+        disable_profiling()
+        self.assertIs(span("read_lines"), NULL_SPAN)
+
+
+def legacy_process_enc_line(line: str, ext: str):
+    """process_enc_line as implemented before the single-pass tokenizer"""
+    encoding = initialize_encoding()
+    name, remaining = parse_instruction_line(line)
+    remaining = process_fixed_ranges(remaining, encoding, line)
+    process_single_fixed(remaining, encoding, line)
+    match, mask = convert_encoding_to_match_mask(encoding)
+    args = single_fixed.sub(" ", remaining).split()
+    check_arg_lut(args, encoding.copy(), name)
+    return name, {
+        "encoding": "".join(encoding),
+        "variable_fields": args,
+        "extension": [os.path.basename(ext)],
+        "match": match,
+        "mask": mask,
+    }
+
+
+class EncodingTokenizerTest(unittest.TestCase):
+    def setUp(self):
+        # error messages are compared through assertLogs
+        logger = logging.getLogger()
+        self.addCleanup(setattr, logger, "disabled", logger.disabled)
+        logger.disabled = False
+        self.arg_lut_patcher = patch.dict("shared_utils.arg_lut")
+        self.arg_lut_patcher.start()
+        self.addCleanup(self.arg_lut_patcher.stop)
+
+    def test_bundled_extensions(self):
+        """Test that every bundled encoding line parses as before"""
+        count = 0
+        for file_name in extension_file_names(["rv*", "unratified/rv*"], OPCODES_DIR):
+            for line in read_lines(file_name):
+                if "$import" in line:
+                    continue
+                if "$pseudo" in line:
+                    _ext, _orig, pseudo_inst, content = pseudo_regex.findall(line)[0]
+                    line = f"{pseudo_inst} {content}"
+                self.assertEqual(
+                    process_enc_line(line, file_name),
+                    legacy_process_enc_line(line, file_name),
+                    line,
+                )
+                count += 1
+        self.assertGreater(count, 1000)
+
+    def test_errors(self):
+        """Test that malformed lines are reported with the same messages"""
+        bad_lines = [
+            "foo rd 6..2=0x0D 4..2=1 1..0=3",
+            "foo rd 2..6=1 1..0=3",
+            "foo rd 6..2=0x40 1..0=3",
+            "foo rd 5=1 6..2=0x0D 1..0=3",
+            "foo rd 12=1 12=0 6..2=0 1..0=3",
+            "foo rd rs1 11..7=0 6..2=0 1..0=3",
+            "foo rd rd 6..2=0 1..0=3",
+            "foo rdx 6..2=0 1..0=3",
+            "foo nope=rd 6..2=0 1..0=3",
+        ]
+        for line in bad_lines:
+            messages = []
+            for implementation in (process_enc_line, legacy_process_enc_line):
+                with self.assertLogs(level="ERROR") as logs, self.assertRaises(
+                    SystemExit
+                ):
+                    implementation(line, "rv_i")
+                messages.append(logs.output)
+            self.assertEqual(messages[0], messages[1], line)
+
+    def test_argument_alias(self):
+        """Test that field aliases are added to arg_lut as before"""
+        line = "foo rd=rd_alias rs1 14..12=0 6..2=0 1..0=3"
+        self.assertEqual(
+            process_enc_line(line, "rv_i"), legacy_process_enc_line(line, "rv_i")
+        )
+
+
+class ShardTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+        artifacts = generate(["rv_i", "rv_m", "rv_zicsr", "rv64_i"], ["json", "shards"])
+        self.full = json.loads(artifacts.pop("instr_dict.json"))
+        for filename, data in artifacts.items():
+            os.makedirs(
+                os.path.join(self.tmp.name, os.path.dirname(filename)), exist_ok=True
+            )
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            with open(os.path.join(self.tmp.name, filename), "wb") as out:
+                out.write(data)
+        self.directory = os.path.join(self.tmp.name, "instr_dict")
+
+    def test_round_trip(self):
+        """Test that loading every shard gives back instr_dict.json"""
+        self.assertEqual(ShardedInstrDB(self.directory).load(["*"]), self.full)
+
+    def test_loads_needed_shards_only(self):
+        """Test that only the shards of the requested extensions are read"""
+        db = ShardedInstrDB(self.directory)
+        instr_dict = db.load(["rv_m"])
+        self.assertEqual(set(db.shards), {"rv_m"})
+        self.assertIn("mul", instr_dict)
+        self.assertNotIn("add", instr_dict)
+        self.assertEqual(db.index["shards"]["rv_m"]["count"], len(db.shards["rv_m"]))
+
+    def test_hash_mismatch(self):
+        """Test that a modified shard is rejected"""
+        with open(
+            os.path.join(self.directory, "rv_m.json"), "a", encoding="utf-8"
+        ) as shard:
+            shard.write(" ")
+        with self.assertRaises(SystemExit):
+            ShardedInstrDB(self.directory).load(["rv_m"])
+
+
+class SplitHeaderTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.artifacts = generate(["rv_i", "rv_m", "rv_zicsr"], ["c", "c_split"])
+
+    def test_same_macros(self):
+        """Test that the split headers define the macros of encoding.out.h"""
+        umbrella = set(str(self.artifacts.pop("encoding.out.h")).splitlines())
+        self.assertEqual(
+            set(self.artifacts),
+            {
+                "encoding/common.h",
+                "encoding/csr.h",
+                "encoding/rv_i.h",
+                "encoding/rv_m.h",
+                "encoding/rv_zicsr.h",
+                "encoding/all.h",
+            },
+        )
+        split = {
+            line
+            for header in self.artifacts.values()
+            for line in str(header).splitlines()
+        }
+        for prefix in ("#define MATCH_", "#define CSR_", "#define INSN_", "DECLARE_"):
+            self.assertEqual(
+                {line for line in umbrella if line.startswith(prefix)},
+                {line for line in split if line.startswith(prefix)},
+            )
+        self.assertIn(
+            "DECLARE_INSN(mul, MATCH_MUL, MASK_MUL)", self.artifacts["encoding/rv_m.h"]
+        )
+
+    def test_all_h_declares_once(self):
+        """Test that all.h declares every instruction once, by its owner"""
+        artifacts = generate(["rv_i", "rv_zbb", "rv_zbkb", "rv_m"], ["c", "c_split"])
+        includes = re.findall(
+            r'#include "(rv\w+)\.h"', str(artifacts["encoding/all.h"])
+        )
+        self.assertEqual(includes, ["rv_i", "rv_m", "rv_zbb", "rv_zbkb"])
+        declared = []
+        for ext in includes:
+            header = re.sub(
+                r"#ifndef RISCV_ENCODING_IN_ALL_H\n.*?#endif\n",
+                "",
+                str(artifacts[f"encoding/{ext}.h"]),
+                flags=re.S,
+            )
+            declared += re.findall(r"^DECLARE_INSN\(.*$", header, re.M)
+        self.assertEqual(
+            sorted(declared),
+            sorted(
+                re.findall(r"^DECLARE_INSN\(.*$", artifacts["encoding.out.h"], re.M)
+            ),
+        )
+        self.assertIn(
+            "DECLARE_INSN(andn, MATCH_ANDN, MASK_ANDN)", artifacts["encoding/rv_zbkb.h"]
+        )
+
+    def test_shared_instructions(self):
+        """Test that every extension listing an instruction gets a header"""
+        artifacts = generate(["rv_zbb", "rv_zbkb", "rv_zkn", "rv_zks"], ["c_split"])
+        for ext in ("rv_zbb", "rv_zbkb", "rv_zkn", "rv_zks"):
+            self.assertIn(
+                "DECLARE_INSN(andn, MATCH_ANDN, MASK_ANDN)",
+                artifacts[f"encoding/{ext}.h"],
+            )
+
+    def compile_unit(self, artifacts: "dict[str, object]", source: str):
+        """Compiles source as unit.c next to the generated headers."""
+        with tempfile.TemporaryDirectory() as tmp:
+            for filename, data in artifacts.items():
+                os.makedirs(os.path.join(tmp, os.path.dirname(filename)), exist_ok=True)
+                with open(os.path.join(tmp, filename), "w", encoding="utf-8") as out:
+                    out.write(str(data))
+            with open(os.path.join(tmp, "unit.c"), "w", encoding="utf-8") as out:
+                out.write(source)
+            subprocess.run(
+                ["cc", "-Wall", "-Werror", "-c", "unit.c", "-o", os.devnull],
+                cwd=tmp,
+                check=True,
+            )
+
+    @unittest.skipUnless(shutil.which("cc"), "requires a C compiler")
+    def test_mixed_includes_compile(self):
+        """Test that the split headers can be included with encoding.out.h"""
+        self.compile_unit(
+            self.artifacts,
+            '#include "encoding.out.h"\n#include "encoding/all.h"\n'
+            "int add_match = MATCH_ADD;\n",
+        )
+
+    @unittest.skipUnless(shutil.which("cc"), "requires a C compiler")
+    def test_all_h_compiles_once(self):
+        """Test that expanding all.h gives no duplicate case in a switch"""
+        self.compile_unit(
+            generate(["rv_i", "rv_zbb", "rv_zbkb"], ["c_split"]),
+            '#include "encoding/all.h"\n'
+            "int known(unsigned match) {\n  switch (match) {\n"
+            "#define DECLARE_INSN(name, match, mask) case match: return 1;\n"
+            '#include "encoding/all.h"\n'
+            "#undef DECLARE_INSN\n  }\n  return 0;\n}\n",
+        )
+
+
+class EmitContextTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.ctx = EmitContext(
+            {
+                "c.add": {
+                    "encoding": "1001" + "-" * 10 + "10",
+                    "extension": ["rv_c"],
+                    "match": "0x9002",
+                    "mask": "0xf003",
+                },
+                "sh1add_uw": {
+                    "encoding": "0010000" + "-" * 10 + "010" + "-" * 5 + "0111011",
+                    "extension": ["rv64_zba"],
+                    "match": "0x2000203b",
+                    "mask": "0xfe00707f",
+                },
+                "add": {
+                    "encoding": "0000000" + "-" * 10 + "000" + "-" * 5 + "0110011",
+                    "extension": ["rv_i", "rv_c"],
+                    "match": "0x33",
+                    "mask": "0xfe00707f",
+                },
+            }
+        )
+
+    def test_instruction_symbols(self):
+        """Test the spellings and values of the instruction symbols"""
+        c_add, sh1add_uw, add = (
+            self.ctx.instrs[0],
+            self.ctx.instrs[1],
+            self.ctx.instrs[2],
+        )
+        self.assertEqual((c_add.c_name, c_add.upper), ("c_add", "C_ADD"))
+        self.assertEqual(sh1add_uw.compact, "SH1ADDUW")
+        self.assertEqual((c_add.match, c_add.mask), (0x9002, 0xF003))
+        self.assertEqual(add.bitpat, "0000000" + "?" * 10 + "000" + "?" * 5 + "0110011")
+        self.assertEqual(add.extension, "rv_i")
+
+    def test_grouped_by_owner(self):
+        """Test that instructions are grouped by their owning extension"""
+        self.assertEqual(
+            {
+                ext: [i.name for i in instrs]
+                for ext, instrs in self.ctx.extensions.items()
+            },
+            {"rv_c": ["c.add"], "rv64_zba": ["sh1add_uw"], "rv_i": ["add"]},
+        )
+        self.assertEqual(list(self.ctx.extensions), ["rv64_zba", "rv_c", "rv_i"])
+
+    def test_write_chunks(self):
+        """Test that chunks are written in batches of the buffer size"""
+        out = Mock()
+        write_chunks(out, iter(["ab", "cd", "e", "fghij", "k"]), buffer_size=4)
+        self.assertEqual(
+            [c.args[0] for c in out.write.call_args_list], ["abcd", "efghij", "k"]
+        )
+
+    def test_chisel_extension_order(self):
+        """Test that the Chisel Maps follow the extension names"""
+        chisel = str(
+            generate(["rv_m", "rv_i", "rv64_i", "rv_zicsr"], ["chisel"])["inst.chisel"]
+        )
+        maps = [line.split()[1] for line in chisel.splitlines() if "= Map(" in line]
+        self.assertEqual(maps, ["I64Type", "IType", "MType", "ZICSRType"])
+        self.assertIn('   "MUL"              -> BitPat("b0000001', chisel)
+
+    def test_tables(self):
+        """Test the CSR, cause and field symbols"""
+        self.assertIn((0x300, "mstatus", "MSTATUS", "0x300", False), self.ctx.csrs)
+        self.assertIn((0xC80, "cycleh", "CYCLEH", "0xc80", True), self.ctx.csrs)
+        self.assertIn(
+            (
+                0x2,
+                "illegal instruction",
+                "ILLEGAL_INSTRUCTION",
+                "illegal_instruction",
+                "0x2",
+            ),
+            self.ctx.causes,
+        )
+        self.assertIn(("rd", "RD", 11, 7, "0xf80"), self.ctx.fields)
+
+
+class LatexLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+
+    def test_shared_layout(self):
+        """Test that instructions with the same layout share one row layout"""
+        add = "0000000" + "-" * 10 + "000" + "-" * 5 + "0110011"
+        sub = "0100000" + "-" * 10 + "000" + "-" * 5 + "0110011"
+        layout = instr_row_layout(["rd", "rs1", "rs2"], add)
+        self.assertIs(instr_row_layout(["rd", "rs1", "rs2"], sub), layout)
+        self.assertEqual(
+            latex_row(layout, "SUB", sub),
+            "\\multicolumn{7}{|c|}{0100000} &\n"
+            "\\multicolumn{5}{c|}{rs2} &\n"
+            "\\multicolumn{5}{c|}{rs1} &\n"
+            "\\multicolumn{3}{c|}{000} &\n"
+            "\\multicolumn{5}{c|}{rd} &\n"
+            "\\multicolumn{7}{|c|}{0110011} & SUB \\\\\n"
+            "\\cline{2-33}\n&\n\n",
+        )
+        self.assertIsNot(
+            instr_row_layout(["rd", "rs1"], add[:7] + "00000" + add[12:]), layout
+        )
+
+
+class PythonBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        source = str(
+            generate(["rv_i", "rv_m", "rv_c", "rv_zicsr"], ["python"])["inst.py"]
+        )
+        self.assertNotIn("import", source)
+        self.inst: "dict[str, object]" = {}
+        exec(compile(source, "inst.py", "exec"), self.inst)  # pylint: disable=exec-used
+
+    def test_constants(self):
+        """Test the constants and tables of the generated module"""
+        self.assertEqual(
+            (self.inst["MATCH_ADD"], self.inst["MASK_ADD"]), (0x33, 0xFE00707F)
+        )
+        self.assertEqual(self.inst["CSR_MSTATUS"], 0x300)
+        self.assertEqual(self.inst["CAUSE_BREAKPOINT"], 0x3)
+        self.assertEqual(
+            self.inst["INSTRUCTIONS"]["mul"], (0x2000033, 0xFE00707F, "rv_m")
+        )
+        self.assertEqual(self.inst["CSRS"][0x300], "mstatus")
+
+    def test_decode(self):
+        """Test that the generated decoder finds every instruction"""
+        decode_insn = self.inst["decode"]
+        instructions = self.inst["INSTRUCTIONS"]
+        for name, (match, mask, _ext) in instructions.items():
+            # an overlapping instruction fixing more bits may win, e.g.
+            # c_ebreak for the match of c_add
+            found_match, found_mask, _ext = instructions[decode_insn(match)]
+            self.assertEqual(match & found_mask, found_match, name)
+            self.assertEqual(found_mask & mask, mask, name)
+        self.assertEqual(decode_insn(0x00B50533), "add")
+        self.assertEqual(decode_insn(0x02B50533), "mul")  # mul a0, a0, a1
+        self.assertEqual(decode_insn(0x0505), "c_addi")  # c.addi a0, 1
+        self.assertIsNone(decode_insn(0xFFFFFFFF))
+
+    def test_overlapping_candidates(self):
+        """Test that overlapping instructions are tried most specific first"""
+        tree = build_decoder([(0x7F, 0x13, "addi"), (0xFFFFFFFF, 0x13, "nop")])
+        self.assertNotIsInstance(tree, DecoderNode)
+        self.assertEqual(decode(tree, 0x13), "nop")
+        self.assertEqual(decode(tree, 0x100093), "addi")
+        self.assertIsNone(decode(tree, 0x33))
+
+
+class CompressedLUTTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.instr_dict = create_inst_dict(
+            ["rv_c", "rv32_c", "rv64_c", "rv_c_d", "rv32_c_f", "rv_zcb", "rv64_zcb"]
+        )
+
+    def test_priorities(self):
+        """Test that overlapping instructions are resolved by priority"""
+        lut = build_compressed_lut(self.instr_dict, 64)
+        self.assertEqual(lut.decode(0x0001), "c_nop")
+        self.assertEqual(lut.decode(0x0505), "c_addi")  # c.addi a0, 1
+        self.assertEqual(lut.decode(0x9002), "c_ebreak")
+        self.assertEqual(lut.decode(0x9502), "c_jalr")  # c.jalr a0
+        self.assertEqual(lut.decode(0x952E), "c_add")  # c.add a0, a1
+        self.assertEqual(lut.decode(0x8082), "c_jr")  # ret
+        self.assertEqual(lut.decode(0x9D71), "c_zext_w")
+        self.assertIsNone(lut.decode(0x0003))
+        self.assertEqual(lut.table.typecode, "B")
+
+    def test_xlen_variants(self):
+        """Test that the XLEN-specific encodings decode per XLEN"""
+        lut32 = build_compressed_lut(self.instr_dict, 32)
+        lut64 = build_compressed_lut(self.instr_dict, 64)
+        self.assertEqual(lut32.decode(0x6000), "c_flw")
+        self.assertEqual(lut64.decode(0x6000), "c_ld")
+        self.assertEqual(lut32.decode(0x2001), "c_jal")
+        self.assertEqual(lut64.decode(0x2001), "c_addiw")
+        self.assertIsNone(lut32.decode(0x9D71))
+
+    def test_ambiguous(self):
+        """Test that instructions with the same encoding are rejected"""
+        self.instr_dict["c_twin"] = dict(self.instr_dict["c_lw"])
+        with self.assertRaises(SystemExit):
+            build_compressed_lut(self.instr_dict, 32)
+
+    def test_exclusive_extensions(self):
+        """Test that a table of mutually exclusive extensions is rejected"""
+        instr_dict = create_inst_dict(["rv_c", "rv_c_d", "rv_zcmp"])
+        self.assertIn(("cm_push", "c_fsdsp"), exclusive_clashes(instr_dict, 64))
+        self.assertEqual(exclusive_clashes(self.instr_dict, 64), [])
+        with self.assertRaises(SystemExit):
+            build_compressed_lut(instr_dict, 64)
+        build_compressed_lut(create_inst_dict(["rv_c", "rv_zcmp"]), 64)
+
+
+@unittest.skipUnless(numpy, "NumPy is not installed (optional dependency)")
+class InstrStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.instr_dict = create_inst_dict(
+            ["rv_i", "rv64_i", "rv_m", "rv_c", "rv64_c", "rv32_c", "rv_zcb"]
+        )
+
+    def test_seeded(self):
+        """Test that a seed always gives the same words"""
+        words = random_instructions(self.instr_dict, 1000, seed=7, xlen=64)
+        self.assertEqual(
+            words.tolist(),
+            random_instructions(self.instr_dict, 1000, seed=7, xlen=64).tolist(),
+        )
+        self.assertNotEqual(
+            words.tolist(),
+            random_instructions(self.instr_dict, 1000, seed=8, xlen=64).tolist(),
+        )
+
+    def test_round_trip(self):
+        """Test that every word decodes to the instruction it was drawn for"""
+        stream = InstrStream(self.instr_dict, 64, {"c_lui": 50, "c_addi16sp": 50})
+        words, indices = stream.generate(50000, numpy.random.default_rng(0))
+        self.assertEqual(stream.round_trip(words, indices).size, 0)
+
+        c_lui = words[indices == stream.names.index("c_lui")]
+        self.assertTrue(c_lui.size)
+        rd = (c_lui >> 7) & 0x1F
+        self.assertFalse(((rd == 0) | (rd == 2)).any())
+        self.assertFalse((c_lui & 0x107C == 0).any())
+        compressed = [stream.names.index(n) for n in ("c_lui", "c_addi16sp", "c_mv")]
+        self.assertTrue((words[numpy.isin(indices, compressed)] < 0x10000).all())
+
+    def test_weights(self):
+        """Test that extension and instruction weights select instructions"""
+        stream = InstrStream(
+            self.instr_dict,
+            32,
+            {"rv_m": 1, "mul": 3, "rv_i": 0, "rv_c": 0, "rv32_c": 0, "rv_zcb": 0},
+        )
+        _words, indices = stream.generate(8000, numpy.random.default_rng(0))
+        drawn = {stream.names[i] for i in indices.tolist()}
+        self.assertLessEqual(
+            drawn, {"mul", "mulh", "mulhsu", "mulhu", "div", "divu", "rem", "remu"}
+        )
+        share = (indices == stream.names.index("mul")).mean()
+        self.assertAlmostEqual(share, 0.3, delta=0.03)
+
+    def test_ambiguous_then_resolved(self):
+        """Test that a later match taking priority resolves an ambiguous word"""
+
+        def instr(mask, match):
+            return {
+                "mask": hex(mask),
+                "match": hex(match),
+                "extension": ["rv_i"],
+                "variable_fields": [],
+            }
+
+        stream = InstrStream(
+            {
+                "twin": instr(0x7F, 0x3B),
+                "other_twin": instr(0x7F, 0x3B),
+                "narrow": instr(0x707F, 0x3B),
+            },
+            64,
+        )
+        words = numpy.array([0x3B, 0x103B], dtype=numpy.uint32)
+        self.assertEqual(
+            stream.classify(words).tolist(), [stream.names.index("narrow"), AMBIGUOUS]
+        )
+
+    def test_exclusive_extensions(self):
+        """Test that mutually exclusive extensions sharing encodings are rejected"""
+        with self.assertRaises(ValueError):
+            InstrStream(create_inst_dict(["rv_c", "rv_c_d", "rv_zcmp"]), 64)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires Unix sockets")
+class QueryServiceTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+        for ext in ("rv_i", "rv_m", "rv_c"):
+            shutil.copy(os.path.join(OPCODES_DIR, ext), self.tmp.name)
+        self.path = os.path.join(self.tmp.name, "service.sock")
+
+    def test_queries(self):
+        """Test that the queries agree with the instruction dictionary"""
+        queries = InstrQueries(create_inst_dict(["rv_i", "rv_m", "rv_c"]))
+        add = {"rd": 10, "rs1": 10, "rs2": 11}
+        word = queries.encode({"name": "add", "fields": add})
+        self.assertEqual(word, 0x00B50533)
+        self.assertEqual(
+            queries.decode({"word": hex(word), "xlen": 64}),
+            {"name": "add", "extension": ["rv_i"], "fields": add},
+        )
+        self.assertEqual(queries.decode({"word": 0x952E, "xlen": 32})["name"], "c_add")
+        self.assertIsNone(queries.decode({"word": 0xFFFFFFFF, "xlen": 64}))
+        addi = queries.encode(
+            {"name": "addi", "fields": {"rd": 1, "rs1": 0, "imm12": -1}}
+        )
+        self.assertEqual(addi, 0xFFF00093)
+        self.assertIn("mulhsu", queries.extension({"name": "rv_m"}))
+        self.assertEqual(queries.field({"name": "rd"})["lsb"], 7)
+        self.assertEqual(queries.csr({"name": "mstatus"})["number"], 0x300)
+        self.assertEqual(queries.csr({"number": "0x300"})["name"], "mstatus")
+        self.assertEqual(
+            queries.instruction({"name": "lui"})["fields"],
+            {"rd": [11, 7], "imm20": [31, 12]},
+        )
+
+        for request in (
+            {"op": "encode", "name": "add", "fields": {"rd": 1, "rs1": 2}},
+            {"op": "encode", "name": "add", "fields": {**add, "imm12": 0}},
+            {"op": "encode", "name": "add", "fields": {**add, "rd": 32}},
+            {
+                "op": "encode",
+                "name": "c_lui",
+                "fields": {"rd_n2": 2, "c_nzimm18hi": 0, "c_nzimm18lo": 1},
+            },
+            {"op": "instruction", "name": "nope"},
+            {"op": "nope"},
+            {"op": ["decode"]},
+            {"op": "decode", "word": 0x33},
+            {"op": "decode", "word": 0x33, "xlen": 128},
+        ):
+            self.assertIn("error", queries.answer(request), request)
+
+    def test_encode_snapshot(self):
+        """Test that encode does not read the tables a reload may be rewriting"""
+        queries = InstrQueries(create_inst_dict(["rv_c"]))
+        fields = {"rd_n2": 2, "c_nzimm18hi": 0, "c_nzimm18lo": 0}
+        with patch.dict("constants.arg_lut", clear=True):
+            with self.assertRaisesRegex(ValueError, "reserved"):
+                queries.encode({"name": "c_lui", "fields": fields})
+
+    def test_watch_survives_errors(self):
+        """Test that a reload raising is logged and the watch goes on"""
+        self.logger.disabled = False
+        service = QueryService(["rv*"], False, 0, self.tmp.name)
+        errors = [RuntimeError("boom"), asyncio.CancelledError()]
+        with patch.object(service, "reload", side_effect=errors) as mock_reload:
+            with self.assertLogs(level="ERROR") as logs:
+                with self.assertRaises(asyncio.CancelledError):
+                    asyncio.run(service.watch())
+        self.assertEqual(mock_reload.call_count, 2)
+        self.assertIn("boom", logs.output[0])
+
+    def test_decode_xlen(self):
+        """Test that compressed words decode as the instruction of their XLEN"""
+        queries = InstrQueries(create_inst_dict(["rv_c", "rv32_c_f", "rv64_c"]))
+        self.assertEqual(queries.decode({"word": 0x6000, "xlen": 32})["name"], "c_flw")
+        self.assertEqual(queries.decode({"word": 0x6000, "xlen": 64})["name"], "c_ld")
+
+    def test_socket(self):
+        """Test batches over the socket and reloads after a file changes"""
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            service = QueryService(["rv*"], False, 0.01, self.tmp.name)
+            server = await service.start(self.path)
+            batch = [
+                {"id": 1, "op": "decode", "word": 0x02B50533, "xlen": 64},
+                {"id": 2, "op": "instruction", "name": "mulx"},
+            ]
+            first = await loop.run_in_executor(None, query, self.path, batch)
+            self.assertEqual(
+                first[0], {"id": 1, "result": service.queries.decode(batch[0])}
+            )
+            self.assertEqual(first[0]["result"]["name"], "mul")
+            self.assertIn("error", first[1])
+
+            with open(os.path.join(self.tmp.name, "rv_m"), "a", encoding="utf-8") as f:
+                f.write("mulx rd rs1 rs2 31..25=2 14..12=0 6..2=0x0C 1..0=3\n")
+            for _ in range(500):
+                if service.reloads > 1:
+                    break
+                await asyncio.sleep(0.01)
+            second = await loop.run_in_executor(None, query, self.path, batch[1])
+            self.assertEqual(second["result"]["extension"], ["rv_m"])
+
+            with open(os.path.join(self.tmp.name, "rv_m"), "a", encoding="utf-8") as f:
+                f.write("broken rd rs1 31..25=2\n")
+            await asyncio.sleep(0.1)
+            third = await loop.run_in_executor(None, query, self.path, batch[1])
+            self.assertEqual(third, second)
+
+            server.close()
+            await server.wait_closed()
+            service.watch_task.cancel()
+
+        asyncio.run(scenario())
+
+
+class QueryIndexTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+        for ext in ("rv_i", "rv_m", "rv_c", "rv_zicsr"):
+            shutil.copy(os.path.join(OPCODES_DIR, ext), self.tmp.name)
+        self.path = os.path.join(self.tmp.name, "instr_index.json")
+
+    def load(self):
+        return load_index(["rv*"], False, self.path, self.tmp.name)
+
+    def test_queries(self):
+        """Test that each kind of query agrees with the instruction dictionary"""
+        index = self.load()
+        self.assertEqual(index.query("word", "0x00b50533"), ["add"])
+        self.assertEqual(index.query("word", "0x952e"), ["c_add"])
+        self.assertEqual(index.query("word", "0xffffffff"), [])
+        self.assertEqual(index.query("name", "mulh*"), ["mulh", "mulhsu", "mulhu"])
+        self.assertEqual(len(index.query("extension", "rv_m")), 8)
+        self.assertEqual(
+            index.query("field", "csr"),
+            ["csrrc", "csrrci", "csrrs", "csrrsi", "csrrw", "csrrwi"],
+        )
+        instr_dict = create_inst_dict(["rv*"], opcodes_dir=self.tmp.name)
+        pattern = "-------------------------1110011"
+        self.assertEqual(
+            index.query("pattern", pattern.replace("-", "?")),
+            sorted(n for n, i in instr_dict.items() if i["encoding"][-7:] == "1110011"),
+        )
+        self.assertEqual(
+            index.query("pattern", "0000001------------------0110011"),
+            index.query("extension", "rv_m"),
+        )
+        self.assertEqual(index.query("pattern", "1111111"), [])
+        with self.assertRaises(SystemExit):
+            index.query("pattern", "012")
+
+    def test_reuse(self):
+        """Test that the index is only rebuilt after a file changes"""
+        self.load()
+        with patch("query_utils.create_inst_dict") as mock_create:
+            self.load()
+        mock_create.assert_not_called()
+
+        with open(os.path.join(self.tmp.name, "rv_m"), "a", encoding="utf-8") as f:
+            f.write("mulx rd rs1 rs2 31..25=2 14..12=0 6..2=0x0C 1..0=3\n")
+        self.assertEqual(self.load().query("name", "mulx"), ["mulx"])
+
+    def test_dependency_changed(self):
+        """Test that the index is rebuilt after a file imported from changes"""
+        with open(os.path.join(self.tmp.name, "rv_zmul"), "w", encoding="utf-8") as f:
+            f.write("$import rv_m::mul\n")
+        load_index(["rv_zmul"], False, self.path, self.tmp.name)
+        with open(os.path.join(self.tmp.name, "rv_m"), "a", encoding="utf-8") as f:
+            f.write("mulx rd rs1 rs2 31..25=2 14..12=0 6..2=0x0C 1..0=3\n")
+        with patch(
+            "query_utils.create_inst_dict", wraps=create_inst_dict
+        ) as mock_create:
+            index = load_index(["rv_zmul"], False, self.path, self.tmp.name)
+        mock_create.assert_called_once()
+        self.assertEqual(index.query("name", "*"), ["mul"])
+
+    def test_main(self):
+        """Test the output of parse.py query"""
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            query_main(["word", "0x00b50533", "rv_i", "--index", self.path, "--json"])
+        self.assertEqual(
+            json.loads(out.getvalue())[0]["values"], {"rd": 10, "rs1": 10, "rs2": 11}
+        )
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            query_main(
+                ["--index", self.path, "pattern", "--", "0000001" + "-" * 25, "rv_m"]
+            )
+        self.assertEqual(len(out.getvalue().splitlines()), 8)
+
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.old = create_inst_dict(["rv_i", "rv_m"])
+
+    def changes(self, new: InstrDict) -> "set[tuple[str, str, str]]":
+        diff = InstrDiff(self.old, new)
+        return {(c.kind, c.extension, c.name) for c in diff.changes}
+
+    def test_changes(self):
+        """Test that each kind of change is told apart"""
+        new = json.loads(json.dumps(self.old))
+        new["addx"] = new.pop("add")
+        new["mul"]["extension"] = ["rv_zmmul"]
+        new["divu"]["variable_fields"] = ["rd", "rs1"]
+        del new["and"]
+        new["sub"].update(
+            encoding="0100001----------000-----0110011", match="0x42000033"
+        )
+        new["mulx"] = dict(
+            new["mulh"], encoding="0000011----------001-----0110011", match="0x6001033"
+        )
+        self.assertEqual(
+            self.changes(new),
+            {
+                ("renamed", "rv_i", "addx"),
+                ("moved", "rv_zmmul", "mul"),
+                ("fields", "rv_m", "divu"),
+                ("removed", "rv_i", "and"),
+                ("re-encoded", "rv_i", "sub"),
+                ("added", "rv_m", "mulx"),
+            },
+        )
+        self.assertEqual(self.changes(self.old), set())
+
+    def test_new_overlaps(self):
+        """Test that only overlaps introduced by the new database are flagged"""
+        new = dict(self.old)
+        new["xori_any"] = dict(
+            self.old["xori"], encoding="-----------------100-----0010011", mask="0x707f"
+        )
+        diff = InstrDiff(self.old, new)
+        self.assertEqual(
+            [c.detail for c in diff.changes if c.kind == "overlap"],
+            ["xori_any and xori"],
+        )
+
+    def test_overlaps_as_parsed(self):
+        """Test that overlaps parsing allows are not flagged: other XLEN, pseudo-ops"""
+        new = create_inst_dict(["rv_i", "rv_m"], include_pseudo=True)
+        new.update(create_inst_dict(["rv32_c_f", "rv64_c"]))
+        self.assertIn("c_flw", new)
+        self.assertIn("pause", new)
+        self.assertEqual(
+            [c.detail for c in InstrDiff(self.old, new).changes if c.kind == "overlap"],
+            [],
+        )
+
+    def test_binary(self):
+        """Test that a binary database compares equal to its JSON source"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "instr_dict.bin")
+            with open(path, "wb") as f:
+                f.write(encode_binary(self.old))
+            self.assertEqual(self.changes(load_db(path)), set())
+
+
+class DecoderLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        self.instr_dict = create_inst_dict(["rv_i", "rv64_i", "rv_m", "rv_c", "rv64_c"])
+        self.candidates = [
+            (int(i["mask"], 16), int(i["match"], 16), name)
+            for name, i in self.instr_dict.items()
+        ]
+        self.weights = {"addi": 40.0, "c_addi": 20.0, "lw": 10.0, "c_nop": 1.0}
+
+    def test_same_decoding(self):
+        """Test that the weighted layout decodes every word the same way"""
+        default = build_decoder(self.candidates)
+        weighted = build_decoder(self.candidates, weights=self.weights)
+        words = [0x0001, 0x0505, 0x952E, 0x00B50533, 0x00150513, 0xFFFFFFFF]
+        for mask, match, _name in self.candidates:
+            words.extend((match, match | (~mask & 0xFFFFFFFF)))
+        for word in words:
+            self.assertEqual(decode(weighted, word), decode(default, word), hex(word))
+
+    def test_cost(self):
+        """Test that the hot instructions take fewer tests"""
+        default = build_decoder(self.candidates)
+        weighted = build_decoder(self.candidates, weights=self.weights)
+        self.assertLess(
+            expected_cost(weighted, self.weights), expected_cost(default, self.weights)
+        )
+        self.assertLessEqual(
+            decoder_costs(weighted)["addi"], decoder_costs(default)["addi"] - 1
+        )
+        self.assertEqual(build_decoder(self.candidates, weights={}), default)
+
+    def test_python_module(self):
+        """Test the decoder of a module generated for a histogram"""
+        source = "".join(python_chunks(EmitContext(self.instr_dict), self.weights))
+        inst: "dict[str, object]" = {}
+        exec(compile(source, "inst.py", "exec"), inst)  # pylint: disable=exec-used
+        decode_insn = inst["decode"]
+        self.assertEqual(len(inst["DECODER"]), 3)
+        for word in (0x0001, 0x0505, 0x00B50533, 0x02B50533, 0xFFFFFFFF):
+            self.assertEqual(
+                decode_insn(word),
+                decode(build_decoder(self.candidates), word),
+            )
+
+    def test_histogram(self):
+        """Test that histograms load from JSON and from traces"""
+        with tempfile.TemporaryDirectory() as tmp:
+            trace = os.path.join(tmp, "trace.log")
+            with open(trace, "w", encoding="utf-8") as f:
+                f.write("core   0: 0x80000000 (0x00150513) addi a0, a0, 1\n")
+                f.write("core   0: 0x80000004 (0x0505) c.addi a0, 1\n")
+                f.write("00150513\nffffffff\n")
+            self.assertEqual(
+                load_histogram(trace, self.instr_dict), {"addi": 2.0, "c_addi": 1.0}
+            )
+            counts = os.path.join(tmp, "counts.json")
+            with open(counts, "w", encoding="utf-8") as f:
+                json.dump({"addi": 3, "nope": 1}, f)
+            self.assertEqual(load_histogram(counts, self.instr_dict), {"addi": 3.0})
+
+
+class IsaTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+
+    def test_parse_isa(self):
+        """Test that ISA strings are split into XLEN and extensions"""
+        self.assertEqual(
+            parse_isa("RV64IMAFDC_Zicsr_zba1p0_zbb"),
+            (64, ["i", "m", "a", "f", "d", "c", "zicsr", "zba", "zbb"]),
+        )
+        self.assertEqual(parse_isa("rv32i2p1m_zk"), (32, ["i", "m", "zk"]))
+        self.assertEqual(parse_isa("rv64gczfh"), (64, ["g", "c", "zfh"]))
+        for isa in ("rv128i", "rv64", "rv64mi", "x86"):
+            with self.assertRaises(SystemExit):
+                parse_isa(isa)
+
+    def test_extension_files(self):
+        """Test that ISA strings select the files of their XLEN and implied extensions"""
+        files = isa_extension_files("rv32gc")
+        self.assertIn("rv32_c_f", files)
+        self.assertIn("rv_c_d", files)
+        self.assertIn("rv_zifencei", files)
+        self.assertFalse([f for f in files if f.startswith("rv64")])
+        self.assertNotIn("rv_c_f", isa_extension_files("rv64gc"))
+        self.assertIn("unratified/rv_zalasr", isa_extension_files("rv64i_zalasr"))
+        self.assertEqual(
+            set(isa_extension_files("rv64i_zk"))
+            - set(isa_extension_files("rv64i_zkn_zkr_zkt")),
+            {"rv_zk", "rv64_zk"},
+        )
+        self.assertEqual(
+            profile_extension_files("RVI20U64"), ["rv_system", "rv_i", "rv64_i"]
+        )
+        self.assertIn("rv_zicbo", profile_extension_files("RVA22U64"))
+        self.assertIn("rv_h", profile_extension_files("RVA23S64"))
+        with self.assertRaises(SystemExit):
+            profile_extension_files("RVA99U64")
+
+    def test_zfhmin(self):
+        """Test that Zfhmin selects its half-precision instructions without Zfh"""
+        instr_dict = select_isa("RVA22U64")
+        for name in ("flh", "fsh", "fmv_x_h", "fmv_h_x", "fcvt_s_h", "fcvt_h_d"):
+            self.assertIn(name, instr_dict)
+        self.assertNotIn("fadd_h", instr_dict)
+        self.assertNotIn("fcvt_h_q", select_isa("rv64gc_zfhmin"))
+        self.assertIn("fcvt_h_q", select_isa("rv64gcq_zfhmin"))
+        self.assertLessEqual(
+            set(select_isa("rv64gc_zfhmin")), set(select_isa("rv64gc_zfh"))
+        )
+
+    def test_unresolved_extensions(self):
+        """Test that extensions selecting no file are reported for profiles too"""
+        self.logger.disabled = False
+        with patch.dict(PROFILES, {"RVX64": (64, ("i", "zkt", "zfoo"))}), patch.dict(
+            "isa_utils._resolutions"
+        ):
+            with self.assertLogs(level="WARNING") as logs:
+                profile_extension_files("RVX64")
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("['zfoo'] of RVX64", logs.output[0])
+
+    def test_select(self):
+        """Test that selecting from the parsed bitsets matches parsing the files"""
+        for isa in ("rv32imac_zicsr_zba", "rv64gcv_zk_zfh_zcb", "rv32gc_zfa"):
+            files = isa_extension_files(isa)
+            selector = isa_selector(parse_isa(isa)[0])
+            for pseudo, pseudo_ops in ((False, None), (True, None), (False, ["rev8"])):
+                self.assertEqual(
+                    selector.select(files, pseudo, pseudo_ops),
+                    create_inst_dict(files, pseudo, pseudo_ops),
+                )
+        with self.assertRaises(ValueError):
+            isa_selector(32).select(["rv64_i"])
+
+
+class MatrixTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+
+    def write_matrix(self, configs: "dict[str, dict]") -> str:
+        path = os.path.join(self.tmp.name, "matrix.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(configs, f)
+        return path
+
+    def test_configurations(self):
+        """Test that every configuration is selected as if parsed on its own"""
+        configs = load_matrix(
+            self.write_matrix(
+                {
+                    "small": {"isa": "rv32imc_zicsr"},
+                    "crypto": {
+                        "extensions": ["rv_zkn", "rv_i", "rv64_i"],
+                        "pseudo": True,
+                    },
+                    "vector": {"profile": "RVA23U64"},
+                }
+            )
+        )
+        self.assertEqual(configs["crypto"].files, ["rv_zkn", "rv_i", "rv64_i"])
+        selector = matrix_selector(configs)
+        for config in configs.values():
+            selector.check_overlaps(config.files)
+            self.assertEqual(
+                selector.select(config.files, config.include_pseudo),
+                create_inst_dict(config.files, config.include_pseudo),
+            )
+        self.assertEqual(selector.arg_aliases(configs["small"].files), set())
+        self.assertIn("rs2=rs1", selector.arg_aliases(configs["vector"].files))
+        for invalid in (
+            {"../x": {"isa": "rv32i"}},
+            {"x": {"isa": "rv32i", "xlen": 32}},
+        ):
+            with self.assertRaises(SystemExit):
+                load_matrix(self.write_matrix(invalid))
+
+    def test_overlaps_per_configuration(self):
+        """Test that files only overlapping in another configuration are accepted"""
+        encoding = "rd rs1 rs2 31..25=0x7f 14..12=0 6..2=0x02 1..0=3\n"
+        for name, instr in (("rv_xa", "foo"), ("rv_xb", "bar")):
+            with open(os.path.join(self.tmp.name, name), "w", encoding="utf-8") as f:
+                f.write(f"{instr} {encoding}")
+        configs = load_matrix(
+            self.write_matrix(
+                {
+                    "a": {"extensions": ["rv_xa"]},
+                    "b": {"extensions": ["rv_xb"]},
+                    "ab": {"extensions": ["rv_xa", "rv_xb"]},
+                }
+            ),
+            opcodes_dir=self.tmp.name,
+        )
+        selector = matrix_selector(configs, opcodes_dir=self.tmp.name)
+        selector.check_overlaps(configs["a"].files)
+        selector.check_overlaps(configs["b"].files)
+        with self.assertRaises(SystemExit):
+            selector.check_overlaps(configs["ab"].files)
+
+    def test_generate_matrix(self):
+        """Test that the outputs of each configuration go to its directory"""
+        path = self.write_matrix(
+            {"rv32i": {"isa": "rv32i"}, "rv64gc": {"isa": "rv64gc", "pseudo": True}}
+        )
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            generate_matrix(path, {"json", "rust"})
+        finally:
+            os.chdir(cwd)
+        for name, pseudo in (("rv32i", False), ("rv64gc", True)):
+            files = isa_extension_files(name)
+            self.assertTrue(
+                os.path.exists(os.path.join(self.tmp.name, name, "inst.rs"))
+            )
+            with open(
+                os.path.join(self.tmp.name, name, "instr_dict.json"), encoding="utf-8"
+            ) as f:
+                instr_dict = json.load(f)
+            expected = dict(sorted(create_inst_dict(files, pseudo).items()))
+            self.assertEqual(instr_dict, add_segmented_vls_insn(expected))
+
+    def test_generate_matrix_failure(self):
+        """Test that arg_lut is restored when a configuration fails"""
+        path = self.write_matrix({"rv32i": {"isa": "rv32i"}})
+        with patch.dict("shared_utils.arg_lut", {"rs2=rs1": (19, 15)}), patch(
+            "parse.emit_outputs", side_effect=OSError
+        ):
+            with self.assertRaises(OSError):
+                generate_matrix(path, {"json"})
+            self.assertIn("rs2=rs1", arg_lut)
+
+
+class DependencyTest(TempDirTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.disabled = True
+        super().setUp()
+
+    def write_extension(self, name: str, line: str):
+        with open(os.path.join(self.tmp.name, name), "w", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def test_dependencies_first(self):
+        """Test that the dependencies are listed before the files needing them"""
+        paths = [
+            os.path.relpath(p, OPCODES_DIR)
+            for p in extension_dependencies(
+                [os.path.join(OPCODES_DIR, "rv_zkn")], OPCODES_DIR
+            )
+        ]
+        self.assertEqual(paths[-1], "rv_zkn")
+        self.assertIn("unratified/rv64_zbp", paths)
+        self.assertLess(paths.index("rv_zbb"), paths.index("rv_zbkb"))
+        # rv64_zbb and rv64_zbkb depend on each other
+        self.assertEqual(
+            len(
+                extension_dependencies(
+                    [os.path.join(OPCODES_DIR, "rv64_zbb")], OPCODES_DIR
+                )
+            ),
+            3,
+        )
+
+    def test_cycle_reported_once(self):
+        """Test that files depending on each other are reported once, as a warning"""
+        self.logger.disabled = False
+        with patch("shared_utils._reported_cycles", set()):
+            with self.assertLogs(level="WARNING") as logs:
+                for _ in range(2):
+                    extension_dependencies(
+                        [os.path.join(OPCODES_DIR, "rv64_zbb")], OPCODES_DIR
+                    )
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("rv64_zbb -> rv64_zbkb -> rv64_zbb", logs.output[0])
+
+    def test_small_configuration(self):
+        """Test that only the requested files and their dependencies are read"""
+        with patch("shared_utils.read_lines", wraps=read_lines) as mock_read:
+            instr_dict = create_inst_dict(
+                ["rv_i", "rv32_i", "rv_c", "rv32_c", "rv_zkn"]
+            )
+        read = {os.path.basename(call.args[0]) for call in mock_read.call_args_list}
+        self.assertFalse([name for name in read if name.startswith(("rv_v", "rv_zv"))])
+        self.assertEqual(instr_dict["pack"]["extension"], ["rv_zkn"])
+
+    def test_import_chain(self):
+        """Test that imports of imports resolve, and import cycles are rejected"""
+        self.write_extension(
+            "rv_xa", "foo rd rs1 rs2 31..25=0x7f 14..12=0 6..2=0x02 1..0=3"
+        )
+        self.write_extension("rv_xb", "$import rv_xa::foo")
+        self.write_extension("rv_xc", "$import rv_xb::foo")
+        instr_dict = create_inst_dict(["rv_xc"], opcodes_dir=self.tmp.name)
+        self.assertEqual(instr_dict["foo"]["extension"], ["rv_xc"])
+
+        self.write_extension("rv_xd", "$import rv_xe::bar")
+        self.write_extension("rv_xe", "$import rv_xd::bar")
+        with self.assertRaises(SystemExit):
+            create_inst_dict(["rv_xd"], opcodes_dir=self.tmp.name)
+
+
 if __name__ == "__main__":
     unittest.main()
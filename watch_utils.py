@@ -0,0 +1,248 @@
+import copy
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import constants
+from constants import emitted_pseudo_ops
+from shared_utils import (
+    OPCODES_DIR,
+    InstrDict,
+    OverlapIndex,
+    SingleInstr,
+    add_standard_instruction,
+    extension_file_names,
+    overlap_key,
+    overlaps,
+    process_enc_line,
+    process_imported_instructions,
+    process_pseudo_instructions,
+    read_lines,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:: %(message)s")
+
+# Files next to the scripts that feed the outputs. A change to any of them
+# regenerates every output that embeds CSR, cause or field tables (all but
+# the JSON, sharded JSON and binary dictionaries); arg_lut.csv also forces
+# a re-parse.
+TABLE_FILES = ("arg_lut.csv", "csrs.csv", "csrs32.csv", "causes.csv", "encoding.h")
+
+FileSignature = Tuple[int, int]
+WriteOutputs = Callable[[InstrDict, Optional[InstrDict], Set[str]], None]
+
+
+def file_signature(path: str) -> "Optional[FileSignature]":
+    """Returns (mtime, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def copy_instr(single_dict: SingleInstr) -> SingleInstr:
+    """Copies an instruction so that merging extensions leaves the cache intact."""
+    return {
+        "encoding": single_dict["encoding"],
+        "variable_fields": list(single_dict["variable_fields"]),
+        "extension": list(single_dict["extension"]),
+        "match": single_dict["match"],
+        "mask": single_dict["mask"],
+    }
+
+
+class InstrDictWatcher:
+    """
+    Keeps the parsed extension files in memory and rebuilds the instruction
+    dictionaries incrementally:
+        - only files whose (mtime, size) changed are read and parsed again;
+        - overlaps are only re-validated for instructions of the changed
+          files and for instructions in overlap buckets (see OverlapIndex)
+          that are compatible with them, since every other pair was already
+          validated by the previous build;
+        - only the outputs whose inputs differ from the previous build are
+          reported for regeneration.
+    """
+
+    def __init__(
+        self,
+        file_filter: "list[str]",
+        include_pseudo: bool,
+        outputs: "set[str]",
+        opcodes_dir: str = OPCODES_DIR,
+    ):
+        self.file_filter = file_filter
+        self.include_pseudo = include_pseudo
+        self.outputs = outputs
+        self.opcodes_dir = opcodes_dir
+        self.table_paths = {
+            os.path.join(constants.TABLES_DIR, name) for name in TABLE_FILES
+        }
+        self.signatures: "Dict[str, Optional[FileSignature]]" = {}
+        self.pending_signatures: "Dict[str, Optional[FileSignature]]" = {}
+        self.failed_signatures: "Optional[Dict[str, Optional[FileSignature]]]" = None
+        self.lines: "Dict[str, List[str]]" = {}
+        self.standard: "Dict[str, List[Tuple[str, SingleInstr]]]" = {}
+        self.instr_dict: "Optional[InstrDict]" = None
+        self.instr_dict_c: "Optional[InstrDict]" = None
+
+    def poll(self) -> "set[str]":
+        """Returns the watched paths that changed since the last successful build."""
+        paths = set(extension_file_names(self.file_filter, self.opcodes_dir))
+        paths |= self.table_paths | set(self.signatures)
+        current = {path: file_signature(path) for path in paths}
+        if current == self.failed_signatures:
+            return set()
+        self.pending_signatures = current
+        return {
+            path
+            for path, signature in current.items()
+            if path not in self.signatures or self.signatures[path] != signature
+        }
+
+    def mark_failed(self):
+        """Ignores the pending changes until one of the watched files changes again."""
+        self.failed_signatures = self.pending_signatures
+
+    def rebuild(
+        self, changed: "set[str]"
+    ) -> "tuple[set[str], InstrDict, Optional[InstrDict]]":
+        """
+        Re-parses the changed files and rebuilds the instruction dictionaries.
+        Returns the outputs to regenerate together with the (sorted) main and
+        C dictionaries. State is only updated once the whole build succeeded.
+        """
+        tables_changed = {
+            os.path.basename(path) for path in changed if path in self.table_paths
+        }
+        if tables_changed:
+            constants.reload_tables()
+
+        file_names = extension_file_names(self.file_filter, self.opcodes_dir)
+        files_changed = changed - self.table_paths
+        if "arg_lut.csv" in tables_changed:
+            files_changed |= set(file_names)
+
+        lines = dict(self.lines)
+        standard = dict(self.standard)
+        for path in files_changed:
+            if os.path.exists(path):
+                logging.debug("Parsing changed file: %s", path)
+                lines[path] = read_lines(path)
+                standard[path] = [
+                    process_enc_line(line, path)
+                    for line in lines[path]
+                    if "$import" not in line and "$pseudo" not in line
+                ]
+            else:
+                lines.pop(path, None)
+                standard.pop(path, None)
+
+        changed_keys = {
+            overlap_key(instr["encoding"])
+            for path in files_changed
+            for _name, instr in self.standard.get(path, []) + standard.get(path, [])
+        }
+        touched: "dict[str, bool]" = {}
+
+        def needs_check(key: str) -> bool:
+            if key not in touched:
+                touched[key] = any(overlaps(key, k) for k in changed_keys)
+            return touched[key]
+
+        first_build = self.instr_dict is None
+        standard_dict: InstrDict = {}
+        overlap_index = OverlapIndex()
+        for path in file_names:
+            check_file = first_build or path in files_changed
+            for name, single_dict in standard[path]:
+                add_standard_instruction(
+                    standard_dict,
+                    name,
+                    copy_instr(single_dict),
+                    os.path.basename(path),
+                    overlap_index,
+                    check_file or needs_check(overlap_key(single_dict["encoding"])),
+                )
+
+        def finish(include_pseudo: bool, include_pseudo_ops: "list[str]") -> InstrDict:
+            instr_dict = {name: copy_instr(i) for name, i in standard_dict.items()}
+            for path in file_names:
+                process_pseudo_instructions(
+                    lines[path],
+                    instr_dict,
+                    path,
+                    self.opcodes_dir,
+                    include_pseudo,
+                    include_pseudo_ops,
+                )
+            for path in file_names:
+                process_imported_instructions(
+                    lines[path], instr_dict, path, self.opcodes_dir
+                )
+            return dict(sorted(instr_dict.items()))
+
+        instr_dict = finish(self.include_pseudo, [])
+        instr_dict_c = (
+            finish(False, emitted_pseudo_ops)
+            if self.outputs & {"c", "c_split"}
+            else None
+        )
+
+        regenerate: "set[str]" = set()
+        if instr_dict != self.instr_dict:
+            regenerate |= self.outputs - {"c", "c_split", "latex"}
+        if instr_dict_c != self.instr_dict_c:
+            regenerate |= self.outputs & {"c", "c_split"}
+        if tables_changed:
+            regenerate |= self.outputs - {"json", "binary", "shards"}
+        if any(os.path.dirname(path) == self.opcodes_dir for path in files_changed):
+            # the LaTeX tables are built from ratified extension files only
+            regenerate |= self.outputs & {"latex"}
+
+        self.signatures = self.pending_signatures
+        self.failed_signatures = None
+        self.lines = lines
+        self.standard = standard
+        self.instr_dict = copy.deepcopy(instr_dict)
+        self.instr_dict_c = copy.deepcopy(instr_dict_c)
+        return regenerate, instr_dict, instr_dict_c
+
+
+def watch(
+    file_filter: "list[str]",
+    include_pseudo: bool,
+    outputs: "set[str]",
+    write_outputs: WriteOutputs,
+    interval: float = 1.0,
+    opcodes_dir: str = OPCODES_DIR,
+):
+    """
+    Polls the extension files and CSV tables every interval seconds and
+    rewrites the affected outputs after each change, until interrupted.
+    Errors in the extension files are reported without stopping the watch.
+    """
+    watcher = InstrDictWatcher(file_filter, include_pseudo, outputs, opcodes_dir)
+    logging.info("Watching for changes, press Ctrl-C to stop")
+    try:
+        while True:
+            changed = watcher.poll()
+            if changed:
+                start = time.perf_counter()
+                try:
+                    regenerate, instr_dict, instr_dict_c = watcher.rebuild(changed)
+                    write_outputs(instr_dict, instr_dict_c, regenerate)
+                except SystemExit:
+                    watcher.mark_failed()
+                    logging.error("Generation failed, waiting for further changes")
+                else:
+                    logging.info(
+                        f"{len(changed)} file(s) changed, regenerated "
+                        f"{sorted(regenerate) or 'nothing'} in "
+                        f"{time.perf_counter() - start:.2f}s"
+                    )
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")